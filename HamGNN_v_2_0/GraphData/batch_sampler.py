@@ -0,0 +1,137 @@
+'''
+Descripttion: Batch sampler packing graphs of different sizes into batches with a memory budget.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 04:05:37
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 04:05:37
+'''
+
+import numpy as np
+from torch.utils.data import Sampler, Subset
+from .graph_store import GraphStoreDataset
+
+BUDGET_TYPES = ('atoms', 'edges', 'blocks')
+
+
+def graph_sizes(dataset):
+    """
+    The number of atoms and edges of every graph of the dataset, read from the offsets of a graph store
+    without loading the graphs.
+    @return: two arrays, shape: (len(dataset),)
+    """
+    if isinstance(dataset, Subset):
+        num_atoms, num_edges = graph_sizes(dataset.dataset)
+        indices = np.asarray(dataset.indices, dtype=np.int64)
+        return num_atoms[indices], num_edges[indices]
+    if isinstance(dataset, GraphStoreDataset):
+        return dataset.field_counts('z'), dataset.field_counts('edge_index')
+    num_atoms = np.array([data.num_nodes for data in dataset], dtype=np.int64)
+    num_edges = np.array([data.edge_index.shape[1] for data in dataset], dtype=np.int64)
+    return num_atoms, num_edges
+
+
+def graph_costs(dataset, budget_type: str = 'edges', nao_max: int = None) -> np.ndarray:
+    """
+    The cost of every graph in the units of the budget: the number of atoms, of edges, or of the
+    elements of the on-site and off-site orbital blocks ((atoms + edges) x nao_max^2).
+    """
+    num_atoms, num_edges = graph_sizes(dataset)
+    if budget_type == 'atoms':
+        return num_atoms
+    elif budget_type == 'edges':
+        return num_edges
+    elif budget_type == 'blocks':
+        if nao_max is None:
+            raise ValueError('nao_max is required for the budget type blocks!')
+        return (num_atoms + num_edges)*nao_max**2
+    else:
+        raise NotImplementedError(f'The budget type {budget_type} is not supported, use one of {BUDGET_TYPES}!')
+
+
+class BudgetBatchSampler(Sampler):
+    """
+    Packs graphs into batches whose total cost does not exceed budget, so that many small structures share
+    a step while the largest ones still fit in memory. A graph whose cost exceeds the budget forms a batch
+    of its own.
+
+    With sort=True the graphs are grouped into buckets of bucket_size graphs (all graphs if None) that are
+    sorted by cost before packing, so that graphs of similar size end up in the same batch. With
+    shuffle=True the graphs are shuffled before bucketing, the costs used as sort keys are scaled by a random
+    factor in [1 - jitter, 1 + jitter], and the batches are shuffled after packing, differently in every epoch.
+    The jitter mixes graphs of similar size across neighbouring batches, so the batches are not composed of
+    the same graphs in every epoch even with a single bucket. With sort=False and shuffle=False the graphs keep the order of the dataset.
+
+    Args:
+        costs (np.ndarray): the cost of every graph, see graph_costs.
+        budget (float): the maximum total cost of a batch.
+        shuffle (bool): shuffle the graphs and the batches in every epoch.
+        sort (bool): sort the graphs by cost inside the buckets.
+        bucket_size (int, optional): the number of graphs per bucket.
+        jitter (float): the relative noise of the sort keys when shuffling.
+        seed (int): the seed of the shuffling.
+    """
+
+    def __init__(self, costs: np.ndarray, budget: float, shuffle: bool = False, sort: bool = True,
+                 bucket_size: int = None, jitter: float = 0.1, seed: int = 42):
+        self.costs = np.asarray(costs)
+        self.budget = budget
+        self.shuffle = shuffle
+        self.sort = sort
+        self.bucket_size = bucket_size
+        self.jitter = jitter
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self._batches = None
+
+    def _pack(self) -> list:
+        rng = np.random.RandomState(self.seed + self.epoch)
+        order = rng.permutation(len(self.costs)) if self.shuffle else np.arange(len(self.costs))
+        if self.sort:
+            keys = self.costs.astype(float)
+            if self.shuffle and self.jitter > 0:
+                keys = keys*rng.uniform(1 - self.jitter, 1 + self.jitter, size=len(keys))
+            bucket_size = self.bucket_size or max(len(order), 1)
+            buckets = [order[start:start+bucket_size] for start in range(0, len(order), bucket_size)]
+            order = np.concatenate([bucket[np.argsort(-keys[bucket], kind='stable')] for bucket in buckets]) if buckets else order
+
+        batches, batch, total = [], [], 0
+        for idx in order.tolist():
+            cost = self.costs[idx]
+            if batch and total + cost > self.budget:
+                batches.append(batch)
+                batch, total = [], 0
+            batch.append(idx)
+            total += cost
+        if batch:
+            batches.append(batch)
+        if self.shuffle:
+            batches = [batches[ibatch] for ibatch in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        if self._batches is None:
+            self._batches = self._pack()
+        batches, self._batches = self._batches, None
+        # a new packing in the next epoch if the loader does not call set_epoch
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        if self._batches is None:
+            self._batches = self._pack()
+        return len(self._batches)
+
+    def efficiency(self) -> float:
+        """
+        The packing efficiency, i.e. the fraction of the budget of the batches used by the graphs.
+        """
+        if self._batches is None:
+            self._batches = self._pack()
+        batch_costs = np.array([np.sum(self.costs[batch]) for batch in self._batches])
+        # a graph larger than the budget fills its batch
+        return float(np.sum(batch_costs)/np.sum(np.maximum(batch_costs, self.budget))) if len(batch_costs) > 0 else 0.0
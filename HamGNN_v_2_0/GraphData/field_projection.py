@@ -0,0 +1,59 @@
+'''
+Descripttion: Field projection of the graph data: drop the fields a run does not use before they are collated.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 04:41:19
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 04:41:19
+'''
+
+from torch.utils.data import Subset
+from .graph_store import GraphStoreDataset
+
+# copies of the blocks that HamGNNPlusPlusOut rebuilds from Hon/Hoff and Son/Soff when they are missing
+DERIVED_FIELDS = ('hamiltonian', 'overlap')
+# the Hamiltonians H0 added to the output (add_H0) or used to build the SOC Hamiltonian (add_H_nonsoc)
+H0_FIELDS = ('Hon0', 'Hoff0', 'iHon0', 'iHoff0')
+# the imaginary blocks and the angular momentum matrices of the SOC and spin-constrained Hamiltonians
+SPIN_FIELDS = ('iHon', 'iHoff', 'Lon', 'Loff')
+
+
+def unused_fields(output_params, losses: list = None, metrics: list = None, keep_fields: list = None) -> set:
+    """
+    The fields of the graphs generated by graph_data_gen that are not read by a Hamiltonian model with the
+    output parameters output_params (HamGNN_out). The fields used as targets by the losses and metrics and
+    the fields in keep_fields are kept, except the derived fields that the output head rebuilds.
+    """
+    get = lambda name: output_params[name] if name in output_params else False
+    drop = set(DERIVED_FIELDS)
+    if not (get('add_H0') or get('add_H_nonsoc')):
+        drop.update(H0_FIELDS)
+    if not (get('soc_switch') or get('spin_constrained')):
+        drop.update(SPIN_FIELDS)
+    targets = [loss_dict['target'] for loss_dict in (losses or []) + (metrics or []) if 'target' in loss_dict]
+    drop.difference_update(field for field in targets if field not in DERIVED_FIELDS)
+    drop.difference_update(keep_fields or [])
+    return drop
+
+
+def project_dataset(dataset, drop_fields):
+    """
+    Drop the fields drop_fields of the graphs of the dataset, so that they are neither loaded nor collated.
+    The graphs of in-memory lists are modified in place (freeing their memory) and the graphs of a graph
+    store are read without the dropped fields.
+    @return: the projected dataset
+    """
+    drop_fields = set(drop_fields)
+    if len(drop_fields) == 0:
+        return dataset
+    if isinstance(dataset, Subset):
+        project_dataset(dataset.dataset, drop_fields)
+        return dataset
+    if isinstance(dataset, GraphStoreDataset):
+        dataset.exclude_fields(drop_fields)
+        return dataset
+    for data in dataset:
+        for field_name in drop_fields:
+            if field_name in data:
+                del data[field_name]
+    return dataset
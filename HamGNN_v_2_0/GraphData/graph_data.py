@@ -11,8 +11,9 @@ from torch_geometric.data import Data
 from torch_geometric.loader import DataLoader
 from typing import Union, Callable
 import numpy as np
-from torch.utils.data import random_split, Subset
+from torch.utils.data import random_split, Subset, Dataset
 import os
+from .batch_sampler import BudgetBatchSampler, graph_costs
 
 """
 graph_data_module inherits pl.lightningDatamodule to implement the dataset class,
@@ -21,7 +22,7 @@ which divides the dataset and builds the dataset loader.
 
 
 class graph_data_module(pl.LightningDataModule):
-    def __init__(self, dataset: Union[list, tuple, np.array] = None,
+    def __init__(self, dataset: Union[list, tuple, np.array, Dataset] = None,
                  train_ratio: float = 0.6,
                  val_ratio: float = 0.2,
                  test_ratio: float = 0.2,
@@ -29,7 +30,14 @@ class graph_data_module(pl.LightningDataModule):
                  val_batch_size: int = None,
                  test_batch_size: int = None,
                  split_file : str = None,
-                 num_workers: int = 4):
+                 num_workers: int = 4,
+                 keys: list = None,
+                 batch_budget: float = None,
+                 budget_type: str = 'edges',
+                 nao_max: int = None,
+                 bucket_size: int = None,
+                 jitter: float = 0.1,
+                 shuffle: bool = True):
         super(graph_data_module, self).__init__()
         self.dataset = dataset
         self.train_ratio = train_ratio
@@ -40,6 +48,16 @@ class graph_data_module(pl.LightningDataModule):
         self.val_batch_size = val_batch_size or batch_size
         self.test_batch_size = test_batch_size or self.val_batch_size
         self.num_workers = num_workers
+        # the graph ids of the dataset, used to key the predictions of the test set
+        self.keys = [str(key) for key in keys] if keys is not None else [str(idx) for idx in range(len(dataset))]
+        self.test_keys = None
+        # dynamic batching: pack graphs up to batch_budget atoms, edges or orbital block elements instead of batch_size graphs
+        self.batch_budget = batch_budget
+        self.budget_type = budget_type
+        self.nao_max = nao_max
+        self.bucket_size = bucket_size
+        self.jitter = jitter
+        self.shuffle = shuffle
 
     def setup(self, stage=None):
         """
@@ -54,6 +72,7 @@ class graph_data_module(pl.LightningDataModule):
             self.train_data = Subset(self.dataset, indices=train_idx)
             self.val_data = Subset(self.dataset, indices=val_idx)
             self.test_data = Subset(self.dataset, indices=test_idx)
+            self.test_keys = [self.keys[idx] for idx in test_idx]
         else:
             if stage == 'fit' or stage is None:
                 random_state = np.random.RandomState(seed=42)
@@ -65,17 +84,37 @@ class graph_data_module(pl.LightningDataModule):
                 train_idx = perm[:num_train]
                 val_idx = perm[num_train:num_train+num_val]
                 test_idx = perm[-num_test:]
-                self.train_data = [self.dataset[i] for i in train_idx]
-                self.val_data = [self.dataset[i] for i in val_idx]
-                self.test_data = [self.dataset[i] for i in test_idx]
+                # Subset keeps lazily loaded datasets (e.g. GraphStoreDataset) lazy
+                self.train_data = Subset(self.dataset, indices=train_idx)
+                self.val_data = Subset(self.dataset, indices=val_idx)
+                self.test_data = Subset(self.dataset, indices=test_idx)
+                self.test_keys = [self.keys[idx] for idx in test_idx]
             if stage == 'test':
                 self.test_data = self.dataset
+                self.test_keys = self.keys
+
+    def budget_batch_sampler(self, data, shuffle: bool, sort: bool, name: str):
+        sampler = BudgetBatchSampler(graph_costs(data, self.budget_type, self.nao_max), self.batch_budget,
+                                     shuffle=shuffle, sort=sort, bucket_size=self.bucket_size, jitter=self.jitter)
+        print(f"{name} set: {len(data)} graphs packed into {len(sampler)} batches of at most {self.batch_budget} {self.budget_type}, "
+              f"packing efficiency {100*sampler.efficiency():.1f}%")
+        return sampler
 
     def train_dataloader(self):
+        if self.batch_budget is not None:
+            return DataLoader(self.train_data, batch_sampler=self.budget_batch_sampler(self.train_data, self.shuffle, True, 'Training'),
+                              pin_memory=True, num_workers=self.num_workers)
         return DataLoader(self.train_data, batch_size=self.batch_size, pin_memory=True, num_workers=self.num_workers)
 
     def val_dataloader(self):
+        if self.batch_budget is not None:
+            return DataLoader(self.val_data, batch_sampler=self.budget_batch_sampler(self.val_data, False, True, 'Validation'),
+                              pin_memory=True, num_workers=self.num_workers)
         return DataLoader(self.val_data, batch_size=self.val_batch_size, pin_memory=True, num_workers=self.num_workers)
 
     def test_dataloader(self):
+        if self.batch_budget is not None:
+            # the test graphs keep their order, which the predictions are keyed by
+            return DataLoader(self.test_data, batch_sampler=self.budget_batch_sampler(self.test_data, False, False, 'Test'),
+                              pin_memory=True, num_workers=self.num_workers)
         return DataLoader(self.test_data, batch_size=self.test_batch_size, pin_memory=True, num_workers=self.num_workers)
@@ -0,0 +1,343 @@
+'''
+Descripttion: Sharded, indexed and memory-mapped on-disk store for graph data.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-16 10:12:45
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-16 10:12:45
+'''
+
+"""
+Layout of a graph store directory:
+
+    store/
+        graph_store.json        # index: schema, shards, number of graphs and graph keys
+        shard_00000/
+            offsets.npz         # per-field offsets (num_graphs_in_shard + 1,) along the concat dim
+            Hon.npy             # per-field arrays of all graphs in the shard concatenated along axis 0
+            Hoff.npy
+            ...
+        shard_00001/
+        ...
+        pending/                # graphs appended since the last shard was written (see GraphStoreWriter)
+            00000000.npz        # the arrays of one graph
+            00000000.json       # its key and field specs, written after the .npz
+
+Every field of a graph is stored with its concat dim (the one PyG concatenates when collating,
+e.g. dim 1 for edge_index) moved to axis 0. The .npy files are opened with mmap_mode='r', so
+reading a graph only touches the pages of that graph.
+"""
+
+import os
+import json
+import glob
+import shutil
+import bisect
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from torch_geometric.data import Data
+
+STORE_INDEX_NAME = 'graph_store.json'
+PENDING_DIR_NAME = 'pending'
+STORE_VERSION = 1
+
+
+def is_graph_store(path: str) -> bool:
+    """
+    Check whether path is a directory containing a graph store.
+    """
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, STORE_INDEX_NAME))
+
+
+def _field_to_numpy(data: Data, key: str, value):
+    """
+    Convert a field of a Data object to (array with the concat dim moved to axis 0, field spec).
+    """
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu()
+        cat_dim = data.__cat_dim__(key, value)
+        if value.dim() == 0:
+            return value.numpy().reshape(1), {'kind': 'tensor0d', 'cat_dim': 0}
+        cat_dim = cat_dim % value.dim()
+        return np.moveaxis(value.numpy(), cat_dim, 0), {'kind': 'tensor', 'cat_dim': cat_dim}
+    elif isinstance(value, (bool, int, float, np.integer, np.floating)):
+        return np.asarray(value).reshape(1), {'kind': 'scalar', 'cat_dim': 0}
+    else:
+        raise TypeError(f'The field {key} of type {type(value)} can not be saved in a graph store!')
+
+
+def _numpy_to_field(array: np.ndarray, spec: dict):
+    """
+    Inverse of _field_to_numpy.
+    """
+    if spec['kind'] == 'scalar':
+        return array[0].item()
+    array = torch.from_numpy(np.array(array))
+    if spec['kind'] == 'tensor0d':
+        return array.reshape(())
+    return torch.movedim(array, 0, spec['cat_dim'])
+
+
+class GraphStoreWriter(object):
+    """
+    Writes graphs to a sharded graph store. Graphs are buffered in memory and flushed to a new
+    shard every shard_size graphs; the index file is only replaced after a shard has been
+    completely written, so an interrupted run never leaves a corrupted store behind.
+    An existing store is opened in append mode.
+
+    Every appended graph is also saved to the pending directory of the store right away, so a killed
+    run loses no finished graph: the next writer opened on the store takes the pending graphs back
+    into its buffer and writes them with the next shard. This costs a second write of every graph,
+    which is small compared to the generation of a graph or a prediction; readers only see the
+    graphs of the written shards.
+
+    Usage:
+        with GraphStoreWriter('./graph_store', shard_size=1000) as writer:
+            for key, graph in graphs.items():
+                writer.append(graph, key=key)
+    """
+
+    def __init__(self, store_path: str, shard_size: int = 1000):
+        self.store_path = store_path
+        self.shard_size = shard_size
+        self.buffer = []
+        self.buffer_keys = []
+        if is_graph_store(store_path):
+            with open(os.path.join(store_path, STORE_INDEX_NAME), 'r') as f:
+                self.index = json.load(f)
+            if self.index['version'] != STORE_VERSION:
+                raise ValueError(f"Unsupported graph store version {self.index['version']} in {store_path}!")
+        else:
+            os.makedirs(store_path, exist_ok=True)
+            self.index = {'version': STORE_VERSION, 'num_graphs': 0, 'schema': None, 'shards': [], 'keys': []}
+        self._keys = set(self.index['keys'])
+        self.pending_dir = os.path.join(store_path, PENDING_DIR_NAME)
+        self.pending_files = []
+        self._num_pending = 0
+        self._recover_pending()
+
+    def _recover_pending(self):
+        """
+        Take the graphs left in the pending directory by an interrupted run back into the buffer.
+        """
+        for spec_path in sorted(glob.glob(os.path.join(self.pending_dir, '*.json'))):
+            array_path = spec_path[:-len('.json')] + '.npz'
+            with open(spec_path, 'r') as f:
+                pending = json.load(f)
+            self._num_pending = max(self._num_pending, int(os.path.basename(spec_path)[:-len('.json')]) + 1)
+            if pending['key'] in self._keys:
+                # the run was interrupted after the shard of this graph had been written
+                os.remove(spec_path)
+                os.remove(array_path)
+                continue
+            with np.load(array_path) as arrays:
+                fields = {field_name: arrays[field_name] for field_name in pending['schema']}
+            self._buffer_graph(pending['key'], fields, pending['schema'], [spec_path, array_path])
+
+    def __len__(self):
+        return self.index['num_graphs'] + len(self.buffer)
+
+    def __contains__(self, key):
+        return str(key) in self._keys
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, data: Data, key=None):
+        """
+        Append a graph to the store. key is an optional unique identifier of the graph
+        (e.g. the directory it was generated from); it defaults to the running graph index.
+        """
+        if key is None:
+            key = len(self)
+        key = str(key)
+        if key in self._keys:
+            raise KeyError(f'The graph {key} already exists in {self.store_path}!')
+
+        fields = {}
+        schema = {}
+        for field_name in data.keys() if callable(data.keys) else data.keys:
+            array, spec = _field_to_numpy(data, field_name, data[field_name])
+            spec['dtype'] = array.dtype.str
+            spec['shape'] = list(array.shape[1:])
+            fields[field_name] = array
+            schema[field_name] = spec
+
+        if self.index['schema'] is not None and schema != self.index['schema']:
+            raise ValueError(f'The fields of graph {key} do not match the schema of {self.store_path}!')
+
+        os.makedirs(self.pending_dir, exist_ok=True)
+        pending_name = os.path.join(self.pending_dir, '%08d' % self._num_pending)
+        self._num_pending += 1
+        np.savez(pending_name + '.npz', **fields)
+        # the graph counts as pending once its .json exists
+        with open(pending_name + '.json.tmp', 'w') as f:
+            json.dump({'key': key, 'schema': schema}, f)
+        os.replace(pending_name + '.json.tmp', pending_name + '.json')
+
+        self._buffer_graph(key, fields, schema, [pending_name + '.json', pending_name + '.npz'])
+        if len(self.buffer) >= self.shard_size:
+            self.flush()
+
+    def _buffer_graph(self, key: str, fields: dict, schema: dict, pending_files: list):
+        if self.index['schema'] is None:
+            self.index['schema'] = schema
+        self.buffer.append(fields)
+        self.buffer_keys.append(key)
+        self.pending_files += pending_files
+        self._keys.add(key)
+
+    def flush(self):
+        """
+        Write the buffered graphs to a new shard and update the index.
+        """
+        if len(self.buffer) == 0:
+            return
+        shard_name = 'shard_%05d' % len(self.index['shards'])
+        shard_dir = os.path.join(self.store_path, shard_name)
+        os.makedirs(shard_dir, exist_ok=True)
+
+        offsets = dict()
+        for field_name, spec in self.index['schema'].items():
+            arrays = [fields[field_name] for fields in self.buffer]
+            counts = [len(array) for array in arrays]
+            offsets[field_name] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            np.save(os.path.join(shard_dir, field_name + '.npy'), np.concatenate(arrays, axis=0).astype(np.dtype(spec['dtype'])))
+        np.savez(os.path.join(shard_dir, 'offsets.npz'), **offsets)
+
+        self.index['shards'].append({'name': shard_name, 'num_graphs': len(self.buffer)})
+        self.index['num_graphs'] += len(self.buffer)
+        self.index['keys'] += self.buffer_keys
+        self._write_index()
+        self.buffer = []
+        self.buffer_keys = []
+        for pending_file in self.pending_files:
+            os.remove(pending_file)
+        self.pending_files = []
+
+    def _write_index(self):
+        index_path = os.path.join(self.store_path, STORE_INDEX_NAME)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def close(self):
+        self.flush()
+        shutil.rmtree(self.pending_dir, ignore_errors=True)
+
+
+class GraphStoreDataset(Dataset):
+    """
+    Lazily loaded dataset over a graph store. The shards are memory-mapped on first access
+    (so that every DataLoader worker maps them on its own) and each __getitem__ only
+    reads the slices belonging to the requested graph.
+    """
+
+    def __init__(self, store_path: str):
+        super(GraphStoreDataset, self).__init__()
+        if not is_graph_store(store_path):
+            raise FileNotFoundError(f'{STORE_INDEX_NAME} was not found in {store_path}!')
+        self.store_path = store_path
+        with open(os.path.join(store_path, STORE_INDEX_NAME), 'r') as f:
+            self.index = json.load(f)
+        self.schema = self.index['schema']
+        # the fields read by __getitem__, see exclude_fields
+        self.fields = list(self.schema) if self.schema is not None else []
+        self.keys = self.index['keys']
+        self.shard_starts = np.concatenate([[0], np.cumsum([shard['num_graphs'] for shard in self.index['shards']])]).tolist()
+        self._shards = None
+
+    def __len__(self):
+        return self.index['num_graphs']
+
+    def _open_shards(self):
+        self._shards = []
+        for shard in self.index['shards']:
+            shard_dir = os.path.join(self.store_path, shard['name'])
+            offsets = np.load(os.path.join(shard_dir, 'offsets.npz'))
+            arrays = {field_name: np.load(os.path.join(shard_dir, field_name + '.npy'), mmap_mode='r') for field_name in self.fields}
+            self._shards.append((arrays, {field_name: offsets[field_name] for field_name in self.fields}))
+
+    def exclude_fields(self, field_names):
+        """
+        Do not read the fields field_names of the graphs.
+        """
+        self.fields = [field_name for field_name in self.fields if field_name not in set(field_names)]
+        self._shards = None
+
+    def field_counts(self, field_name: str) -> np.ndarray:
+        """
+        The length of the field along its concat dim for every graph (e.g. the number of atoms for z and
+        the number of edges for edge_index), read from the offsets without loading the graphs.
+        """
+        counts = []
+        for shard in self.index['shards']:
+            offsets = np.load(os.path.join(self.store_path, shard['name'], 'offsets.npz'))[field_name]
+            counts.append(np.diff(offsets))
+        return np.concatenate(counts).astype(np.int64) if counts else np.zeros(0, dtype=np.int64)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f'Graph index {idx} is out of range for a store with {len(self)} graphs!')
+        if self._shards is None:
+            self._open_shards()
+        ishard = bisect.bisect_right(self.shard_starts, idx) - 1
+        local_idx = idx - self.shard_starts[ishard]
+        arrays, offsets = self._shards[ishard]
+
+        fields = dict()
+        for field_name in self.fields:
+            spec = self.schema[field_name]
+            start, end = offsets[field_name][local_idx], offsets[field_name][local_idx+1]
+            fields[field_name] = _numpy_to_field(arrays[field_name][start:end], spec)
+        return Data(**fields)
+
+    def __getstate__(self):
+        # memory maps are not pickled; every worker process maps the shards again
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+
+def convert_npz_to_store(graph_data_path: str, store_path: str, shard_size: int = 1000):
+    """
+    Convert a graph_data.npz file generated by graph_data_gen to a graph store.
+
+    Args:
+        graph_data_path: path of graph_data.npz.
+        store_path: directory of the graph store to be created or appended to.
+        shard_size: number of graphs per shard.
+
+    Returns:
+        The number of graphs written.
+    """
+    graph_data = np.load(graph_data_path, allow_pickle=True)
+    graph_data = graph_data['graph'].item()
+    num_graphs = 0
+    with GraphStoreWriter(store_path, shard_size=shard_size) as writer:
+        for key, graph in graph_data.items():
+            writer.append(graph, key=key)
+            num_graphs += 1
+    return num_graphs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='convert graph_data.npz to a sharded graph store')
+    parser.add_argument('--input', type=str, required=True, help='path of graph_data.npz')
+    parser.add_argument('--output', type=str, required=True, help='directory of the graph store')
+    parser.add_argument('--shard_size', default=1000, type=int, help='number of graphs per shard')
+    args = parser.parse_args()
+
+    num_graphs = convert_npz_to_store(args.input, args.output, shard_size=args.shard_size)
+    print(f'{num_graphs} graphs from {args.input} are saved in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+'''
+Descripttion: Batch inference engine that loads a trained model once and streams the predicted Hamiltonians of many structures to disk.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 02:48:10
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 02:48:10
+'''
+
+import os
+import glob
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+from torch_geometric.data import Batch
+from .GraphData.graph_store import GraphStoreDataset, is_graph_store
+from .GraphData.field_projection import unused_fields, project_dataset
+from .input.config_parsing import read_config
+from .models.Model import Model
+from .models.prediction_writer import split_predictions, PredictionWriter
+from .main import build_model
+
+
+class KeyedGraphs(Dataset):
+    """
+    Pairs the graphs of a dataset (a list, a GraphStoreDataset, ...) with their keys.
+    """
+
+    def __init__(self, graphs, keys=None):
+        super(KeyedGraphs, self).__init__()
+        self.graphs = graphs
+        self.keys = [str(key) for key in keys] if keys is not None else [str(idx) for idx in range(len(graphs))]
+        self.indices = list(range(len(self.graphs)))
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        return self.keys[self.indices[idx]], self.graphs[self.indices[idx]]
+
+    def exclude(self, skip):
+        """
+        Skip the graphs for which skip(key) is True, e.g. the structures predicted by an interrupted run.
+        """
+        self.indices = [idx for idx in range(len(self.graphs)) if not skip(self.keys[idx])]
+        return self
+
+
+def collate_keyed_graphs(items):
+    keys = [key for key, _ in items]
+    return keys, Batch.from_data_list([data for _, data in items])
+
+
+def load_graph_sources(path: str):
+    """
+    Yield the graphs to be predicted as KeyedGraphs, which are processed one after another.
+
+    path can be a graph store, a graph_data.npz file, or a directory containing a graph store,
+    a graph_data.npz file or several *.npz files generated by graph_data_gen. The npz files are only
+    loaded when they are reached, and the keys of the graphs in several npz files are prefixed by the
+    names of the files.
+    """
+    if is_graph_store(path):
+        dataset = GraphStoreDataset(path)
+        yield KeyedGraphs(dataset, dataset.keys)
+        return
+    if os.path.isfile(path):
+        files = [path]
+    elif os.path.isfile(os.path.join(path, 'graph_data.npz')):
+        files = [os.path.join(path, 'graph_data.npz')]
+    else:
+        files = sorted(glob.glob(os.path.join(path, '*.npz')))
+        if len(files) == 0:
+            raise FileNotFoundError(f'No graph store or graph data (*.npz) was found in {path}!')
+    for graph_file in files:
+        prefix = '' if len(files) == 1 else os.path.splitext(os.path.basename(graph_file))[0] + '/'
+        graph_data = np.load(graph_file, allow_pickle=True)['graph'].item()
+        yield KeyedGraphs(list(graph_data.values()), [prefix + str(key) for key in graph_data.keys()])
+
+
+def _as_sources(graphs):
+    if isinstance(graphs, str):
+        return load_graph_sources(graphs)
+    if isinstance(graphs, KeyedGraphs):
+        return [graphs]
+    if isinstance(graphs, GraphStoreDataset):
+        return [KeyedGraphs(graphs, graphs.keys)]
+    if isinstance(graphs, (list, tuple)) and len(graphs) > 0 and isinstance(graphs[0], KeyedGraphs):
+        return graphs
+    return [KeyedGraphs(graphs)]
+
+
+class InferenceEngine(object):
+    """
+    Predicts Hamiltonians with a trained HamGNN model without a Lightning Trainer.
+
+    The model is built from the config and the weights of the checkpoint are loaded once. The output heads
+    are built without the terms that need the DFT Hamiltonians of the structures (zero_point_shift, the
+    band energies and the masks of the loss), so only the input graphs are required. Batches are evaluated
+    under torch.no_grad (unless the outputs are derivatives) and the predictions are split back into the
+    structures of the batch.
+
+    Usage:
+        engine = InferenceEngine(read_config('config.yaml'), checkpoint_path='./model.ckpt')
+        for key, outputs in engine.predict(graphs, batch_size=8):
+            H = outputs['hamiltonian']
+
+    Args:
+        config (EasyDict): the config read by read_config, the same as for training.
+        checkpoint_path (str, optional): the checkpoint of the trained model, config.setup.checkpoint_path if None.
+        device (str, optional): 'cuda' if available by default.
+        outputs (list, optional): the predictions to keep, ['hamiltonian'] (and 'overlap' if the overlap is predicted) by default.
+    """
+
+    def __init__(self, config, checkpoint_path: str = None, device: str = None, outputs: list = None):
+        if config.setup.property.lower() == 'hamiltonian':
+            output_params = config.output_nets.HamGNN_out
+            output_params.zero_point_shift = False
+            output_params.calculate_band_energy = False
+            output_params.get_nonzero_mask_tensor = False
+
+        graph_representation, output_module, post_utility = build_model(config)
+        self.dtype = torch.float32 if config.setup.precision == 32 else torch.float64
+        torch.set_default_dtype(self.dtype)
+        graph_representation.to(self.dtype)
+        output_module.to(self.dtype)
+
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        checkpoint_path = checkpoint_path or config.setup.checkpoint_path
+        self.model = Model.load_from_checkpoint(checkpoint_path=checkpoint_path,
+            representation=graph_representation,
+            output=output_module,
+            post_processing=post_utility,
+            losses=config.losses_metrics.losses,
+            validation_metrics=config.losses_metrics.metrics,
+            map_location=self.device
+            )
+        self.model.to(self.device)
+        self.model.eval()
+
+        # the targets are not needed, only the fields read by the model are loaded
+        self.drop_fields = set()
+        if config.dataset_params.field_projection and config.setup.property.lower() == 'hamiltonian':
+            self.drop_fields = unused_fields(config.output_nets.HamGNN_out, keep_fields=config.dataset_params.keep_fields)
+
+        if outputs is None:
+            outputs = ['hamiltonian']
+            if config.setup.property.lower() == 'hamiltonian' and not config.output_nets.HamGNN_out.ham_only:
+                outputs.append('overlap')
+        self.outputs = outputs
+
+    def predict_batch(self, batch: Batch) -> list:
+        """
+        The predictions of every structure of the batch as numpy arrays, in the order of the batch (see split_predictions).
+        """
+        batch = batch.to(self.device)
+        batch = batch.apply(lambda x: x.to(self.dtype) if x.is_floating_point() else x)
+        with torch.set_grad_enabled(self.model.requires_dr):
+            pred = self.model(batch)
+        return split_predictions(batch, pred, self.outputs)
+
+    def predict(self, graphs, batch_size: int = 1, num_workers: int = 0, skip=None):
+        """
+        Yield (key, predictions) for every structure.
+
+        Args:
+            graphs: a path accepted by load_graph_sources, a GraphStoreDataset, a list of graphs or a (list of) KeyedGraphs.
+            batch_size (int): the number of structures per batch.
+            num_workers (int): the number of DataLoader workers reading the graphs.
+            skip (callable, optional): skip(key) is True for the structures that are not predicted.
+        """
+        for source in _as_sources(graphs):
+            source.graphs = project_dataset(source.graphs, self.drop_fields)
+            if skip is not None:
+                source.exclude(skip)
+            if len(source) == 0:
+                continue
+            loader = DataLoader(source, batch_size=batch_size, shuffle=False, num_workers=num_workers,
+                                collate_fn=collate_keyed_graphs)
+            for keys, batch in loader:
+                for key, result in zip(keys, self.predict_batch(batch)):
+                    yield key, result
+
+    def run(self, graphs, output_path: str, output_format: str = 'store', batch_size: int = 1, num_workers: int = 0,
+            shard_size: int = 1000) -> int:
+        """
+        Predict the structures and stream the predictions to output_path, skipping the structures already there.
+
+        With output_format='store' the predictions are appended to a prediction store (one record per structure
+        holding the predicted arrays as prediction_<name>, readable with PredictionReader); with
+        output_format='npz' every structure gets a prediction_<key>.npz file.
+
+        Returns:
+            The number of structures predicted in this run.
+        """
+        num_predicted = 0
+        if output_format == 'store':
+            with PredictionWriter(output_path, shard_size=shard_size) as writer:
+                for key, result in self.predict(graphs, batch_size=batch_size, num_workers=num_workers, skip=writer.__contains__):
+                    writer.write([key], [{'prediction_'+name: value for name, value in result.items()}])
+                    num_predicted += 1
+        elif output_format == 'npz':
+            os.makedirs(output_path, exist_ok=True)
+            file_name = lambda key: os.path.join(output_path, 'prediction_' + key.replace('/', '_') + '.npz')
+            skip = lambda key: os.path.exists(file_name(key))
+            for key, result in self.predict(graphs, batch_size=batch_size, num_workers=num_workers, skip=skip):
+                np.savez(file_name(key), **result)
+                num_predicted += 1
+        else:
+            raise NotImplementedError(f'The output format {output_format} is not supported!')
+        return num_predicted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch prediction of Hamiltonians with a trained HamGNN model')
+    parser.add_argument('--config', default='config.yaml', type=str, metavar='N')
+    parser.add_argument('--checkpoint', default=None, type=str, help='checkpoint of the model, setup.checkpoint_path by default')
+    parser.add_argument('--input', default=None, type=str, help='graph store, npz file or directory, dataset_params.graph_data_path by default')
+    parser.add_argument('--output', default=None, type=str, help='output path, <train_dir>/prediction by default')
+    parser.add_argument('--format', default='store', type=str, choices=['store', 'npz'], help='graph store or one npz file per structure')
+    parser.add_argument('--batch_size', default=None, type=int, help='dataset_params.batch_size by default')
+    parser.add_argument('--num_workers', default=0, type=int, help='number of workers reading the graphs')
+    parser.add_argument('--shard_size', default=1000, type=int, help='number of structures per shard of the output store')
+    parser.add_argument('--device', default=None, type=str)
+    args = parser.parse_args()
+
+    config = read_config(config_file_name=args.config)
+    graph_data_path = args.input or config.dataset_params.graph_data_path
+    output_path = args.output or os.path.join(config.profiler_params.train_dir, 'prediction')
+    batch_size = args.batch_size or config.dataset_params.batch_size
+
+    engine = InferenceEngine(config, checkpoint_path=args.checkpoint, device=args.device)
+    num_predicted = engine.run(graph_data_path, output_path, output_format=args.format, batch_size=batch_size,
+                               num_workers=args.num_workers, shard_size=args.shard_size)
+    print(f'{num_predicted} structures from {graph_data_path} are predicted and saved in {output_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -42,6 +42,13 @@ config_default_dataset['split_file'] = None
 config_default_dataset['radius'] = 6.0
 config_default_dataset['max_num_nbr'] = 32
 config_default_dataset['graph_data_path'] = './graph_data'
+config_default_dataset['batch_budget'] = None # pack graphs up to this budget instead of batch_size graphs per batch
+config_default_dataset['budget_type'] = 'edges' # 'atoms', 'edges' or 'blocks' ((atoms + edges) x nao_max^2)
+config_default_dataset['bucket_size'] = None # the number of graphs sorted by size together, all graphs if None
+config_default_dataset['jitter'] = 0.1 # relative noise of the sizes sorted when shuffling, so the batches change between epochs
+config_default_dataset['shuffle'] = True # shuffle the training batches of the batch budget
+config_default_dataset['field_projection'] = True # drop the fields of the graphs that the run does not read
+config_default_dataset['keep_fields'] = [] # fields kept by the field projection in any case
 
 config_default_db_params = dict()
 config_default_db_params['db_path'] = './'
@@ -13,6 +13,8 @@ import os
 import e3nn
 from e3nn import o3
 from .GraphData.graph_data import graph_data_module
+from .GraphData.graph_store import GraphStoreDataset, is_graph_store
+from .GraphData.field_projection import unused_fields, project_dataset
 from .input.config_parsing import read_config
 from .models.outputs import (Born, Born_node_vec, scalar, trivial_scalar, Force, 
                             Force_node_vec, crystal_tensor, piezoelectric, total_energy_and_atomic_forces, EPC_output)
@@ -47,7 +49,8 @@ def initialize_output_parameters(output_params):
     default_params = {
         'add_H_nonsoc': False,
         'get_nonzero_mask_tensor': False,
-        'zero_point_shift': True
+        'zero_point_shift': True,
+        'eigen_solver': 'cholesky'
     }
     
     # Set default values for parameters not already defined
@@ -64,21 +67,38 @@ def prepare_data(config):
     batch_size = config.dataset_params.batch_size
     split_file = config.dataset_params.split_file
     graph_data_path = config.dataset_params.graph_data_path
-    if not os.path.isfile(graph_data_path):
-        if not os.path.exists(graph_data_path):
-            os.mkdir(graph_data_path)
-        graph_data_path = os.path.join(graph_data_path, 'graph_data.npz')
-    if os.path.exists(graph_data_path):
-        print(f"Loading graph data from {graph_data_path}!")
+    if is_graph_store(graph_data_path):
+        print(f"Loading graph store from {graph_data_path}!")
+        graph_dataset = GraphStoreDataset(graph_data_path)
+        graph_keys = graph_dataset.keys
     else:
-        print(f'The graph_data.npz file was not found in {graph_data_path}!')
+        if not os.path.isfile(graph_data_path):
+            if not os.path.exists(graph_data_path):
+                os.mkdir(graph_data_path)
+            graph_data_path = os.path.join(graph_data_path, 'graph_data.npz')
+        if os.path.exists(graph_data_path):
+            print(f"Loading graph data from {graph_data_path}!")
+        else:
+            print(f'The graph_data.npz file was not found in {graph_data_path}!')
+
+        graph_data = np.load(graph_data_path, allow_pickle=True)
+        graph_data = graph_data['graph'].item()
+        graph_dataset = list(graph_data.values())
+        graph_keys = list(graph_data.keys())
 
-    graph_data = np.load(graph_data_path, allow_pickle=True)
-    graph_data = graph_data['graph'].item()
-    graph_dataset = list(graph_data.values())
+    # drop the fields that the model and the losses do not read before they are collated
+    if config.dataset_params.field_projection and config.setup.property.lower() == 'hamiltonian':
+        drop_fields = unused_fields(config.output_nets.HamGNN_out, config.losses_metrics.losses, config.losses_metrics.metrics,
+                                    keep_fields=config.dataset_params.keep_fields)
+        print(f"Dropping the unused fields {sorted(drop_fields)} of the graph data!")
+        graph_dataset = project_dataset(graph_dataset, drop_fields)
 
+    nao_max = config.output_nets.HamGNN_out.nao_max if 'nao_max' in config.output_nets.HamGNN_out else None
     graph_dataset = graph_data_module(graph_dataset, train_ratio=train_ratio, val_ratio=val_ratio, test_ratio=test_ratio, 
-                                        batch_size=batch_size, split_file=split_file)
+                                        batch_size=batch_size, split_file=split_file, keys=graph_keys,
+                                        batch_budget=config.dataset_params.batch_budget, budget_type=config.dataset_params.budget_type,
+                                        nao_max=nao_max, bucket_size=config.dataset_params.bucket_size, jitter=config.dataset_params.jitter,
+                                        shuffle=config.dataset_params.shuffle)
     graph_dataset.setup(stage=config.setup.stage)
 
     return graph_dataset
@@ -215,7 +235,8 @@ def build_model(config):
                                          ham_only= output_params.ham_only, symmetrize=output_params.symmetrize,calculate_band_energy=output_params.calculate_band_energy,num_k=output_params.num_k,k_path=output_params.k_path,
                                          band_num_control=output_params.band_num_control, soc_switch=output_params.soc_switch, nonlinearity_type = output_params.nonlinearity_type, add_H0=output_params.add_H0, 
                                          spin_constrained=output_params.spin_constrained, collinear_spin=output_params.collinear_spin, minMagneticMoment=output_params.minMagneticMoment, add_H_nonsoc=output_params.add_H_nonsoc,
-                                         get_nonzero_mask_tensor=output_params.get_nonzero_mask_tensor, zero_point_shift=output_params.zero_point_shift)
+                                         get_nonzero_mask_tensor=output_params.get_nonzero_mask_tensor, zero_point_shift=output_params.zero_point_shift,
+                                         eigen_solver=output_params.eigen_solver)
 
     else:
         print('Evaluation of this property is not supported!')
@@ -311,6 +332,7 @@ def train_and_eval(config):
 
         # Eval
         print("Start eval.")
+        model.prediction_keys = data.test_keys
         results = trainer.test(model, data.test_dataloader())
         # log hyper-parameters in tensorboard.
         hparam_dict = get_hparam_dict(config)
@@ -336,6 +358,7 @@ def train_and_eval(config):
             save_dir=config.profiler_params.train_dir, name="", default_hp_metric=False)
 
         trainer = pl.Trainer(gpus=config.setup.num_gpus, precision=config.setup.precision, logger=tb_logger)
+        model.prediction_keys = data.test_keys
         trainer.test(model=model, datamodule=data)
 
 def HamGNN():
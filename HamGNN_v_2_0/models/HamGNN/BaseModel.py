@@ -14,9 +14,6 @@ import torch.nn as nn
 from torch_scatter import scatter
 from easydict import EasyDict
 
-import warnings
-from ase import geometry, neighborlist
-import numpy as np
 from pymatgen.core.periodic_table import Element
 from typing import List, Union
 
@@ -82,130 +79,145 @@ def get_radii_from_atomic_numbers(atomic_numbers: Union[torch.Tensor, List[int]]
     return [radius_scale * ATOMIC_RADII[radius_type].get(Element.from_Z(z).symbol, DEFAULT_RADIUS) for z in atomic_numbers]
 
 
-def neighbor_list_and_relative_vec(
-    pos,
-    r_max,
-    self_interaction=False,
-    strict_self_interaction=True,
-    cell=None,
-    pbc=False,
-):
-    """Create neighbor list and neighbor vectors based on radial cutoff.
-
-    Edges are given by the following convention:
-    - ``edge_index[0]`` is the *source* (convolution center).
-    - ``edge_index[1]`` is the *target* (neighbor).
-
-    Args:
-        pos (shape [N, 3]): Positional coordinates; Tensor or numpy array.
-        r_max (float): Radial cutoff distance for neighbor finding.
-        cell (numpy shape [3, 3]): Cell for periodic boundary conditions.
-        pbc (bool or 3-tuple of bool): Periodicity in each of the three dimensions.
-        self_interaction (bool): Include same periodic image self-edges.
-        strict_self_interaction (bool): Include any self interaction edges.
+CELL_SHIFT_KEY_BITS = 21
+
+def pack_cell_shift(cell_shift: torch.Tensor) -> torch.Tensor:
+    """
+    Encodes integer cell shifts as int64 keys. The keys keep the lexicographic order of the shifts,
+    so sorting the keys sorts the shifts like torch.unique(cell_shift, dim=0).
+
+    Parameters:
+    - cell_shift (torch.Tensor): Integer cell shifts (any dtype), shape: (..., 3). Every component must lie in [-2**20, 2**20).
+
+    Returns:
+    - torch.Tensor: The int64 keys, shape: (...,).
+    """
+    shift = cell_shift.round().long() if cell_shift.is_floating_point() else cell_shift.long()
+    shift = shift + (1 << (CELL_SHIFT_KEY_BITS - 1))
+    return (shift[..., 0] << (2*CELL_SHIFT_KEY_BITS)) | (shift[..., 1] << CELL_SHIFT_KEY_BITS) | shift[..., 2]
+
+def unpack_cell_shift(keys: torch.Tensor) -> torch.Tensor:
+    """
+    Inverse of pack_cell_shift, returns the int64 cell shifts of shape (..., 3).
+    """
+    mask = (1 << CELL_SHIFT_KEY_BITS) - 1
+    shift = torch.stack([keys >> (2*CELL_SHIFT_KEY_BITS), (keys >> CELL_SHIFT_KEY_BITS) & mask, keys & mask], dim=-1)
+    return shift - (1 << (CELL_SHIFT_KEY_BITS - 1))
+
+def cell_list_neighbor_search(pos: torch.Tensor, cell: torch.Tensor, batch: torch.Tensor, radii: torch.Tensor, 
+                              self_interaction: bool = False):
+    """
+    Periodic neighbor search with a linked-cell list, vectorized over all structures of a batch and run on the device of pos.
+    Atoms i and j are neighbors if |pos[j] - pos[i] + shift @ cell| < radii[i] + radii[j], which is the criterion of
+    ase.neighborlist.primitive_neighbor_list with a list of cutoffs.
+
+    Every cell is divided into bins that are at least as wide as the largest cutoff of its structure, so the neighbors
+    of an atom are in the adjacent bins (or in several periodic images of them if the cell is thinner than the cutoff).
+
+    Parameters:
+    - pos (torch.Tensor): Cartesian coordinates of all atoms in the batch, shape: (Natoms, 3).
+    - cell (torch.Tensor): Lattice vectors (in rows) of every structure, shape: (Nbatch, 3, 3).
+    - batch (torch.Tensor): The structure index of every atom, shape: (Natoms,).
+    - radii (torch.Tensor): The cutoff radius of every atom, shape: (Natoms,).
+    - self_interaction (bool): Include the edges from an atom to itself in the same cell.
 
     Returns:
-        edge_index (torch.Tensor [2, num_edges]): List of edges.
-        shifts (torch.Tensor [num_edges, 3]): Relative cell shift vectors.
-        cell_tensor (torch.Tensor [3, 3]): Cell tensor.
+    - edge_index (torch.Tensor): The edges (source, target) with global atom indices, shape: (2, Nedges).
+    - shifts (torch.Tensor): The integer cell shifts of the targets, shape: (Nedges, 3).
     """
-    if isinstance(pbc, bool):
-        pbc = (pbc,) * 3
-
-    # Handle positional data
-    if isinstance(pos, torch.Tensor):
-        temp_pos = pos.detach().cpu().numpy()
-        out_device = pos.device
-        out_dtype = pos.dtype
-    else:
-        temp_pos = np.asarray(pos)
-        out_device = torch.device("cpu")
-        out_dtype = torch.get_default_dtype()
-
-    if out_device.type != "cpu":
-        warnings.warn(
-            "Currently, neighborlists require a round trip to the CPU. Please pass CPU tensors if possible."
-        )
-
-    # Handle cell data
-    if isinstance(cell, torch.Tensor):
-        temp_cell = cell.detach().cpu().numpy()
-        cell_tensor = cell.to(device=out_device, dtype=out_dtype)
-    elif cell is not None:
-        temp_cell = np.asarray(cell)
-        cell_tensor = torch.as_tensor(temp_cell, device=out_device, dtype=out_dtype)
-    else:
-        temp_cell = np.zeros((3, 3), dtype=temp_pos.dtype)
-        cell_tensor = torch.as_tensor(temp_cell, device=out_device, dtype=out_dtype)
-
-    temp_cell = geometry.complete_cell(temp_cell)
-
-    # Generate neighbor list
-    first_index, second_index, shifts = neighborlist.primitive_neighbor_list(
-        "ijS",
-        pbc,
-        temp_cell,
-        temp_pos,
-        cutoff=r_max,
-        self_interaction=strict_self_interaction,
-        use_scaled_positions=False,
-    )
-
-    # Filter self-edges
+    device = pos.device
+    num_graphs = len(cell)
+    cell = cell.type_as(pos)
+    radii = radii.type_as(pos)
+
+    # bins of every structure
+    r_cut = 2.0*scatter(radii, batch, dim=0, dim_size=num_graphs, reduce='max') # (Nbatch,)
+    volume = torch.linalg.det(cell).abs()
+    face_dist = volume.unsqueeze(-1)/torch.linalg.norm(torch.cross(cell[:, [1, 2, 0]], cell[:, [2, 0, 1]], dim=-1), dim=-1) # (Nbatch, 3)
+    num_bins = torch.clamp(torch.floor(face_dist/r_cut.unsqueeze(-1)), min=1).long() # (Nbatch, 3)
+    # search range in bins, the same for all structures
+    num_images = torch.ceil(r_cut.unsqueeze(-1)*num_bins/face_dist).long().amax(dim=0).tolist()
+    bins_per_graph = num_bins.prod(dim=-1)
+    bin_offset = torch.cumsum(bins_per_graph, dim=0) - bins_per_graph
+
+    def flat_bin_index(bin3, graph):
+        nb = num_bins[graph]
+        return bin_offset[graph] + (bin3[:, 0]*nb[:, 1] + bin3[:, 1])*nb[:, 2] + bin3[:, 2]
+
+    # wrap the atoms into the cells and sort them by bins
+    frac = torch.einsum('ni, nij -> nj', pos, torch.linalg.inv(cell)[batch])
+    offset = torch.floor(frac)
+    frac = frac - offset
+    offset = offset.long()
+    atom_bin3 = torch.minimum((frac*num_bins[batch]).long(), num_bins[batch] - 1)
+    atom_bin = flat_bin_index(atom_bin3, batch)
+    order = torch.argsort(atom_bin)
+    bin_count = torch.bincount(atom_bin, minlength=int(bins_per_graph.sum()))
+    bin_start = torch.cumsum(bin_count, dim=0) - bin_count
+
+    # candidate bins of every atom
+    disp = torch.cartesian_prod(*[torch.arange(-n, n + 1, device=device) for n in num_images]) # (Nd, 3)
+    num_disp = len(disp)
+    nbr_bin3 = (atom_bin3.unsqueeze(1) + disp.unsqueeze(0)).reshape(-1, 3)
+    nbr_graph = batch.repeat_interleave(num_disp)
+    image = torch.div(nbr_bin3, num_bins[nbr_graph], rounding_mode='floor')
+    nbr_bin = flat_bin_index(nbr_bin3 - image*num_bins[nbr_graph], nbr_graph)
+
+    # candidate pairs: every atom in a candidate bin
+    counts = bin_count[nbr_bin]
+    candidate = torch.arange(len(nbr_bin), device=device).repeat_interleave(counts)
+    local_index = torch.arange(len(candidate), device=device) - (torch.cumsum(counts, dim=0) - counts)[candidate]
+    first_index = candidate//num_disp
+    second_index = order[bin_start[nbr_bin][candidate] + local_index]
+    shifts = image[candidate] + offset[first_index] - offset[second_index]
+
+    vec = pos[second_index] - pos[first_index] + torch.einsum('ni, nij -> nj', shifts.type_as(pos), cell[batch[first_index]])
+    keep_edge = torch.linalg.norm(vec, dim=-1) < radii[first_index] + radii[second_index]
     if not self_interaction:
-        bad_edge = first_index == second_index
-        bad_edge &= np.all(shifts == 0, axis=1)
-        keep_edge = ~bad_edge
-        if not np.any(keep_edge):
-            raise ValueError("No edges remain after eliminating self-edges.")
-        first_index = first_index[keep_edge]
-        second_index = second_index[keep_edge]
-        shifts = shifts[keep_edge]
-
-    # Build output
-    edge_index = torch.vstack(
-        (torch.LongTensor(first_index), torch.LongTensor(second_index))
-    ).to(device=out_device)
-
-    shifts = torch.as_tensor(
-        shifts,
-        dtype=torch.long,
-        device=out_device,
-    )
-
-    return edge_index, shifts, cell_tensor
+        keep_edge &= ~((first_index == second_index) & (shifts == 0).all(dim=-1))
+
+    edge_index = torch.stack([first_index[keep_edge], second_index[keep_edge]])
+    return edge_index, shifts[keep_edge]
 
 def find_matching_columns_of_A_in_B(A, B):
     """
-    Finds matching columns between two matrices A and B.
+    Finds matching columns between two edge matrices A and B, whose rows are (source, target, shift_x, shift_y, shift_z).
+    The columns are encoded as int64 keys, so the matching only needs a sort of B and a binary search.
 
     Parameters:
-    - A (torch.Tensor): First matrix.
-    - B (torch.Tensor): Second matrix.
+    - A (torch.Tensor): First matrix, shape: (5, num_cols_A).
+    - B (torch.Tensor): Second matrix, shape: (5, num_cols_B).
 
     Returns:
-    - torch.Tensor: Indices of matching columns in B.
+    - torch.Tensor: Indices of matching columns in B, shape: (num_cols_A,).
     """
     assert A.shape[0] == B.shape[0], "The number of rows in A and B must be the same."
     assert A.shape[-1] <= B.shape[-1], "Please increase radius_scale factor!"
 
-    # Transpose A and B to treat columns as rows for comparison
-    A_rows = A.T.unsqueeze(1)  # Shape: (num_cols_A, 1, num_rows)
-    B_rows = B.T.unsqueeze(0)  # Shape: (1, num_cols_B, num_rows)
-
-    # Compare each row of A with each row of B
-    matches = torch.all(A_rows == B_rows, dim=-1)  # Shape: (num_cols_A, num_cols_B)
+    num_cols_A = A.shape[-1]
+    AB = torch.cat([A, B], dim=-1).long()
+    if num_cols_A == 0:
+        return torch.zeros((0,), dtype=torch.long, device=A.device)
+    # (source, target, compact index of the cell shift) packed into one key
+    _, cell_index = torch.unique(pack_cell_shift(AB[2:].t()), return_inverse=True)
+    num_nodes = int(AB[:2].max()) + 1
+    keys = (AB[0]*num_nodes + AB[1])*(int(cell_index.max()) + 1) + cell_index
+    keys_A, keys_B = keys[:num_cols_A], keys[num_cols_A:]
 
-    # Find the indices where the rows match
-    matching_indices = matches.nonzero(as_tuple=True)[1]  # Take the second element of the tuple
+    sorted_keys_B, order = torch.sort(keys_B)
+    position = torch.clamp(torch.searchsorted(sorted_keys_B, keys_A), max=len(sorted_keys_B) - 1)
+    assert bool((sorted_keys_B[position] == keys_A).all()), "Please increase radius_scale factor!"
 
-    return matching_indices
+    return order[position]
 
 class BaseModel(nn.Module):
     def __init__(self, radius_type: str = 'openmx', radius_scale: float = 1.5) -> None:
         super().__init__()
         self.radius_type = radius_type
         self.radius_scale = radius_scale
+        # scaled cutoff radii indexed by the atomic number
+        atomic_radii = [0.0] + get_radii_from_atomic_numbers(list(range(1, 119)), radius_scale=radius_scale, radius_type=radius_type)
+        self.register_buffer('atomic_radii', torch.tensor(atomic_radii), persistent=False)
 
     def forward(self, data):
         raise NotImplementedError
@@ -216,39 +228,15 @@ class BaseModel(nn.Module):
     ):
         graph = EasyDict()
 
-        node_counts = scatter(torch.ones_like(data.batch), data.batch, dim=0).detach()
-
         latt_batch = data.cell.detach().reshape(-1, 3, 3)
-        pos_batch = data.pos.detach()
-
-        pos_batch = torch.split(pos_batch, node_counts.tolist(), dim=0)
-        z_batch = torch.split(data.z.detach(), node_counts.tolist(), dim=0)
-        
-        nbr_shift = []
-        edge_index = []
-        cell_shift = []
-
-        for idx_xtal, pos in enumerate(pos_batch):
-            edge_index_temp, shifts_tmp, _ = neighbor_list_and_relative_vec(
-                pos,
-                r_max=get_radii_from_atomic_numbers(z_batch[idx_xtal], radius_scale=self.radius_scale, radius_type=self.radius_type),
-                self_interaction=False,
-                strict_self_interaction=True,
-                cell=latt_batch[idx_xtal],
-                pbc=True,
-            )
-            nbr_shift_temp = torch.einsum('ni, ij -> nj',  shifts_tmp.type_as(pos), latt_batch[idx_xtal])
-            
-            if idx_xtal > 0:
-                edge_index_temp += node_counts[idx_xtal - 1]
-
-            edge_index.append(edge_index_temp)
-            cell_shift.append(shifts_tmp)
-            nbr_shift.append(nbr_shift_temp)
-
-        edge_index = torch.cat(edge_index, dim=-1).type_as(data.edge_index)
-        cell_shift = torch.cat(cell_shift, dim=0).type_as(data.cell_shift)
-        nbr_shift = torch.cat(nbr_shift, dim=0).type_as(data.nbr_shift)
+        pos = data.pos.detach()
+
+        edge_index, cell_shift = cell_list_neighbor_search(pos, latt_batch, data.batch, self.atomic_radii[data.z], self_interaction=False)
+        nbr_shift = torch.einsum('ni, nij -> nj', cell_shift.type_as(pos), latt_batch[data.batch[edge_index[0]]])
+
+        edge_index = edge_index.type_as(data.edge_index)
+        cell_shift = cell_shift.type_as(data.cell_shift)
+        nbr_shift = nbr_shift.type_as(data.nbr_shift)
 
         matching_edges = find_matching_columns_of_A_in_B(torch.cat([data.edge_index, data.cell_shift.t()], dim=0), 
                                                       torch.cat([edge_index, cell_shift.t()], dim=0))
@@ -10,7 +10,7 @@ import torch
 from torch import nn
 from typing import Any, Callable, Dict, List, Optional, Type, Union, Tuple
 import numpy as np
-from .BaseModel import BaseModel
+from .BaseModel import BaseModel, pack_cell_shift, unpack_cell_shift
 from e3nn import o3
 from ..layers import GaussianSmearing, BesselBasis, cuttoff_envelope, CosineCutoff
 from ..basis import (
@@ -46,6 +46,7 @@ from pymatgen.core.structure import Structure
 from pymatgen.symmetry.kpath import KPathSeek
 from e3nn.math import soft_unit_step
 from ..utils import blockwise_2x2_concat, extract_elements_above_threshold, upgrade_tensor_precision
+from ..eigen_solver import GeneralizedEigenSolver
 
 au2ang = 0.5291772083
 
@@ -341,7 +342,8 @@ class HamGNNPlusPlusOut(nn.Module):
                  collinear_spin: bool = False,
                  zero_point_shift: bool = False,
                  add_H_nonsoc: bool = False,
-                 get_nonzero_mask_tensor: bool = False):
+                 get_nonzero_mask_tensor: bool = False,
+                 eigen_solver: str = 'cholesky'):
         
         super().__init__()
 
@@ -404,6 +406,8 @@ class HamGNNPlusPlusOut(nn.Module):
         self.calculate_band_energy = calculate_band_energy
         self.num_k = num_k
         self.k_path = k_path
+        # Reduction of the generalized eigenproblem: 'cholesky' or 'lowdin'
+        self.eigen_solver = eigen_solver
         
         # Other parameters
         self.add_quartic = False
@@ -418,9 +422,11 @@ class HamGNNPlusPlusOut(nn.Module):
         
         self._set_basis_info()
         self._init_irreps()
+        self._init_basis_tables()
         
         # self.cg_cal = ClebschGordan()
         self.cg_cal = ClebschGordanCoefficients(max_l=self.ham_irreps.lmax)
+        self._init_merge_map()
 
         # hamiltonian                        
         self.onsitenet_h = self._create_ham_layer(irreps_in=irreps_in_node, irreps_out=self.ham_irreps)
@@ -533,6 +539,50 @@ class HamGNNPlusPlusOut(nn.Module):
         else:
             raise NotImplementedError(f"Hamiltonian type '{self.ham_type}' is not supported.")
 
+    def _init_basis_tables(self):
+        """
+        Build the lookup tables indexed by the atomic number once instead of on every forward call.
+        They are registered as non-persistent buffers, so they follow the module to its device
+        without being saved in the checkpoints.
+        """
+        if not hasattr(self, 'basis_def'):
+            return
+        # key is the atomic number, value is the index of the occupied orbits.
+        basis_definition = torch.zeros((99, self.nao_max), dtype=torch.long)
+        for k in self.basis_def.keys():
+            basis_definition[k][self.basis_def[k]] = 1
+        self.register_buffer('basis_definition', basis_definition, persistent=False)
+        
+        # Orbital masks of the blocks of all pairs of the supported species, shape: (Nspecies+1, Nspecies+1, nao_max**2).
+        # The last species is reserved for the atomic numbers missing from basis_def, whose masks are all zero.
+        species = sorted(self.basis_def.keys())
+        species_index = torch.full((99,), len(species), dtype=torch.long)
+        species_index[species] = torch.arange(len(species))
+        species_orb = torch.cat([basis_definition[species], torch.zeros((1, self.nao_max), dtype=torch.long)]).bool()
+        species_pair_mask = species_orb[:, None, :, None] & species_orb[None, :, None, :]
+        self.register_buffer('species_index', species_index, persistent=False)
+        self.register_buffer('species_pair_mask', species_pair_mask.reshape(len(species)+1, len(species)+1, -1), persistent=False)
+        
+        # number of valence electrons
+        num_valence = torch.zeros((99,), dtype=torch.long)
+        if hasattr(self, 'num_valence'):
+            for k in self.num_valence.keys():
+                num_valence[k] = self.num_valence[k]
+        self.register_buffer('num_valence_table', num_valence, persistent=False)
+        
+        # number of bands of each element in the band energy loss
+        band_num_win = torch.zeros((99,), dtype=torch.long)
+        if isinstance(self.band_num_control, dict):
+            for k in self.band_num_control.keys():
+                band_num_win[k] = self.band_num_control[k]
+        self.register_buffer('band_num_win_table', band_num_win, persistent=False)
+
+    def pair_mask(self, z_row, z_col):
+        """
+        Orbital masks of the (z_row, z_col) blocks, shape: (N, nao_max**2), looked up from the species pair table.
+        """
+        return self.species_pair_mask[self.species_index[z_row], self.species_index[z_col]]
+
     def _set_openmx_basis(self):
         """
         Sets basis information for 'openmx' Hamiltonian.
@@ -1027,12 +1077,17 @@ class HamGNNPlusPlusOut(nn.Module):
             resnet=True
         )
 
-    def matrix_merge(self, sph_split):   
+    def _init_merge_map(self):
         """
-        Incorporate irreducible representations into matrix blocks
+        Compile the inverse spherical tensor products that incorporate the irreps into matrix blocks, followed by
+        change_index, into a block-dense linear map. The (li, lj) blocks sharing the same pair of angular momenta are contracted by one batched
+        matmul with a (n_i*n_j, n_i*n_j) matrix, and a single gather puts every element at its final
+        (reordered and sign-flipped) position in the flattened nao_max**2 block.
         """
-        block = torch.zeros(sph_split[0].shape[0], self.nao_max, self.nao_max).type_as(sph_split[0])
+        ham_irreps_dim = self.ham_irreps_dim.tolist()
+        irreps_start = np.cumsum([0] + ham_irreps_dim)
         
+        groups = dict() # (li, lj) -> (input indices of every block, output positions of every block)
         idx = 0 #index for accessing the correct irreps
         start_i = 0
         for _, li in self.row:
@@ -1040,20 +1095,56 @@ class HamGNNPlusPlusOut(nn.Module):
             start_j = 0
             for _, lj in self.col:
                 n_j = 2*lj.l+1
-                for L in range(abs(li.l-lj.l), li.l+lj.l+1):
-                    #compute inverse spherical tensor product             
-                    cg = math.sqrt(2*L+1)*self.cg_cal(li.l, lj.l, L).unsqueeze(0)
-                    product = (cg*sph_split[idx].unsqueeze(-2).unsqueeze(-2)).sum(-1)
-
-                    #add product to appropriate part of the block
-                    blockpart = block.narrow(-2,start_i,n_i).narrow(-1,start_j,n_j)
-                    blockpart += product
-
-                    idx += 1
+                in_index, out_index = groups.setdefault((li.l, lj.l), ([], []))
+                in_index.append(np.arange(irreps_start[idx], irreps_start[idx] + n_i*n_j))
+                out_index.append(((start_i + np.arange(n_i))[:,None]*self.nao_max + (start_j + np.arange(n_j))[None,:]).reshape(-1))
+                idx += 2*min(li.l, lj.l) + 1
                 start_j += n_j
             start_i += n_i
-            
-        return block.reshape(-1, self.nao_max*self.nao_max)
+        
+        self.merge_groups = []
+        out_positions = []
+        for (l1, l2), (in_index, out_index) in groups.items():
+            # the irreps of a block are ordered by L = |l1-l2|, ..., l1+l2
+            cg = [math.sqrt(2*L+1)*self.cg_cal(l1, l2, L).reshape((2*l1+1)*(2*l2+1), 2*L+1).T for L in range(abs(l1-l2), l1+l2+1)]
+            name = f'{l1}_{l2}'
+            self.register_buffer(f'merge_index_{name}', torch.LongTensor(np.stack(in_index)), persistent=False)
+            self.register_buffer(f'merge_cg_{name}', torch.cat(cg, dim=0).float(), persistent=False)
+            self.merge_groups.append(name)
+            out_positions.append(np.concatenate(out_index))
+        out_positions = np.concatenate(out_positions)
+        
+        # position of every element of the merged block in the concatenated outputs of the groups
+        merge_perm = np.zeros((self.nao_max**2,), dtype=np.int64)
+        merge_perm[out_positions] = np.arange(len(out_positions))
+        # fold in change_index: H_new[a, b] = sign[a]*sign[b]*H_old[index_change[a], index_change[b]]
+        index_change = np.arange(self.nao_max) if getattr(self, 'index_change', None) is None else self.index_change.numpy()
+        merge_perm = merge_perm[(index_change[:,None]*self.nao_max + index_change[None,:]).reshape(-1)]
+        self.register_buffer('merge_perm', torch.LongTensor(merge_perm), persistent=False)
+        if hasattr(self, 'minus_index'):
+            sign = torch.ones(self.nao_max)
+            sign[self.minus_index] = -1.0
+            self.register_buffer('merge_sign', (sign[:,None]*sign[None,:]).reshape(-1), persistent=False)
+        else:
+            self.merge_sign = None
+
+    def matrix_merge_fused(self, sph):
+        """
+        Incorporate irreducible representations into matrix blocks in the orbital order of the DFT code.
+        The block of every (li, lj) pair is the sum over L of sqrt(2L+1)*CG(li, lj, L) contracted with its irreps.
+        
+        :param sph: the irreps of all blocks, shape: (N, ham_irreps.dim)
+        :return: the flattened blocks, shape: (N, nao_max**2)
+        """
+        blocks = []
+        for name in self.merge_groups:
+            in_index = getattr(self, f'merge_index_{name}') # shape: (Nblocks_in_group, n_i*n_j)
+            cg = getattr(self, f'merge_cg_{name}').type_as(sph) # shape: (n_i*n_j, n_i*n_j)
+            blocks.append(torch.matmul(sph[:, in_index], cg).reshape(sph.shape[0], -1))
+        block = torch.cat(blocks, dim=-1)[:, self.merge_perm]
+        if self.merge_sign is not None:
+            block = block*self.merge_sign.type_as(block)
+        return block
 
     def matrix_2rank_merge(self, sph_split):   
         """
@@ -1268,30 +1359,19 @@ class HamGNNPlusPlusOut(nn.Module):
         Nbatch = cell.shape[0]
         
         # parse the Atomic Orbital Basis Sets
-        basis_definition = torch.zeros((99, self.nao_max)).type_as(data.z)
-        # key is the atomic number, value is the index of the occupied orbits.
-        for k in self.basis_def.keys():
-            basis_definition[k][self.basis_def[k]] = 1
-            
-        orb_mask = basis_definition[data.z] # shape: [Natoms, nao_max] 
+        orb_mask = self.basis_definition[data.z] # shape: [Natoms, nao_max] 
         orb_mask = torch.split(orb_mask, data.node_counts.tolist(), dim=0) # shape: [natoms, nao_max]
         orb_mask_batch = []
         for idx in range(Nbatch):
             orb_mask_batch.append(orb_mask[idx].reshape(-1, 1)* orb_mask[idx].reshape(1, -1)) # shape: [natoms*nao_max, natoms*nao_max]
         
         # set the number of valence electrons
-        num_val = torch.zeros((99,)).type_as(data.z)
-        for k in self.num_valence.keys():
-            num_val[k] = self.num_valence[k]
-        num_val = num_val[data.z] # shape: [Natoms]
+        num_val = self.num_valence_table[data.z] # shape: [Natoms]
         num_val = scatter(num_val, data.batch, dim=0) # shape: [Nbatch]
                 
         # Initialize band_num_win
         if self.band_num_control is not None:
-            band_num_win = torch.zeros((99,)).type_as(data.z)
-            for k in self.band_num_control.keys():
-                band_num_win[k] = self.band_num_control[k]
-            band_num_win = band_num_win[data.z] # shape: [Natoms,]   
+            band_num_win = self.band_num_win_table[data.z] # shape: [Natoms,]   
             band_num_win = scatter(band_num_win, data.batch, dim=0) # shape: (Nbatch,)
              
         # Separate Hon and Hoff for each batch
@@ -1381,15 +1461,12 @@ class HamGNNPlusPlusOut(nn.Module):
                 dSK = dSK.reshape(self.num_k, norbs, norbs, 3)            
             
             # Calculate band energies
-            L = torch.linalg.cholesky(SK)
-            L_t = torch.transpose(L.conj(), dim0=-1, dim1=-2)
-            L_inv = torch.linalg.inv(L)
-            L_t_inv = torch.linalg.inv(L_t)
-            Hs = torch.bmm(torch.bmm(L_inv, HK), L_t_inv)
+            solver = GeneralizedEigenSolver(SK, method=self.eigen_solver)
+            Hs = solver.reduce(HK)
             orbital_energies, orbital_coefficients = torch.linalg.eigh(Hs)        
             
             # Convert the wavefunction coefficients back to the original basis
-            orbital_coefficients = torch.einsum('ijk, ika -> iaj', L_t_inv, orbital_coefficients)
+            orbital_coefficients = solver.back_transform(orbital_coefficients).transpose(-1, -2) # shape: (num_k, Nbands, norbs)
             
             # Numpy
             """
@@ -1446,6 +1523,52 @@ class HamGNNPlusPlusOut(nn.Module):
             H_sym = torch.cat(H_sym, dim=0) # shape:(Nbatch*num_k*norbs*norbs)
             return band_energy, wavefunction, gap, H_sym   
 
+    def bloch_sum(self, Mon, Moff, data, vector_dim: int = None):
+        """
+        Fourier transform the on-site and off-site blocks of all structures in the batch to all of their
+        k-points at once: M(k) = sum_R M(R)exp(2*pi*i*k*R). All blocks are accumulated by a single index_add
+        into a flat buffer holding the natoms*natoms atom pairs of every structure, so there is no loop
+        over the structures or the k-points.
+
+        Args:
+            Mon: on-site blocks, shape: (Natoms, nao_max**2) or (Natoms, nao_max**2, vector_dim)
+            Moff: off-site blocks, shape: (Nedges, nao_max**2) or (Nedges, nao_max**2, vector_dim)
+            data: the batch, data.k_vecs has the shape (Nbatch, num_k, 3)
+            vector_dim: the length of vector elements, e.g. 3 for dS
+
+        Returns:
+            A list of the complex matrices of every structure, shape: (num_k, natoms*nao_max, natoms*nao_max[, vector_dim])
+        """
+        j, i = data.edge_index
+        node_counts = data.node_counts
+        node_counts_shift = torch.cumsum(node_counts, dim=0) - node_counts
+        pair_counts = node_counts*node_counts
+        pair_counts_shift = torch.cumsum(pair_counts, dim=0) - pair_counts
+        tail = (self.nao_max, self.nao_max) if vector_dim is None else (self.nao_max, self.nao_max, vector_dim)
+        
+        # Bloch phases of all edges at the k-points of their own structure
+        batch_j = data.batch[j]
+        coe = torch.exp(2j*torch.pi*torch.sum(data.nbr_shift[:,None,:]*data.k_vecs[batch_j], dim=-1)) # (nedges, 1, 3)*(nedges, num_k, 3) -> (nedges, num_k)
+        Moff = Moff.reshape(-1, 1, *tail)*coe.reshape(*coe.shape, *([1]*len(tail))) # shape: (Nedges, num_k, *tail)
+        Mon = Mon.reshape(-1, 1, *tail).type_as(Moff).expand(-1, self.num_k, *tail) # shape: (Natoms, num_k, *tail)
+        
+        # Row of every (j, i) atom pair in the flat buffer
+        na = torch.arange(data.z.shape[0]).type_as(j) - node_counts_shift[data.batch]
+        index_on = pair_counts_shift[data.batch] + na*node_counts[data.batch] + na
+        index_off = pair_counts_shift[batch_j] + (j - node_counts_shift[batch_j])*node_counts[batch_j] + (i - node_counts_shift[batch_j])
+        
+        MK = torch.zeros((int(pair_counts.sum()), self.num_k, *tail), dtype=Moff.dtype, device=Moff.device)
+        MK = MK.index_add(0, index_on, Mon)
+        MK = MK.index_add(0, index_off, Moff)
+        
+        MK_split = []
+        for idx, MK_idx in enumerate(torch.split(MK, pair_counts.tolist(), dim=0)):
+            natoms = int(node_counts[idx])
+            MK_idx = MK_idx.reshape(natoms, natoms, self.num_k, *tail)
+            MK_idx = MK_idx.permute(2, 0, 3, 1, 4, *range(5, MK_idx.dim())) # (nk, natoms, nao_max, natoms, nao_max[, vector_dim])
+            MK_split.append(MK_idx.reshape(self.num_k, natoms*self.nao_max, natoms*self.nao_max, *tail[2:]))
+        return MK_split
+
     def cal_band_energy(self, Hon, Hoff, data, export_reciprocal_values:bool=False):
         """
         Currently this function can only be used to calculate the energy band of the openmx Hamiltonian.
@@ -1455,46 +1578,26 @@ class HamGNNPlusPlusOut(nn.Module):
         Nbatch = cell.shape[0]
         
         # parse the Atomic Orbital Basis Sets
-        basis_definition = torch.zeros((99, self.nao_max)).type_as(data.z)
-        # key is the atomic number, value is the index of the occupied orbits.
-        for k in self.basis_def.keys():
-            basis_definition[k][self.basis_def[k]] = 1
-            
-        orb_mask = basis_definition[data.z] # shape: [Natoms, nao_max] 
+        orb_mask = self.basis_definition[data.z] # shape: [Natoms, nao_max] 
         orb_mask = torch.split(orb_mask, data.node_counts.tolist(), dim=0) # shape: [natoms, nao_max]
         orb_mask_batch = []
         for idx in range(Nbatch):
             orb_mask_batch.append(orb_mask[idx].reshape(-1, 1)* orb_mask[idx].reshape(1, -1)) # shape: [natoms*nao_max, natoms*nao_max]
         
         # set the number of valence electrons
-        num_val = torch.zeros((99,)).type_as(data.z)
-        for k in self.num_valence.keys():
-            num_val[k] = self.num_valence[k]
-        num_val = num_val[data.z] # shape: [Natoms]
+        num_val = self.num_valence_table[data.z] # shape: [Natoms]
         num_val = scatter(num_val, data.batch, dim=0) # shape: [Nbatch]
                 
         # Initialize band_num_win
         if isinstance(self.band_num_control, dict):
-            band_num_win = torch.zeros((99,)).type_as(data.z)
-            for k in self.band_num_control.keys():
-                band_num_win[k] = self.band_num_control[k]
-            band_num_win = band_num_win[data.z] # shape: [Natoms,]   
+            band_num_win = self.band_num_win_table[data.z] # shape: [Natoms,]   
             band_num_win = scatter(band_num_win, data.batch, dim=0) # shape: (Nbatch,)   
              
-        # Separate Hon and Hoff for each batch
-        node_counts = data.node_counts
-        node_counts_shift = torch.cumsum(node_counts, dim=0) - node_counts
-        Hon_split = torch.split(Hon, node_counts.tolist(), dim=0)
-        Son_split = torch.split(data.Son, node_counts.tolist(), dim=0)
-        #
-        edge_num = torch.ones_like(j)
-        edge_num = scatter(edge_num, data.batch[j], dim=0) # shape: (Nbatch,)
-        edge_num_shift = torch.cumsum(edge_num, dim=0) - edge_num
-        Hoff_split = torch.split(Hoff, edge_num.tolist(), dim=0)
-        Soff_split = torch.split(data.Soff, edge_num.tolist(), dim=0)
+        # Fourier transform H, S (and dS) of all structures to all of their k-points at once
+        HK_split = self.bloch_sum(Hon, Hoff, data) # list of (num_k, natoms*nao_max, natoms*nao_max)
+        SK_split = self.bloch_sum(data.Son, data.Soff, data)
         if export_reciprocal_values:
-            dSon_split = torch.split(data.dSon, node_counts.tolist(), dim=0)
-            dSoff_split = torch.split(data.dSoff, edge_num.tolist(), dim=0)
+            dSK_split = self.bloch_sum(data.dSon, data.dSoff, data, vector_dim=3) # list of (num_k, natoms*nao_max, natoms*nao_max, 3)
         
         band_energy = []
         wavefunction = []
@@ -1504,60 +1607,10 @@ class HamGNNPlusPlusOut(nn.Module):
         dS_reciprocal = []
         gap = []
         for idx in range(Nbatch):
-            k_vec = data.k_vecs[idx]   
-            natoms = data.node_counts[idx]
-            
-            # Initialize HK and SK       
-            coe = torch.exp(2j*torch.pi*torch.sum(data.nbr_shift[edge_num_shift[idx]+torch.arange(edge_num[idx]).type_as(j),None,:]*k_vec[None,:,:], axis=-1)) # (nedges, 1, 3)*(1, num_k, 3) -> (nedges, num_k)     
-            
-            HK = torch.view_as_complex(torch.zeros((self.num_k, natoms, natoms, self.nao_max, self.nao_max, 2)).type_as(Hon))
-            SK = torch.view_as_complex(torch.zeros((self.num_k, natoms, natoms, self.nao_max, self.nao_max, 2)).type_as(Hon))            
-            if export_reciprocal_values:
-                dSK = torch.view_as_complex(torch.zeros((self.num_k, natoms, natoms, self.nao_max, self.nao_max, 3, 2)).type_as(Hon))
-
-            na = torch.arange(natoms).type_as(j)
-            HK[:,na,na,:,:] +=  Hon_split[idx].reshape(-1, self.nao_max, self.nao_max)[None,na,:,:].type_as(HK) # shape (num_k, natoms, nao_max, nao_max)
-            SK[:,na,na,:,:] +=  Son_split[idx].reshape(-1, self.nao_max, self.nao_max)[None,na,:,:].type_as(SK)
-            if export_reciprocal_values:
-                dSK[:,na,na,:,:,:] +=  dSon_split[idx].reshape(-1, self.nao_max, self.nao_max, 3)[None,na,:,:,:].type_as(dSK)
-
-            # Calculate the index of all edges
-            edge_indices = torch.arange(edge_num[idx], device=j.device)
-            j_indices = j[edge_num_shift[idx] + edge_indices] - node_counts_shift[idx]
-            i_indices = i[edge_num_shift[idx] + edge_indices] - node_counts_shift[idx]
-
-            # Reshape the coefficients and matrices to facilitate vectorization operations
-            Hoff_reshaped = Hoff_split[idx].reshape(edge_num[idx], self.nao_max, self.nao_max)
-            Soff_reshaped = Soff_split[idx].reshape(edge_num[idx], self.nao_max, self.nao_max)
-            
-            for k_idx in range(self.num_k):
-                # Pre-calculate all the values of the current point k
-                coe_k = coe[:edge_num[idx], k_idx].unsqueeze(-1).unsqueeze(-1)  # shape: (edge_num, 1, 1)
-                HK_values = coe_k * Hoff_reshaped  # shape: (edge_num, nao_max, nao_max)
-                SK_values = coe_k * Soff_reshaped  # shape: (edge_num, nao_max, nao_max)
-
-                # Use index_put for accumulation
-                HK[k_idx] = torch.index_put(HK[k_idx], (j_indices, i_indices), HK_values, accumulate=True)
-                SK[k_idx] = torch.index_put(SK[k_idx], (j_indices, i_indices), SK_values, accumulate=True)
-
-            if export_reciprocal_values:
-                dSoff_reshaped = dSoff_split[idx].reshape(edge_num[idx], self.nao_max, self.nao_max, 3)
-
-                for k_idx in range(self.num_k):
-                    # Estimate all the values of the current point k
-                    coe_k = coe[:edge_num[idx], k_idx].unsqueeze(-1).unsqueeze(-1).unsqueeze(-1)  # shape: (edge_num, 1, 1, 1)
-                    dSK_values = coe_k * dSoff_reshaped  # shape: (edge_num, nao_max, nao_max, 3)
-
-                    # Use index_put for accumulation
-                    dSK[k_idx] = torch.index_put(dSK[k_idx], (j_indices, i_indices), dSK_values, accumulate=True)
-
-            HK = torch.swapaxes(HK,-2,-3) #(nk, natoms, nao_max, natoms, nao_max)
-            HK = HK.reshape(-1, natoms*self.nao_max, natoms*self.nao_max)
-            SK = torch.swapaxes(SK,-2,-3) #(nk, natoms, nao_max, natoms, nao_max)
-            SK = SK.reshape(-1, natoms*self.nao_max, natoms*self.nao_max)
+            HK = HK_split[idx]
+            SK = SK_split[idx]
             if export_reciprocal_values:
-                dSK = torch.swapaxes(dSK,-3,-4) #(nk, natoms, nao_max, natoms, nao_max, 3)
-                dSK = dSK.reshape(-1, natoms*self.nao_max, natoms*self.nao_max, 3)
+                dSK = dSK_split[idx]
             
             # mask HK and SK
             HK = torch.masked_select(HK, orb_mask_batch[idx].repeat(self.num_k,1,1) > 0)
@@ -1572,15 +1625,26 @@ class HamGNNPlusPlusOut(nn.Module):
                 dSK = dSK.reshape(self.num_k, norbs, norbs, 3)            
             
             # Calculate band energies
-            L = torch.linalg.cholesky(SK)
-            L_t = torch.transpose(L.conj(), dim0=-1, dim1=-2)
-            L_inv = torch.linalg.inv(L)
-            L_t_inv = torch.linalg.inv(L_t)
-            Hs = torch.bmm(torch.bmm(L_inv, HK), L_t_inv)
+            solver = GeneralizedEigenSolver(SK, method=self.eigen_solver)
+            Hs = solver.reduce(HK)
             orbital_energies, orbital_coefficients = torch.linalg.eigh(Hs)        
             
-            # Convert the wavefunction coefficients back to the original basis
-            orbital_coefficients = torch.einsum('ijk, ika -> iaj', L_t_inv, orbital_coefficients)
+            numc = math.ceil(num_val[idx]/2)
+            gap.append((torch.min(orbital_energies[:,numc]) - torch.max(orbital_energies[:,numc-1])).unsqueeze(0))
+            if self.band_num_control is not None:
+                if isinstance(self.band_num_control, dict):
+                    band_window = (0, band_num_win[idx])
+                else:
+                    if isinstance(self.band_num_control, float):
+                        self.band_num_control = max([1, int(self.band_num_control*numc)])
+                    else:
+                        self.band_num_control = min([self.band_num_control, numc])
+                    band_window = (numc-self.band_num_control, numc+self.band_num_control)
+                orbital_energies = orbital_energies[:,band_window[0]:band_window[1]]
+                orbital_coefficients = orbital_coefficients[:,:,band_window[0]:band_window[1]]
+            
+            # Convert the wavefunction coefficients of the selected bands back to the original basis
+            orbital_coefficients = solver.back_transform(orbital_coefficients).transpose(-1, -2) # shape: (num_k, Nbands, norbs)
             
             # Numpy
             """
@@ -1612,19 +1676,6 @@ class HamGNNPlusPlusOut(nn.Module):
                 S_reciprocal.append(SK)
                 dS_reciprocal.append(dSK)
             
-            numc = math.ceil(num_val[idx]/2)
-            gap.append((torch.min(orbital_energies[:,numc]) - torch.max(orbital_energies[:,numc-1])).unsqueeze(0))
-            if self.band_num_control is not None:
-                if isinstance(self.band_num_control, dict):
-                    orbital_energies = orbital_energies[:,:band_num_win[idx]]   
-                    orbital_coefficients = orbital_coefficients[:,:band_num_win[idx],:]
-                else:
-                    if isinstance(self.band_num_control, float):
-                        self.band_num_control = max([1, int(self.band_num_control*numc)])
-                    else:
-                        self.band_num_control = min([self.band_num_control, numc])
-                    orbital_energies = orbital_energies[:,numc-self.band_num_control:numc+self.band_num_control]   
-                    orbital_coefficients = orbital_coefficients[:,numc-self.band_num_control:numc+self.band_num_control,:]               
             band_energy.append(torch.transpose(orbital_energies, dim0=-1, dim1=-2)) # [shape:(Nbands, num_k)]
             wavefunction.append(orbital_coefficients)  
             H_sym.append(Hs.view(-1))   
@@ -1659,30 +1710,19 @@ class HamGNNPlusPlusOut(nn.Module):
         Hsoc_off_imag = Hsoc_off_imag.reshape(-1, 2*self.nao_max, 2*self.nao_max)
         
         # parse the Atomic Orbital Basis Sets
-        basis_definition = torch.zeros((99, self.nao_max)).type_as(data.z)
-        # key is the atomic number, value is the index of the occupied orbits.
-        for k in self.basis_def.keys():
-            basis_definition[k][self.basis_def[k]] = 1
-            
-        orb_mask = basis_definition[data.z] # shape: [Natoms, nao_max] 
+        orb_mask = self.basis_definition[data.z] # shape: [Natoms, nao_max] 
         orb_mask = torch.split(orb_mask, data.node_counts.tolist(), dim=0) # shape: [natoms, nao_max]
         orb_mask_batch = []
         for idx in range(Nbatch):
             orb_mask_batch.append(orb_mask[idx].reshape(-1, 1)* orb_mask[idx].reshape(1, -1)) # shape: [natoms*nao_max, natoms*nao_max]
         
         # Set the number of valence electrons
-        num_val = torch.zeros((99,)).type_as(data.z)
-        for k in self.num_valence.keys():
-            num_val[k] = self.num_valence[k]
-        num_val = num_val[data.z] # shape: [Natoms]
+        num_val = self.num_valence_table[data.z] # shape: [Natoms]
         num_val = scatter(num_val, data.batch, dim=0) # shape: [Nbatch]
                 
         # Initialize band_num_win
         if isinstance(self.band_num_control, dict):
-            band_num_win = torch.zeros((99,)).type_as(data.z)
-            for k in self.band_num_control.keys():
-                band_num_win[k] = self.band_num_control[k]
-            band_num_win = band_num_win[data.z] # shape: [Natoms,]   
+            band_num_win = self.band_num_win_table[data.z] # shape: [Natoms,]   
             band_num_win = scatter(band_num_win, data.batch, dim=0) # shape: (Nbatch,)       
             
         # Separate Hon and Hoff for each batch
@@ -1771,14 +1811,11 @@ class HamGNNPlusPlusOut(nn.Module):
             HK = torch.cat([torch.cat([HK_list[0],HK_list[1]], dim=-1), torch.cat([HK_list[2],HK_list[3]], dim=-1)],dim=-2)
         
             # Calculate band energies
-            L = torch.linalg.cholesky(SK)
-            L_t = torch.transpose(L.conj(), dim0=-1, dim1=-2)
-            L_inv = torch.linalg.inv(L)
-            L_t_inv = torch.linalg.inv(L_t)
-            Hs = torch.bmm(torch.bmm(L_inv, HK), L_t_inv)
+            solver = GeneralizedEigenSolver(SK, method=self.eigen_solver)
+            Hs = solver.reduce(HK)
             orbital_energies, orbital_coefficients = torch.linalg.eigh(Hs)   
             # Convert the wavefunction coefficients back to the original basis
-            orbital_coefficients = torch.bmm(L_t_inv, orbital_coefficients) # shape:(num_k, Nbands, Nbands)
+            orbital_coefficients = solver.back_transform(orbital_coefficients) # shape:(num_k, Nbands, Nbands)
             if self.band_num_control is not None:
                 if isinstance(self.band_num_control, dict):
                     orbital_energies = orbital_energies[:,:band_num_win[idx]]   
@@ -1791,12 +1828,6 @@ class HamGNNPlusPlusOut(nn.Module):
         return torch.cat(band_energy, dim=0), torch.cat(wavefunction, dim=0).reshape(-1)
     
     def mask_Ham(self, Hon, Hoff, data):
-        # parse the Atomic Orbital Basis Sets
-        basis_definition = torch.zeros((99, self.nao_max)).type_as(data.z)
-        # key is the atomic number, value is the index of the occupied orbits.
-        for k in self.basis_def.keys():
-            basis_definition[k][self.basis_def[k]] = 1
-        
         # Save the original shape
         original_shape_on = Hon.shape
         original_shape_off = Hoff.shape
@@ -1807,22 +1838,17 @@ class HamGNNPlusPlusOut(nn.Module):
             Hoff = Hoff.reshape(original_shape_off[0], -1)
         
         # mask Hon first        
-        orb_mask = basis_definition[data.z].view(-1, self.nao_max) # shape: [Natoms, nao_max] 
-        orb_mask = orb_mask[:,:,None] * orb_mask[:,None,:]       # shape: [Natoms, nao_max, nao_max]
-        orb_mask = orb_mask.reshape(-1, int(self.nao_max*self.nao_max)) # shape: [Natoms, nao_max*nao_max]
+        orb_mask = self.pair_mask(data.z, data.z) # shape: [Natoms, nao_max*nao_max]
         
         Hon_mask = torch.zeros_like(Hon)
-        Hon_mask[orb_mask>0] = Hon[orb_mask>0]
+        Hon_mask[orb_mask] = Hon[orb_mask]
         
         # mask Hoff
         j, i = data.edge_index        
-        orb_mask_j = basis_definition[data.z[j]].view(-1, self.nao_max) # shape: [Nedges, nao_max]
-        orb_mask_i = basis_definition[data.z[i]].view(-1, self.nao_max) # shape: [Nedges, nao_max] 
-        orb_mask = orb_mask_j[:,:,None] * orb_mask_i[:,None,:]       # shape: [Nedges, nao_max, nao_max]
-        orb_mask = orb_mask.reshape(-1, int(self.nao_max*self.nao_max)) # shape: [Nedges, nao_max*nao_max]
+        orb_mask = self.pair_mask(data.z[j], data.z[i]) # shape: [Nedges, nao_max*nao_max]
         
         Hoff_mask = torch.zeros_like(Hoff)
-        Hoff_mask[orb_mask>0] = Hoff[orb_mask>0]
+        Hoff_mask[orb_mask] = Hoff[orb_mask]
 
         # Output the result in the original shape
         Hon_mask = Hon_mask.reshape(original_shape_on)
@@ -1886,109 +1912,115 @@ class HamGNNPlusPlusOut(nn.Module):
         return cell_index_map
 
     def get_unique_cell_shift_and_cell_shift_indices(self, data):
-        # Matches the row index of cell shift in unique_cell_shift
+        """
+        Finds the unique cell shifts of the edges and the index of the cell shift of every edge. The cell shifts
+        are packed into int64 keys, so only a sort of Nedges keys and a binary search are needed.
+
+        :return: unique_cell_shift, shape: (Nunique, 3), sorted with (0, 0, 0) moved to the front if it is absent;
+                 cell_shift_indices, shape: (Nedges,); cell_index_map, a dict mapping the cell tuples to their indices.
+        """
         cell_shift = data.cell_shift
-        unique_cell_shift = torch.unique(cell_shift, dim=0)
-        
-        zero_vector = torch.tensor([[0, 0, 0]]).type_as(unique_cell_shift)
-        is_zero_vector_present = (unique_cell_shift == zero_vector).all(dim=1).any()
-        
-        # If (0, 0, 0) does not exist, add it to cell_shift
-        if not is_zero_vector_present:
-            unique_cell_shift = torch.cat((zero_vector, unique_cell_shift), dim=0)
-        
-        # Expand cell_shift and unique_cell_shift for comparison
-        expanded_cell_shift = cell_shift.unsqueeze(1).expand(-1, unique_cell_shift.size(0), -1)
-        expanded_unique_cell_shift = unique_cell_shift.unsqueeze(0).expand(cell_shift.size(0), -1, -1)
-        
-        # Compare and find matching rows
-        matches = (expanded_cell_shift == expanded_unique_cell_shift).all(dim=2)
+        keys = pack_cell_shift(cell_shift)
+        unique_keys = torch.unique(keys) # sorted
         
         # Gets the index of the matching row
-        cell_shift_indices = matches.nonzero(as_tuple=True)[1] # (Nedges,)
+        cell_shift_indices = torch.searchsorted(unique_keys, keys) # (Nedges,)
+        
+        # If (0, 0, 0) does not exist, add it to the front of unique_cell_shift
+        zero_key = pack_cell_shift(torch.zeros((1, 3), dtype=torch.long, device=keys.device))
+        if not (unique_keys == zero_key).any():
+            unique_keys = torch.cat((zero_key, unique_keys), dim=0)
+            cell_shift_indices = cell_shift_indices + 1
+        unique_cell_shift = unpack_cell_shift(unique_keys).type_as(cell_shift)
         
         # Get the cell index map
         cell_index_map = self.index_cells(unique_cell_shift.tolist())
         
         return unique_cell_shift, cell_shift_indices, cell_index_map
 
-    def edge_hunter(self, data, inv_edge_idx=None):
-        src, tar = data.edge_index
-        unique_cell_shift = data.unique_cell_shift
-        cell_shift_indices = data.cell_shift_indices
-        cell_index_map = data.cell_index_map
-
+    def heisenberg_terms(self, data, B_on, B_off_tar, B_off_src, weight_on, weight_off, sigma, magnetic_atoms):
+        """
+        Vectorized assembly of the spin-constrained Heisenberg terms of the on-site and off-site blocks.
+        
+        Every term is W[t]*B[s]·sigma, where t is the receiving block (an atom or an edge) and B[s] the spin field
+        of an exchange block. Since W[t] does not depend on the source, the fields are first summed for every
+        receiving block with scatter-adds and multiplied by the weights and Pauli matrices only once:
+            on-site J of magnetic atom a -> atom a, the edges starting at a and the zero-shift edges ending at a;
+            J_off of edge (a->b) with b magnetic -> atom a and all edges starting at a;
+            J_off of edge (a->b) with a magnetic -> all edges ending at b with the same cell shift,
+                                                     and atom b if the cell shift is zero.
+        
+        :param B_on: spin fields of the on-site J, shape: (Natoms, nao_max, nao_max, K)
+        :param B_off_tar: spin fields of J_off with the spin of the target atom, shape: (Nedges, nao_max, nao_max, K)
+        :param B_off_src: spin fields of J_off with the spin of the source atom, shape: (Nedges, nao_max, nao_max, K)
+        :param weight_on: shape: (Natoms, nao_max, nao_max)
+        :param weight_off: shape: (Nedges, nao_max, nao_max)
+        :param sigma: the K Pauli matrices, shape: (K, 2, 2)
+        :param magnetic_atoms: bool mask of the magnetic atoms, shape: (Natoms,)
+        :return: H_heisen_J_on, shape: (Natoms, 2, nao_max, 2, nao_max); H_heisen_J_off, shape: (Nedges, 2, nao_max, 2, nao_max)
+        """
+        j, i = data.edge_index
         num_nodes = len(data.z)
-        num_shifts = len(unique_cell_shift)
-
-        edge_matcher_src = [torch.where(src == ia)[0] for ia in range(num_nodes)]
-        edge_matcher_tar = [[[] for _ in range(num_shifts)] for _ in range(num_nodes)]
-
-        for ia in range(num_nodes):
-            inv_src = inv_edge_idx[edge_matcher_src[ia]]
-            cell_shift_inv_src = cell_shift_indices[inv_src]
-
-            for idx_edge, idx_cell in zip(inv_src, cell_shift_inv_src):
-                edge_matcher_tar[ia][idx_cell.item()].append(idx_edge)
-
-            for idx_cell in range(num_shifts):
-                if edge_matcher_tar[ia][idx_cell]:
-                    edge_matcher_tar[ia][idx_cell] = torch.stack(edge_matcher_tar[ia][idx_cell]).type_as(src)
-                else:
-                    edge_matcher_tar[ia][idx_cell] = torch.tensor([], dtype=torch.long).type_as(src)
-
-        return edge_matcher_src, edge_matcher_tar
+        magnetic = magnetic_atoms.type_as(B_on).reshape(-1, 1, 1, 1)
+        cell_shift_indices = data.cell_shift_indices
+        zero_shift = (cell_shift_indices == data.cell_index_map[(0, 0, 0)]).type_as(B_on).reshape(-1, 1, 1, 1)
+        
+        # on-site J
+        B_on = B_on*magnetic
+        acc_on = B_on
+        acc_off = B_on[j] + B_on[i]*zero_shift
+        
+        # J_off acting with the spin of the target atom
+        Q_src = scatter(B_off_tar*magnetic[i], j, dim=0, dim_size=num_nodes)
+        acc_on = acc_on + Q_src
+        acc_off = acc_off + Q_src[j]
+        
+        # J_off acting with the spin of the source atom, grouped by (target atom, cell shift)
+        B_off_src = B_off_src*magnetic[j]
+        _, group = torch.unique(i*len(data.unique_cell_shift) + cell_shift_indices, return_inverse=True)
+        acc_off = acc_off + scatter(B_off_src, group, dim=0)[group]
+        acc_on = acc_on + scatter(B_off_src*zero_shift, i, dim=0, dim_size=num_nodes)
+        
+        H_heisen_J_on = oe.contract('mij, mijk, kop -> moipj', weight_on.type_as(sigma), acc_on.type_as(sigma), sigma)
+        H_heisen_J_off = oe.contract('mij, mijk, kop -> moipj', weight_off.type_as(sigma), acc_off.type_as(sigma), sigma)
+        return H_heisen_J_on, H_heisen_J_off
 
     def get_basis_definition(self, z):
-        """Create and return the basis definition tensor for mask calculations."""
-        basis_definition = torch.zeros((99, self.nao_max)).type_as(z)
-        for k in self.basis_def:
-            basis_definition[k][self.basis_def[k]] = 1
-        return basis_definition
+        """Return the cached basis definition tensor for mask calculations."""
+        return self.basis_definition
 
     def mask_tensor_builder(self, data):
         """Build the tensor mask and return the concatenated mask tensor."""
         j, i = data.edge_index
         z = data.z
-        basis_definition = self.get_basis_definition(z)
-        # Calculate mask_on and mask_off using einsum
-        mask_on = torch.einsum('ni, nj -> nij', basis_definition[z], basis_definition[z]).bool()
-        mask_off = torch.einsum('ni, nj -> nij', basis_definition[z[j]], basis_definition[z[i]]).bool()
-        # Concatenate and reshape the masks
-        mask_all = torch.cat(
-            (mask_on.reshape(-1, self.nao_max**2), 
-             mask_off.reshape(-1, self.nao_max**2)), 
-            dim=0
-        )
+        # Look up mask_on and mask_off from the species pair table
+        mask_on = self.pair_mask(z, z)
+        mask_off = self.pair_mask(z[j], z[i])
+        # Concatenate the masks
+        mask_all = torch.cat((mask_on, mask_off), dim=0)
         return mask_all
 
     def mask_tensor_builder_col(self, data):
         """Build the tensor mask and return the concatenated mask tensor."""
         j, i = data.edge_index
         z = data.z
-        basis_definition = self.get_basis_definition(z)
-        # Calculate mask_on and mask_off using einsum
-        mask_on = torch.einsum('ni, nj -> nij', basis_definition[z], basis_definition[z]).bool()
-        mask_on = torch.stack([mask_on, mask_on], dim=1) # (Nbatchs, 2, nao_max, nao_max)
-        mask_off = torch.einsum('ni, nj -> nij', basis_definition[z[j]], basis_definition[z[i]]).bool()
-        mask_off = torch.stack([mask_off, mask_off], dim=1) # (Nbatchs, 2, nao_max, nao_max)
-        # Concatenate and reshape the masks
-        mask_all = torch.cat(
-            (mask_on.reshape(-1, 2, self.nao_max**2), 
-             mask_off.reshape(-1, 2, self.nao_max**2)), 
-            dim=0
-        )
+        # Look up mask_on and mask_off from the species pair table
+        mask_on = self.pair_mask(z, z)
+        mask_on = torch.stack([mask_on, mask_on], dim=1) # (Nbatchs, 2, nao_max**2)
+        mask_off = self.pair_mask(z[j], z[i])
+        mask_off = torch.stack([mask_off, mask_off], dim=1) # (Nbatchs, 2, nao_max**2)
+        # Concatenate the masks
+        mask_all = torch.cat((mask_on, mask_off), dim=0)
         return mask_all
 
     def mask_tensor_builder_soc(self, data):
         """Build the tensor mask including spin-orbit coupling."""
         j, i = data.edge_index
         z = data.z
-        basis_definition = self.get_basis_definition(z)
 
-        # Calculate the base masks
-        mask_on = torch.einsum('ni, nj -> nij', basis_definition[z], basis_definition[z])
-        mask_off = torch.einsum('ni, nj -> nij', basis_definition[z[j]], basis_definition[z[i]])
+        # Look up the base masks
+        mask_on = self.pair_mask(z, z).reshape(-1, self.nao_max, self.nao_max)
+        mask_off = self.pair_mask(z[j], z[i]).reshape(-1, self.nao_max, self.nao_max)
 
         # Expand tensors to include spin components
         mask_on_expanded = blockwise_2x2_concat(mask_on, mask_on, mask_on, mask_on).reshape(-1, (2*self.nao_max)**2).bool()
@@ -2015,10 +2047,10 @@ class HamGNNPlusPlusOut(nn.Module):
             data.Hon = torch.stack([data.H_u[:len(data.z)], data.H_d[:len(data.z)]], dim=1).flatten(2)
             data.Hoff = torch.stack([data.H_u[len(data.z):], data.H_d[len(data.z):]], dim=1).flatten(2)
     
-        # prepare data.hamiltonian & data.overlap
-        if 'hamiltonian' not in data:
+        # prepare data.hamiltonian & data.overlap (the graphs of structures that are only predicted have no targets)
+        if 'hamiltonian' not in data and 'Hon' in data:
             data.hamiltonian = self.cat_onsite_and_offsite(data, data.Hon, data.Hoff)
-        if 'overlap' not in data:
+        if 'overlap' not in data and 'Son' in data:
             data.overlap = self.cat_onsite_and_offsite(data, data.Son, data.Soff)
         
         node_attr = graph_representation['node_attr']
@@ -2037,10 +2069,7 @@ class HamGNNPlusPlusOut(nn.Module):
         
         if not self.ham_only:
             node_sph = self.onsitenet_s(node_attr)
-            node_sph = torch.split(node_sph, self.ham_irreps_dim.tolist(), dim=-1)
-            Son = self.matrix_merge(node_sph) # shape (Nnodes, nao_max**2)
-            
-            Son = self.change_index(Son)
+            Son = self.matrix_merge_fused(node_sph) # shape (Nnodes, nao_max**2)
         
             # Impose Hermitian symmetry for Son
             Son = self.symmetrize_Hon(Son)
@@ -2048,10 +2077,7 @@ class HamGNNPlusPlusOut(nn.Module):
             # Calculate the off-site overlap
             # Calculate the contribution of the edges       
             edge_sph = self.offsitenet_s(edge_attr)
-            edge_sph = torch.split(edge_sph, self.ham_irreps_dim.tolist(), dim=-1)        
-            Soff = self.matrix_merge(edge_sph)
-        
-            Soff = self.change_index(Soff)        
+            Soff = self.matrix_merge_fused(edge_sph)
             # Impose Hermitian symmetry for Soff
             Soff = self.symmetrize_Hoff(Soff, inv_edge_idx)
         
@@ -2090,10 +2116,7 @@ class HamGNNPlusPlusOut(nn.Module):
                         
                     else:
                         node_sph = self.onsitenet_h(node_attr)     
-                        node_sph = torch.split(node_sph, self.ham_irreps_dim.tolist(), dim=-1)
-                        Hon = self.matrix_merge(node_sph) # shape (Nnodes, nao_max**2)
-    
-                        Hon = self.change_index(Hon)
+                        Hon = self.matrix_merge_fused(node_sph) # shape (Nnodes, nao_max**2)
     
                         # Impose Hermitian symmetry for Hon
                         Hon = self.symmetrize_Hon(Hon)            
@@ -2101,10 +2124,7 @@ class HamGNNPlusPlusOut(nn.Module):
                         # Calculate the off-site Hamiltonian
                         # Calculate the contribution of the edges       
                         edge_sph = self.offsitenet_h(edge_attr)
-                        edge_sph = torch.split(edge_sph, self.ham_irreps_dim.tolist(), dim=-1)        
-                        Hoff = self.matrix_merge(edge_sph)
-    
-                        Hoff = self.change_index(Hoff)        
+                        Hoff = self.matrix_merge_fused(edge_sph)
                         # Impose Hermitian symmetry for Hoff
                         Hoff = self.symmetrize_Hoff(Hoff, inv_edge_idx)
     
@@ -2178,48 +2198,39 @@ class HamGNNPlusPlusOut(nn.Module):
                     raise NotImplementedError
             else:
                 node_sph = self.onsitenet_h(node_attr)     
-                node_sph = torch.split(node_sph, self.ham_irreps_dim.tolist(), dim=-1)
-                Hon = self.matrix_merge(node_sph) # shape (Nnodes, nao_max**2)
-                Hon = self.change_index(Hon)
+                Hon = self.matrix_merge_fused(node_sph) # shape (Nnodes, nao_max**2)
                 # Impose Hermitian symmetry for Hon
                 Hon = self.symmetrize_Hon(Hon)            
                 # Calculate the off-site Hamiltonian
                 # Calculate the contribution of the edges       
                 edge_sph = self.offsitenet_h(edge_attr)
-                edge_sph = torch.split(edge_sph, self.ham_irreps_dim.tolist(), dim=-1)        
-                Hoff = self.matrix_merge(edge_sph)
-                Hoff = self.change_index(Hoff)        
+                Hoff = self.matrix_merge_fused(edge_sph)
                 # Impose Hermitian symmetry for Hoff
                 Hoff = self.symmetrize_Hoff(Hoff, inv_edge_idx)
                 Hon, Hoff = self.mask_Ham(Hon, Hoff, data)
                 
                 if not self.collinear_spin:
-                    Hsoc_on_real = torch.zeros_like(data.Hon).reshape(Hon.shape[0], 2*self.nao_max, 2*self.nao_max)
+                    Hsoc_on_real = torch.zeros((Hon.shape[0], 2*self.nao_max, 2*self.nao_max)).type_as(Hon)
                     Hsoc_on_real[:,:self.nao_max,:self.nao_max] = Hon.reshape(-1, self.nao_max, self.nao_max)
                     Hsoc_on_real[:,self.nao_max:,self.nao_max:] = Hon.reshape(-1, self.nao_max, self.nao_max)
                     Hsoc_on_real = Hsoc_on_real.reshape(Hon.shape[0], (2*self.nao_max)**2)
                     
-                    Hsoc_off_real = torch.zeros_like(data.Hoff).reshape(Hoff.shape[0], 2*self.nao_max, 2*self.nao_max)
+                    Hsoc_off_real = torch.zeros((Hoff.shape[0], 2*self.nao_max, 2*self.nao_max)).type_as(Hoff)
                     Hsoc_off_real[:,:self.nao_max,:self.nao_max] = Hoff.reshape(-1, self.nao_max, self.nao_max)
                     Hsoc_off_real[:,self.nao_max:,self.nao_max:] = Hoff.reshape(-1, self.nao_max, self.nao_max)
                     Hsoc_off_real = Hsoc_off_real.reshape(Hoff.shape[0], (2*self.nao_max)**2)
                     
-                    Hsoc_on_imag = torch.zeros_like(data.iHon) 
-                    Hsoc_off_imag = torch.zeros_like(data.iHoff)
+                    Hsoc_on_imag = torch.zeros((Hon.shape[0], (2*self.nao_max)**2)).type_as(Hon)
+                    Hsoc_off_imag = torch.zeros((Hoff.shape[0], (2*self.nao_max)**2)).type_as(Hoff)
             
             if self.spin_constrained:
                 magnetic_atoms = (data.spin_length > self.minMagneticMoment)
                 data.unique_cell_shift, data.cell_shift_indices, data.cell_index_map = self.get_unique_cell_shift_and_cell_shift_indices(data)
-                cell_shift_indices = data.cell_shift_indices.tolist()
-                cell_index_map = data.cell_index_map
                 
                 # learn a weight matrix
                 if self.use_learned_weight:
                     node_sph = self.onsitenet_weight(node_attr)     
-                    node_sph = torch.split(node_sph, self.ham_irreps_dim.tolist(), dim=-1)
-                    weight_on = self.matrix_merge(node_sph) # shape (Nnodes, nao_max**2)
-            
-                    weight_on = self.change_index(weight_on)
+                    weight_on = self.matrix_merge_fused(node_sph) # shape (Nnodes, nao_max**2)
 
                     # Impose Hermitian symmetry for Hon
                     weight_on = self.symmetrize_Hon(weight_on)           
@@ -2227,10 +2238,7 @@ class HamGNNPlusPlusOut(nn.Module):
                     # Calculate the off-site Hamiltonian
                     # Calculate the contribution of the edges       
                     edge_sph = self.offsitenet_weight(edge_attr)
-                    edge_sph = torch.split(edge_sph, self.ham_irreps_dim.tolist(), dim=-1)        
-                    weight_off = self.matrix_merge(edge_sph)
-        
-                    weight_off = self.change_index(weight_off)        
+                    weight_off = self.matrix_merge_fused(edge_sph)
                     # Impose Hermitian symmetry for Hoff
                     weight_off = self.symmetrize_Hoff(weight_off, inv_edge_idx)
                     
@@ -2258,46 +2266,14 @@ class HamGNNPlusPlusOut(nn.Module):
                     sigma[1] = torch.complex(real=torch.zeros((2,2)), imag=torch.Tensor([[0.0, -1.0],[1.0, 0.0]])).type_as(sigma) 
                     sigma[2] = torch.Tensor([[1.0, 0.0],[0.0, -1.0]]).type_as(sigma) 
 
-                    spin_vec = data.spin_vec
-
-                    # brodcast shape: (Natoms/Nedges, Natoms/Nedges, 2, nao_max, 2, nao_max)
-                    H_heisen_J_on = torch.zeros(len(J_on), 2, self.nao_max, 2, self.nao_max).type_as(sigma)
-                    H_heisen_J_off = torch.zeros(len(j), 2, self.nao_max, 2, self.nao_max).type_as(sigma)
-
-                    # Optimize Performance
-                    edge_matcher_src, edge_matcher_tar = self.edge_hunter(data, inv_edge_idx)           
-
-                    H_heisen_J_on[magnetic_atoms] += oe.contract('mijkl, mij, kop, ml -> moipj', J_on[magnetic_atoms].type_as(sigma), weight_on[magnetic_atoms].type_as(sigma), sigma, spin_vec[magnetic_atoms].type_as(sigma))    
-                    H_heisen_J_on[magnetic_atoms] += oe.contract('mijkl, mij, lop, mk -> moipj', J_on[magnetic_atoms].type_as(sigma), weight_on[magnetic_atoms].type_as(sigma), sigma, spin_vec[magnetic_atoms].type_as(sigma))
+                    spin_vec = data.spin_vec.type_as(J_on)
 
-                    zero_shift_idx = cell_index_map[(0, 0, 0)]
-                    for ia in range(len(J_on)):
-                        # src
-                        if magnetic_atoms[ia]:
-                            zero_shift_edges = edge_matcher_tar[ia][zero_shift_idx]
-                            edge_matcher_src_ = torch.cat([edge_matcher_src[ia], zero_shift_edges])
-                            Woff = weight_off[edge_matcher_src_]                    
-                            H_heisen_J_off[edge_matcher_src_] += oe.contract('ijkl, mij, kop, l -> moipj', J_on[ia].type_as(sigma), Woff.type_as(sigma), sigma, spin_vec[ia].type_as(sigma))
-                            H_heisen_J_off[edge_matcher_src_] += oe.contract('ijkl, mij, lop, k -> moipj', J_on[ia].type_as(sigma), Woff.type_as(sigma), sigma, spin_vec[ia].type_as(sigma))
-                    
-                    for i_edge in range(len(j)):
-                        ia = j[i_edge].item()
-                        ja = i[i_edge].item()
-
-                        # i
-                        if magnetic_atoms[ja]:
-                            Won = weight_on[ia]
-                            Woff_src = weight_off[edge_matcher_src[ia]]
-                            H_heisen_J_on[ia] += oe.contract('ijkl, ij, kop, l -> oipj', J_off[i_edge].type_as(sigma), Won.type_as(sigma), sigma, spin_vec[ja].type_as(sigma))
-                            H_heisen_J_off[edge_matcher_src[ia]] += oe.contract('ijkl, mij, kop, l -> moipj', J_off[i_edge].type_as(sigma), Woff_src.type_as(sigma), sigma, spin_vec[ja].type_as(sigma))
-
-                        # j
-                        if magnetic_atoms[ia]:
-                            Woff_tar = weight_off[edge_matcher_tar[ja][cell_shift_indices[i_edge]]]
-                            H_heisen_J_off[edge_matcher_tar[ja][cell_shift_indices[i_edge]]] += oe.contract('ijkl, mij, lop, k -> moipj', J_off[i_edge].type_as(sigma), Woff_tar.type_as(sigma), sigma, spin_vec[ia].type_as(sigma))
-                            if cell_shift_indices[i_edge] == data.cell_index_map[(0,0,0)]:
-                                Won = weight_on[ja]
-                                H_heisen_J_on[ja] += oe.contract('ijkl, ij, lop, k -> oipj', J_off[i_edge].type_as(sigma), Won.type_as(sigma), sigma, spin_vec[ia].type_as(sigma))   
+                    # Spin fields of the exchange blocks: the on-site J acts with both of its spin indices,
+                    # J_off with the spin of the target atom ('kop, l') or of the source atom ('lop, k')
+                    B_on = oe.contract('nijkl, nl -> nijk', J_on, spin_vec) + oe.contract('nijkl, nk -> nijl', J_on, spin_vec)
+                    B_off_tar = oe.contract('nijkl, nl -> nijk', J_off, spin_vec[i])
+                    B_off_src = oe.contract('nijkl, nk -> nijl', J_off, spin_vec[j])
+                    H_heisen_J_on, H_heisen_J_off = self.heisenberg_terms(data, B_on, B_off_tar, B_off_src, weight_on, weight_off, sigma, magnetic_atoms)
                 else:
                     J_on = self.onsitenet_J(node_attr) # shape: (Natoms, Nblocks)  
                     J_on = self.J_merge(J_on) # shape: (Natoms, nao_max, nao_max,)
@@ -2315,44 +2291,13 @@ class HamGNNPlusPlusOut(nn.Module):
                     if self.collinear_spin:
                         sigma_z = torch.Tensor([[1.0, 0.0],[0.0, -1.0]]).type_as(J_on) 
 
-                        spin_vec = data.spin_vec
-
-                        # brodcast shape: (Natoms/Nedges, Natoms/Nedges, 2, nao_max, 2, nao_max)
-                        H_heisen_J_on = torch.zeros(len(J_on), 2, self.nao_max, 2, self.nao_max).type_as(J_on) 
-                        H_heisen_J_off = torch.zeros(len(j), 2, self.nao_max, 2, self.nao_max).type_as(J_off) 
-
-                        # Optimize Performance
-                        edge_matcher_src, edge_matcher_tar = self.edge_hunter(data, inv_edge_idx)           
-
-                        H_heisen_J_on[magnetic_atoms] += oe.contract('mij, mij, op, m -> moipj', J_on[magnetic_atoms], weight_on[magnetic_atoms], sigma_z, spin_vec[magnetic_atoms,2])
-
-                        zero_shift_idx = cell_index_map[(0, 0, 0)]
-                        for ia in range(len(J_on)):
-                            # src
-                            if magnetic_atoms[ia]:
-                                zero_shift_edges = edge_matcher_tar[ia][zero_shift_idx]
-                                edge_matcher_src_ = torch.cat([edge_matcher_src[ia], zero_shift_edges])
-                                Woff = weight_off[edge_matcher_src_]   
-                                H_heisen_J_off[edge_matcher_src_] += oe.contract('ij, mij, op-> moipj', J_on[ia], Woff, sigma_z)*spin_vec[ia,2]
-
-                        for i_edge in range(len(j)):
-                            ia = j[i_edge].item()
-                            ja = i[i_edge].item()
-
-                            # i
-                            if magnetic_atoms[ja]:
-                                Won = weight_on[ia]
-                                Woff_src = weight_off[edge_matcher_src[ia]]
-                                H_heisen_J_on[ia] += oe.contract('ij, ij, op-> oipj', J_off[i_edge], Won, sigma_z)*spin_vec[ja,2]
-                                H_heisen_J_off[edge_matcher_src[ia]] += oe.contract('ij, mij, op -> moipj', J_off[i_edge], Woff_src, sigma_z)*spin_vec[ja,2]
-
-                            # j
-                            if magnetic_atoms[ia]:
-                                Woff_tar = weight_off[edge_matcher_tar[ja][cell_shift_indices[i_edge]]]
-                                H_heisen_J_off[edge_matcher_tar[ja][cell_shift_indices[i_edge]]] += oe.contract('ij, mij, op -> moipj', J_off[i_edge], Woff_tar, sigma_z)*spin_vec[ia,2]
-                                if cell_shift_indices[i_edge] == data.cell_index_map[(0,0,0)]:
-                                    Won = weight_on[ja]
-                                    H_heisen_J_on[ja] += oe.contract('ij, ij, op-> oipj', J_off[i_edge], Won, sigma_z)*spin_vec[ia,2]
+                        spin_vec = data.spin_vec.type_as(J_on)
+
+                        # Spin fields of the exchange blocks along z
+                        B_on = J_on.unsqueeze(-1)*spin_vec[:,None,None,2:3]
+                        B_off_tar = J_off.unsqueeze(-1)*spin_vec[i][:,None,None,2:3]
+                        B_off_src = J_off.unsqueeze(-1)*spin_vec[j][:,None,None,2:3]
+                        H_heisen_J_on, H_heisen_J_off = self.heisenberg_terms(data, B_on, B_off_tar, B_off_src, weight_on, weight_off, sigma_z.unsqueeze(0), magnetic_atoms)
 
                     else:                 
                         sigma = torch.view_as_complex(torch.zeros((3,2,2,2)).type_as(J_on))
@@ -2360,44 +2305,13 @@ class HamGNNPlusPlusOut(nn.Module):
                         sigma[1] = torch.complex(real=torch.zeros((2,2)), imag=torch.Tensor([[0.0, -1.0],[1.0, 0.0]])).type_as(sigma) 
                         sigma[2] = torch.Tensor([[1.0, 0.0],[0.0, -1.0]]).type_as(sigma) 
 
-                        spin_vec = data.spin_vec
-
-                        # brodcast shape: (Natoms/Nedges, Natoms/Nedges, 2, nao_max, 2, nao_max)
-                        H_heisen_J_on = torch.zeros(len(J_on), 2, self.nao_max, 2, self.nao_max).type_as(sigma)
-                        H_heisen_J_off = torch.zeros(len(j), 2, self.nao_max, 2, self.nao_max).type_as(sigma)
-
-                        # Optimize Performance
-                        edge_matcher_src, edge_matcher_tar = self.edge_hunter(data, inv_edge_idx)          
-
-                        H_heisen_J_on[magnetic_atoms] += oe.contract('mij, mij, kop, mk -> moipj', J_on[magnetic_atoms].type_as(sigma), weight_on[magnetic_atoms].type_as(sigma), sigma, spin_vec[magnetic_atoms].type_as(sigma))
-
-                        zero_shift_idx = cell_index_map[(0, 0, 0)]
-                        for ia in range(len(J_on)):
-                            # src
-                            if magnetic_atoms[ia]:
-                                zero_shift_edges = edge_matcher_tar[ia][zero_shift_idx]
-                                edge_matcher_src_ = torch.cat([edge_matcher_src[ia], zero_shift_edges])
-                                Woff = weight_off[edge_matcher_src_]  
-                                H_heisen_J_off[edge_matcher_src_] += oe.contract('ij, mij, kop, k -> moipj', J_on[ia].type_as(sigma), Woff.type_as(sigma), sigma, spin_vec[ia].type_as(sigma))
-
-                        for i_edge in range(len(j)):
-                            ia = j[i_edge].item()
-                            ja = i[i_edge].item()
-
-                            # i
-                            if magnetic_atoms[ja]:
-                                Won = weight_on[ia]
-                                Woff_src = weight_off[edge_matcher_src[ia]]
-                                H_heisen_J_on[ia] += oe.contract('ij, ij, kop, k -> oipj', J_off[i_edge].type_as(sigma), Won.type_as(sigma), sigma, spin_vec[ja].type_as(sigma))
-                                H_heisen_J_off[edge_matcher_src[ia]] += oe.contract('ij, mij, kop, k -> moipj', J_off[i_edge].type_as(sigma), Woff_src.type_as(sigma), sigma, spin_vec[ja].type_as(sigma))
-
-                            # j
-                            if magnetic_atoms[ia]:
-                                Woff_tar = weight_off[edge_matcher_tar[ja][cell_shift_indices[i_edge]]]
-                                H_heisen_J_off[edge_matcher_tar[ja][cell_shift_indices[i_edge]]] += oe.contract('ij, mij, kop, k -> moipj', J_off[i_edge].type_as(sigma), Woff_tar.type_as(sigma), sigma, spin_vec[ia].type_as(sigma))
-                                if cell_shift_indices[i_edge] == data.cell_index_map[(0,0,0)]:
-                                    Won = weight_on[ja]
-                                    H_heisen_J_on[ja] += oe.contract('ij, ij, kop, k -> oipj', J_off[i_edge].type_as(sigma), Won.type_as(sigma), sigma, spin_vec[ia].type_as(sigma))                                
+                        spin_vec = data.spin_vec.type_as(J_on)
+
+                        # Spin fields of the exchange blocks
+                        B_on = J_on.unsqueeze(-1)*spin_vec[:,None,None,:]
+                        B_off_tar = J_off.unsqueeze(-1)*spin_vec[i][:,None,None,:]
+                        B_off_src = J_off.unsqueeze(-1)*spin_vec[j][:,None,None,:]
+                        H_heisen_J_on, H_heisen_J_off = self.heisenberg_terms(data, B_on, B_off_tar, B_off_src, weight_on, weight_off, sigma, magnetic_atoms)
 
                 if not self.collinear_spin:
                     Hsoc_on_real =  Hsoc_on_real + H_heisen_J_on.reshape(-1, (2*self.nao_max)**2).real
@@ -2428,11 +2342,12 @@ class HamGNNPlusPlusOut(nn.Module):
                 Hsoc_real = self.cat_onsite_and_offsite(data, Hsoc_on_real, Hsoc_off_real)
                 Hsoc_imag = self.cat_onsite_and_offsite(data, Hsoc_on_imag, Hsoc_off_imag)
 
-                data.hamiltonian_real = self.cat_onsite_and_offsite(data, data.Hon, data.Hoff)
-                data.hamiltonian_imag = self.cat_onsite_and_offsite(data, data.iHon, data.iHoff)
+                if 'iHon' in data:
+                    data.hamiltonian_real = self.cat_onsite_and_offsite(data, data.Hon, data.Hoff)
+                    data.hamiltonian_imag = self.cat_onsite_and_offsite(data, data.iHon, data.iHoff)
+                    data.hamiltonian = torch.cat((data.hamiltonian_real, data.hamiltonian_imag), dim=0)
 
                 Hsoc = torch.cat((Hsoc_real, Hsoc_imag), dim=0)
-                data.hamiltonian = torch.cat((data.hamiltonian_real, data.hamiltonian_imag), dim=0)
 
                 if self.calculate_band_energy:
                     k_vecs = []
@@ -2458,7 +2373,8 @@ class HamGNNPlusPlusOut(nn.Module):
                     wavefunction = None
             else:                
                 Hcol = self.cat_onsite_and_offsite(data, Hcol_on, Hcol_off)
-                data.hamiltonian = self.cat_onsite_and_offsite(data, data.Hon, data.Hoff)
+                if 'Hon' in data:
+                    data.hamiltonian = self.cat_onsite_and_offsite(data, data.Hon, data.Hoff)
                 
                 # cal band energy
                 if self.calculate_band_energy:
@@ -2527,10 +2443,7 @@ class HamGNNPlusPlusOut(nn.Module):
         # non-soc and non-magnetic
         else:                
             node_sph = self.onsitenet_h(node_attr)
-            node_sph = torch.split(node_sph, self.ham_irreps_dim.tolist(), dim=-1)
-            Hon = self.matrix_merge(node_sph) # shape (Nnodes, nao_max**2)
-            
-            Hon = self.change_index(Hon)
+            Hon = self.matrix_merge_fused(node_sph) # shape (Nnodes, nao_max**2)
         
             # Impose Hermitian symmetry for Hon
             Hon = self.symmetrize_Hon(Hon)
@@ -2540,10 +2453,7 @@ class HamGNNPlusPlusOut(nn.Module):
             # Calculate the off-site Hamiltonian
             # Calculate the contribution of the edges       
             edge_sph = self.offsitenet_h(edge_attr)
-            edge_sph = torch.split(edge_sph, self.ham_irreps_dim.tolist(), dim=-1)        
-            Hoff = self.matrix_merge(edge_sph)
-        
-            Hoff = self.change_index(Hoff)        
+            Hoff = self.matrix_merge_fused(edge_sph)
             # Impose Hermitian symmetry for Hoff
             Hoff = self.symmetrize_Hoff(Hoff, inv_edge_idx)
             if self.add_H0:
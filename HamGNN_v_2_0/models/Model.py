@@ -12,10 +12,12 @@ import torch.nn as nn
 import torch.optim as opt
 from typing import List, Dict, Union
 from torch.nn import functional as F
-from .utils import scatter_plot
+from .utils import scatter_plot, ReservoirSampler
+from .prediction_writer import split_predictions, PredictionWriter
 import numpy as np
 import os
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 
 class Model(pl.LightningModule):
@@ -63,6 +65,15 @@ class Model(pl.LightningModule):
         # For gradients
         self.requires_dr = self.output_module.derivative
 
+        # the graph ids of the test set in the order of the test dataloader, the running index if None
+        self.prediction_keys = None
+
+        # reservoirs of (prediction, target) pairs for the scatter plots, kept on the device
+        self.scatter_samplers = dict()
+        # the scatter plots are drawn in a background thread
+        self._plot_executor = None
+        self._plot_futures = []
+
     def calculate_loss(self, batch, result, mode):
         loss = torch.tensor(0.0, device=self.device)
         for loss_dict in self.losses:
@@ -115,19 +126,40 @@ class Model(pl.LightningModule):
         self.log("validation/total_loss", val_loss,
                  on_step=False, on_epoch=True)
         self.log_metrics(data, pred, 'validation')
-        outputs_pred, outputs_target = {}, {}
-        for loss_dict in self.losses:
-            outputs_pred[loss_dict["prediction"]] = pred[loss_dict["prediction"]].detach().cpu().numpy()  
-            outputs_target[loss_dict["target"]] = data[loss_dict["target"]].detach().cpu().numpy()      
-        return {'pred': outputs_pred, 'target': outputs_target}
+        self._sample_scatter_points(data, pred)
+
+    def on_validation_epoch_start(self):
+        self._reset_scatter_samplers()
 
     def validation_epoch_end(self, validation_step_outputs):
+        self._plot_scatter_samples('validation')
+
+    def _reset_scatter_samplers(self):
+        self.scatter_samplers = {loss_dict["prediction"]: ReservoirSampler(self.max_points_to_scatter, seed=42)
+                                 for loss_dict in self.losses if "target" in loss_dict.keys()}
+
+    def _sample_scatter_points(self, data, pred):
+        for loss_dict in self.losses:
+            if "target" in loss_dict.keys():
+                self.scatter_samplers[loss_dict["prediction"]].update(pred[loss_dict["prediction"]], data[loss_dict["target"]])
+
+    def _plot_scatter_samples(self, mode):
+        """
+        Draw the scatter plots of the sampled (prediction, target) pairs and add them to the logger in a
+        background thread, so that the epoch does not wait for matplotlib.
+        """
+        if self._plot_executor is None:
+            self._plot_executor = ThreadPoolExecutor(max_workers=1)
+        # forget the finished plots, raising their errors
+        for future in [future for future in self._plot_futures if future.done()]:
+            self._plot_futures.remove(future)
+            future.result()
         for loss_dict in self.losses:
             if "target" in loss_dict.keys():
-                pred = np.concatenate([out['pred'][loss_dict["prediction"]]
-                                 for out in validation_step_outputs])
-                target = np.concatenate([out['target'][loss_dict["target"]]
-                                    for out in validation_step_outputs])
+                samples = self.scatter_samplers[loss_dict["prediction"]].numpy()
+                if samples is None:
+                    continue
+                pred, target = samples
                 if (pred.dtype == np.complex64) and (target.dtype == np.complex64):
                     lossname = type(loss_dict['metric']).__name__.split(".")[-1]
                     if lossname.lower() == 'abs_mae':
@@ -136,18 +168,30 @@ class Model(pl.LightningModule):
                     else:
                         pred = np.concatenate([pred.real, pred.imag], axis=-1)
                         target = np.concatenate([target.real, target.imag], axis=-1)
-                # Control the number of scatter points to plot
-                if pred.size > self.max_points_to_scatter:
-                    random_state = np.random.RandomState(seed=42)
-                    perm = list(random_state.permutation(np.arange(pred.size)))
-                    pred = pred.reshape(-1)[perm[:self.max_points_to_scatter]]
-                    target = target.reshape(-1)[perm[:self.max_points_to_scatter]]
-                figure = scatter_plot(pred.reshape(-1), target.reshape(-1))
                 figname = 'PredVSTarget_' + loss_dict['prediction']
-                self.logger.experiment.add_figure(
-                    'validation/'+figname, figure, global_step=self.global_step)
-            else:
-                pass
+                self._plot_futures.append(self._plot_executor.submit(
+                    self._add_scatter_figure, mode+'/'+figname, pred, target, self.global_step))
+
+    def _add_scatter_figure(self, tag, pred, target, global_step):
+        figure = scatter_plot(pred.reshape(-1), target.reshape(-1))
+        self.logger.experiment.add_figure(tag, figure, global_step=global_step)
+
+    def teardown(self, stage=None):
+        # wait for the pending scatter plots and raise their errors
+        for future in self._plot_futures:
+            future.result()
+        self._plot_futures = []
+        if self._plot_executor is not None:
+            self._plot_executor.shutdown(wait=True)
+            self._plot_executor = None
+
+    def on_test_epoch_start(self):
+        # the predictions and targets are written per structure as soon as they are produced
+        if not os.path.exists(self.trainer.logger.log_dir):
+            os.makedirs(self.trainer.logger.log_dir)
+        self.prediction_writer = PredictionWriter(os.path.join(self.trainer.logger.log_dir, 'prediction_store'))
+        self.num_tested = 0
+        self._reset_scatter_samplers()
 
     def test_step(self, data, batch_idx):
         if self.requires_dr:
@@ -169,51 +213,28 @@ class Model(pl.LightningModule):
         loss = self.calculate_loss(data, pred, 'test').detach().item()
         self.log("test/total_loss", loss, on_step=False, on_epoch=True)
         self.log_metrics(data, pred, "test") 
-        outputs_pred, outputs_target = {}, {}
-        for loss_dict in self.losses:
-            outputs_pred[loss_dict["prediction"]] = pred[loss_dict["prediction"]].detach().cpu().numpy()  
-            outputs_target[loss_dict["target"]] = data[loss_dict["target"]].detach().cpu().numpy()      
-        return {'pred': outputs_pred, 'target': outputs_target, 'processed_values': proessed_values}
+
+        # stream the predictions and targets of every structure to the prediction store
+        num_graphs = data.num_graphs
+        if self.prediction_keys is not None:
+            keys = self.prediction_keys[self.num_tested:self.num_tested+num_graphs]
+        else:
+            keys = [str(idx) for idx in range(self.num_tested, self.num_tested+num_graphs)]
+        self.num_tested += num_graphs
+        predictions = split_predictions(data, pred, [loss_dict["prediction"] for loss_dict in self.losses], strict=False)
+        targets = split_predictions(data, data, [loss_dict["target"] for loss_dict in self.losses if "target" in loss_dict.keys()], strict=False)
+        results = [dict([('prediction_'+name, value) for name, value in prediction.items()] + 
+                        [('target_'+name, value) for name, value in target.items()]) for prediction, target in zip(predictions, targets)]
+        self.prediction_writer.write(keys, results)
+
+        self._sample_scatter_points(data, pred)
+        return {'processed_values': proessed_values}
 
     def test_epoch_end(self, test_step_outputs):
-        for loss_dict in self.losses:
-            if "target" in loss_dict.keys():
-                pred = np.concatenate([out['pred'][loss_dict["prediction"]]
-                                 for out in test_step_outputs])
-                target = np.concatenate([out['target'][loss_dict["target"]]
-                                    for out in test_step_outputs])
-                
-                if not os.path.exists(self.trainer.logger.log_dir):
-                    os.makedirs(self.trainer.logger.log_dir)
-                    
-                np.save(os.path.join(
-                    self.trainer.logger.log_dir, 'prediction_'+loss_dict["prediction"]+'.npy'), pred)
-                np.save(os.path.join(self.trainer.logger.log_dir,
-                        'target_'+loss_dict["target"]+'.npy'), target)
-                
-                # plot
-                if (pred.dtype == np.complex64) and (target.dtype == np.complex64):
-                    lossname = type(loss_dict['metric']).__name__.split(".")[-1]
-                    if lossname.lower() == 'abs_mae':
-                        pred = np.absolute(pred)
-                        target = np.absolute(target)
-                    else:
-                        pred = np.concatenate([pred.real, pred.imag], axis=-1)
-                        target = np.concatenate([target.real, target.imag], axis=-1)
-                
-                # Control the number of scatter points to plot
-                if pred.size > self.max_points_to_scatter:
-                    random_state = np.random.RandomState(seed=42)
-                    perm = list(random_state.permutation(np.arange(pred.size)))
-                    pred = pred.reshape(-1)[perm[:self.max_points_to_scatter]]
-                    target = target.reshape(-1)[perm[:self.max_points_to_scatter]]
-                    
-                figure = scatter_plot(pred.reshape(-1), target.reshape(-1))
-                figname = 'PredVSTarget_' + loss_dict['prediction']
-                self.logger.experiment.add_figure(
-                    'test/'+figname, figure, global_step=self.global_step)
-            else:
-                pass
+        self.prediction_writer.close()
+        print(f'The predictions of {self.num_tested} structures are saved in {self.prediction_writer.store_path}')
+
+        self._plot_scatter_samples('test')
         
         if self.post_processing is not None:
             if type(self.post_processing).__name__.split(".")[-1].lower() == 'epc_output':
@@ -0,0 +1,92 @@
+'''
+Descripttion: Solver of the generalized Hermitian eigenproblem H(k)C = S(k)CE used by the band energy losses and band_cal.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-16 18:20:37
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-16 18:20:37
+'''
+
+import torch
+from typing import Tuple
+
+
+class GeneralizedEigenSolver(object):
+    """
+    Reduces the generalized eigenproblem H C = S C E of a batch of Hermitian H and positive definite S
+    to the standard problem Hs Y = Y E and transforms Y back to C. The overlap is factorized once in the
+    constructor, so that several Hamiltonians sharing the same S (e.g. the two spin channels) reuse it.
+
+    Two reductions are supported:
+        'cholesky': S = L L^H, Hs = L^-1 H L^-H and C = L^-H Y. L^-1 is never formed, every product
+            with it is a triangular solve.
+        'lowdin': S = U s U^H, X = S^-1/2 = U s^-1/2 U^H, Hs = X H X and C = X Y.
+
+    Args:
+        SK (torch.Tensor): the overlap matrices, shape: (..., norbs, norbs)
+        method (str): 'cholesky' or 'lowdin'
+    """
+
+    def __init__(self, SK: torch.Tensor, method: str = 'cholesky'):
+        self.method = method.lower()
+        if self.method == 'cholesky':
+            self.L = torch.linalg.cholesky(SK)
+        elif self.method == 'lowdin':
+            s, U = torch.linalg.eigh(SK)
+            self.X = (U*torch.rsqrt(s).unsqueeze(-2).type_as(U)) @ U.conj().transpose(-1, -2)
+        else:
+            raise NotImplementedError(f'The reduction method {method} is not supported!')
+
+    def reduce(self, HK: torch.Tensor) -> torch.Tensor:
+        """
+        Transform H to the orthogonal basis: Hs = L^-1 H L^-H or Hs = X H X.
+        """
+        if self.method == 'cholesky':
+            A = torch.linalg.solve_triangular(self.L, HK, upper=False) # L^-1 H
+            return torch.linalg.solve_triangular(self.L, A.conj().transpose(-1, -2), upper=False).conj().transpose(-1, -2) # (L^-1 (L^-1 H)^H)^H = L^-1 H L^-H
+        else:
+            return self.X @ HK @ self.X
+
+    def back_transform(self, Y: torch.Tensor) -> torch.Tensor:
+        """
+        Transform the eigenvectors (columns of Y) of Hs to the eigenvectors of the generalized problem.
+        """
+        if self.method == 'cholesky':
+            return torch.linalg.solve_triangular(self.L.conj().transpose(-1, -2), Y, upper=True) # L^-H Y
+        else:
+            return self.X @ Y
+
+    def eigh(self, HK: torch.Tensor, band_window: Tuple[int, int] = None, eigenvectors: bool = True):
+        """
+        Solve H C = S C E.
+
+        Args:
+            HK (torch.Tensor): the Hamiltonian matrices, shape: (..., norbs, norbs)
+            band_window (tuple, optional): (start, stop) indices of the bands to return, e.g. a window
+                around the Fermi level. Only the eigenvectors of these bands are transformed back.
+            eigenvectors (bool): whether to return the eigenvectors.
+
+        Returns:
+            eigenvalues, shape: (..., nbands), and the eigenvectors in the columns of a (..., norbs, nbands)
+            tensor if eigenvectors is True.
+        """
+        Hs = self.reduce(HK)
+        if not eigenvectors:
+            eigenvalues = torch.linalg.eigvalsh(Hs)
+            if band_window is not None:
+                eigenvalues = eigenvalues[..., band_window[0]:band_window[1]]
+            return eigenvalues
+        eigenvalues, Y = torch.linalg.eigh(Hs)
+        if band_window is not None:
+            eigenvalues = eigenvalues[..., band_window[0]:band_window[1]]
+            Y = Y[..., band_window[0]:band_window[1]]
+        return eigenvalues, self.back_transform(Y)
+
+
+def generalized_eigh(HK: torch.Tensor, SK: torch.Tensor, method: str = 'cholesky',
+                     band_window: Tuple[int, int] = None, eigenvectors: bool = True):
+    """
+    Solve the generalized eigenproblem H C = S C E for a batch of matrices.
+    See GeneralizedEigenSolver for the arguments.
+    """
+    return GeneralizedEigenSolver(SK, method=method).eigh(HK, band_window=band_window, eigenvectors=eigenvectors)
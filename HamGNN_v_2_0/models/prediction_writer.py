@@ -0,0 +1,170 @@
+'''
+Descripttion: Per-structure prediction store: splits the batched predictions into structures and streams them to an indexed graph store.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 03:20:42
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 03:20:42
+'''
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+from ..GraphData.graph_store import GraphStoreWriter, GraphStoreDataset, is_graph_store
+
+# the predictions made of on-site blocks followed by off-site blocks for every structure
+BLOCK_OUTPUTS = ('hamiltonian', 'hamiltonian_real', 'hamiltonian_imag', 'overlap')
+
+
+def _split(value: np.ndarray, counts: list) -> list:
+    return np.split(value, np.cumsum(counts)[:-1], axis=0)
+
+
+def split_predictions(data, pred, names: list, strict: bool = True) -> list:
+    """
+    Split the batched predictions (or targets) into the structures of the batch.
+
+    The block outputs (see BLOCK_OUTPUTS) keep the layout of the training targets of a single structure: the
+    on-site blocks followed by the off-site blocks, and for SOC the real blocks followed by the imaginary
+    blocks. The other outputs are split per atom, per edge or per structure according to their length.
+
+    Args:
+        data (Batch): the batch.
+        pred (dict): the predictions (or the batch itself for the targets).
+        names (list): the names of the outputs to split.
+        strict (bool): If True, a ValueError is raised for outputs that can not be split, otherwise they are skipped.
+
+    Returns:
+        list: a dict of numpy arrays for every structure of the batch.
+    """
+    num_graphs = data.num_graphs
+    node_counts = torch.bincount(data.batch, minlength=num_graphs).tolist()
+    edge_counts = torch.bincount(data.batch[data.edge_index[0]], minlength=num_graphs).tolist()
+    block_counts = [n + e for n, e in zip(node_counts, edge_counts)]
+    results = [dict() for _ in range(num_graphs)]
+    for name in names:
+        value = pred[name]
+        value = value.detach().cpu().numpy() if isinstance(value, torch.Tensor) else np.asarray(value)
+        if name in BLOCK_OUTPUTS and len(value) == 2*sum(block_counts):
+            # SOC: the real parts of all structures followed by the imaginary parts
+            real, imag = np.split(value, 2, axis=0)
+            splits = [np.concatenate(parts, axis=0) for parts in zip(_split(real, block_counts), _split(imag, block_counts))]
+        elif name in BLOCK_OUTPUTS and len(value) == sum(block_counts):
+            splits = _split(value, block_counts)
+        elif value.ndim > 0 and len(value) == data.num_nodes:
+            splits = _split(value, node_counts)
+        elif value.ndim > 0 and len(value) == data.edge_index.shape[1]:
+            splits = _split(value, edge_counts)
+        elif value.ndim > 0 and len(value) == num_graphs:
+            splits = list(value)
+        elif strict:
+            raise ValueError(f'The prediction {name} can not be split into the structures of the batch!')
+        else:
+            continue
+        for result, split in zip(results, splits):
+            result[name] = split
+    return results
+
+
+class PredictionWriter(object):
+    """
+    Appends the predictions of every structure, keyed by its graph id, to a graph store as soon as they
+    are produced, so that the predictions of a whole test set never have to be held in memory. Every
+    structure is one record (a Data object with the predicted arrays) that can be read on its own with
+    PredictionReader or GraphStoreDataset.
+
+    Usage:
+        with PredictionWriter('./prediction_store') as writer:
+            writer.write(keys, split_predictions(batch, pred, ['hamiltonian']))
+    """
+
+    def __init__(self, store_path: str, shard_size: int = 1000):
+        self.store_path = store_path
+        self.writer = GraphStoreWriter(store_path, shard_size=shard_size)
+
+    def __len__(self):
+        return len(self.writer)
+
+    def __contains__(self, key):
+        return key in self.writer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, keys: list, results: list):
+        for key, result in zip(keys, results):
+            self.writer.append(Data(**{name: torch.from_numpy(np.ascontiguousarray(value)) for name, value in result.items()}), key=key)
+
+    def close(self):
+        self.writer.close()
+
+
+class PredictionReader(object):
+    """
+    Reads the predictions of single structures from a store written by PredictionWriter; only the
+    slices of the requested structure are read from the memory-mapped shards.
+
+    Usage:
+        predictions = PredictionReader('./prediction_store')
+        H = predictions['0']['prediction_hamiltonian']
+    """
+
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        self.dataset = GraphStoreDataset(store_path)
+        self.index = {key: idx for idx, key in enumerate(self.dataset.keys)}
+
+    @property
+    def keys(self):
+        return self.dataset.keys
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __contains__(self, key):
+        return str(key) in self.index
+
+    def __getitem__(self, key) -> dict:
+        key = str(key)
+        if key not in self.index:
+            raise KeyError(f'The structure {key} was not found in {self.store_path}!')
+        data = self.dataset[self.index[key]]
+        return {name: data[name].numpy() for name in self.dataset.schema}
+
+    def select(self, keys: list, name: str = 'prediction_hamiltonian', transform=None):
+        """
+        A list-like view of the prediction name of the structures keys, read when an item is accessed.
+        transform(idx, value) can post-process every item, e.g. keep only the on-site blocks.
+        """
+        return LazyList(lambda idx: self[keys[idx]][name] if transform is None else transform(idx, self[keys[idx]][name]), len(keys))
+
+
+class LazyList(object):
+    """
+    A read-only sequence whose items are computed by getter(idx) when they are accessed.
+    """
+
+    def __init__(self, getter, length: int):
+        self.getter = getter
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.length
+        if idx < 0 or idx >= self.length:
+            raise IndexError(f'Index {idx} is out of range for a list of length {self.length}!')
+        return self.getter(idx)
+
+    def __iter__(self):
+        for idx in range(self.length):
+            yield self.getter(idx)
+
+
+def is_prediction_store(path) -> bool:
+    return path is not None and is_graph_store(path)
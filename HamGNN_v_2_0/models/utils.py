@@ -15,11 +15,12 @@ from torch.nn import (Linear, Bilinear, Sigmoid, Softplus, ELU, ReLU, SELU, SiLU
 from typing import Callable, Union
 import re
 import torch.nn.functional as F
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from easydict import EasyDict
 from scipy.stats import gaussian_kde
 from typing import Optional
 from e3nn import o3
+from utils_openmx.inverse_edge import find_inverse_edge_index as _find_inverse_edge_index
 
 def swish(x):
     return x * x.sigmoid()
@@ -101,7 +102,9 @@ def get_activation(name):
         raise NameError("Not supported activation: {}".format(name))
 
 def scatter_plot(pred: np.ndarray = None, target: np.ndarray = None):
-    fig, ax = plt.subplots()
+    # The figure is built without pyplot so that it can be drawn outside the main thread
+    fig = Figure()
+    ax = fig.subplots()
     """
         try:
         # Calculate the point density
@@ -120,12 +123,62 @@ def scatter_plot(pred: np.ndarray = None, target: np.ndarray = None):
     min_val, max_val = np.min([target, pred]), np.max([target, pred])
     ax.plot([min_val, max_val], [min_val, max_val],
             ls="--", linewidth=1, c='r')
-    plt.xlabel('Prediction', fontsize=15)
-    plt.ylabel('Target', fontsize=15)
-    plt.xticks(fontsize=15)
-    plt.yticks(fontsize=15)
+    ax.set_xlabel('Prediction', fontsize=15)
+    ax.set_ylabel('Target', fontsize=15)
+    ax.tick_params(labelsize=15)
     return fig
 
+
+class ReservoirSampler(object):
+    """
+    Keeps a uniform random sample (without replacement) of at most max_points elements of a stream of
+    tensors on the device of the tensors. Every element gets a random key and the elements with the
+    max_points largest keys seen so far are kept, so each update only costs a top-k over the reservoir
+    and the new elements whose keys can enter it.
+
+    Several tensors with the same number of elements (e.g. predictions and targets) are sampled jointly.
+    """
+    def __init__(self, max_points: int, seed: int = 42):
+        self.max_points = max_points
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self.generator = None
+        self.keys = None
+        self.values = None
+
+    def update(self, *tensors):
+        values = [tensor.detach().reshape(-1) for tensor in tensors]
+        if any(value.numel() != values[0].numel() for value in values):
+            raise ValueError('The tensors sampled together must have the same number of elements!')
+        device = values[0].device
+        if self.generator is None:
+            self.generator = torch.Generator(device=device)
+            self.generator.manual_seed(self.seed)
+        keys = torch.rand(values[0].numel(), generator=self.generator, device=device)
+        if self.keys is not None:
+            if len(self.keys) >= self.max_points:
+                # only the elements with keys above the smallest kept key can enter a full reservoir
+                enter = keys > self.keys.min()
+                keys = keys[enter]
+                values = [value[enter] for value in values]
+            keys = torch.cat([self.keys, keys])
+            values = [torch.cat([kept, value]) for kept, value in zip(self.values, values)]
+        if len(keys) > self.max_points:
+            keys, top = torch.topk(keys, self.max_points, sorted=False)
+            values = [value[top] for value in values]
+        self.keys, self.values = keys, values
+
+    def numpy(self):
+        """
+        The sampled elements of every tensor as numpy arrays, None if nothing has been sampled.
+        """
+        if self.values is None:
+            return None
+        return [value.cpu().numpy() for value in self.values]
+
+
 class cosine_similarity_loss(nn.Module):
     def __init__(self):
         super(cosine_similarity_loss, self).__init__()
@@ -252,6 +305,14 @@ def triplets(edge_index, num_nodes, cell_shift):
                
     return col, row, idx_i, idx_j, idx_k, idx_kj, idx_ji
 
+def inverse_edge_index(edge_index: torch.Tensor, cell_shift: torch.Tensor, validate: bool = True) -> torch.Tensor:
+    """
+    The index of the inverse edge (dst, src, -cell_shift) of every edge (src, dst, cell_shift).
+    See utils_openmx.inverse_edge.find_inverse_edge_index, which is shared with the DFT converters.
+    """
+    inv_edge_idx = _find_inverse_edge_index(edge_index.detach().cpu().numpy(), cell_shift.detach().cpu().numpy(), validate=validate)
+    return torch.from_numpy(inv_edge_idx).to(edge_index.device)
+
 def prod(x):
     """Compute the product of a sequence."""
     out = 1
@@ -810,18 +810,322 @@ void Input(FILE *fp)
 
 void free_scfout();
 #include <stdbool.h>
+/* An edge (src, tar, shift) and its index, sorted to find the inverse edges (tar, src, -shift) */
+typedef struct
+{
+	int key[5];
+	int idx;
+} edge_key;
+
+static int compare_edge_key(const void *a, const void *b)
+{
+	const int *ka = ((const edge_key *)a)->key;
+	const int *kb = ((const edge_key *)b)->key;
+	int k;
+	for (k = 0; k < 5; k++)
+	{
+		if (ka[k] != kb[k])
+			return ka[k] < kb[k] ? -1 : 1;
+	}
+	return 0;
+}
+
+static int compare_edge(const void *a, const void *b)
+{
+	int order = compare_edge_key(a, b);
+	if (order != 0)
+		return order;
+	return ((const edge_key *)a)->idx - ((const edge_key *)b)->idx;
+}
+
+/* inv_edge_idx[iedge] is the index of the first edge (tar, src, -shift) of the edge (src, tar, shift), or -1 if
+   there is none. One sort and a binary search per edge replace the comparison of all pairs of edges. */
+static void find_inv_edge_idx(int num_edges, const int *src, const int *tar, const int *shift, int *inv_edge_idx)
+{
+	int iedge, k;
+	edge_key *sorted, query, *found;
+
+	sorted = (edge_key *)malloc(sizeof(edge_key) * (num_edges + 1));
+	for (iedge = 0; iedge < num_edges; iedge++)
+	{
+		sorted[iedge].key[0] = src[iedge];
+		sorted[iedge].key[1] = tar[iedge];
+		for (k = 0; k < 3; k++)
+		{
+			sorted[iedge].key[k + 2] = shift[3 * iedge + k];
+		}
+		sorted[iedge].idx = iedge;
+	}
+	qsort(sorted, num_edges, sizeof(edge_key), compare_edge);
+
+	for (iedge = 0; iedge < num_edges; iedge++)
+	{
+		query.key[0] = tar[iedge];
+		query.key[1] = src[iedge];
+		for (k = 0; k < 3; k++)
+		{
+			query.key[k + 2] = -shift[3 * iedge + k];
+		}
+		found = (edge_key *)bsearch(&query, sorted, num_edges, sizeof(edge_key), compare_edge_key);
+		if (found == NULL)
+		{
+			inv_edge_idx[iedge] = -1;
+			continue;
+		}
+		while (found > sorted && compare_edge_key(found - 1, &query) == 0)
+			found--;
+		inv_edge_idx[iedge] = found->idx;
+	}
+	free(sorted);
+}
+
+/* Binary output (read_openmx file.scfout -b)
+   HS.bin is written in the native byte order:
+     char   magic[8] = "HSBIN001"
+     int    atomnum, num_edges, SpinP_switch
+     int    Total_NumOrbs[atomnum]
+     int    edge_index[2][num_edges]
+     double pos[atomnum][3]
+     int    cell_shift[num_edges][3]
+     int    inv_edge_idx[num_edges]
+     double nbr_shift[num_edges][3]
+     double Hon[SpinP_switch+1][on-site elements], Hoff[SpinP_switch+1][off-site elements]
+     double iHon[3][on-site elements], iHoff[3][off-site elements]  (only if SpinP_switch == 3)
+     double Son[on-site elements], Soff[off-site elements]
+     double Lon[on-site elements][3], Loff[off-site elements][3]
+   The blocks of each matrix are stored in the same order and layout as in HS.json. */
+static void write_block(FILE *fp, double **M, int TNO1, int TNO2)
+{
+	int i;
+	for (i = 0; i < TNO1; i++)
+	{
+		fwrite(M[i], sizeof(double), TNO2, fp);
+	}
+}
+
+static void write_L_block(FILE *fp, double ***M, int TNO1, int TNO2)
+{
+	int i, j;
+	for (i = 0; i < TNO1; i++)
+	{
+		for (j = 0; j < TNO2; j++)
+		{
+			fwrite(M[i][j], sizeof(double), 3, fp);
+		}
+	}
+}
+
+int write_binary(const char *fname)
+{
+	int ct_AN, h_AN, Gh_AN, Rn, spin, num_edges, iedge, k;
+	int *src, *tar, *shift, *inv_edge_idx;
+	double *nbr;
+	FILE *fp;
+	const char magic[8] = {'H', 'S', 'B', 'I', 'N', '0', '0', '1'};
+
+	num_edges = 0;
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		num_edges += FNAN[ct_AN];
+	}
+
+	src = (int *)malloc(sizeof(int) * (num_edges + 1));
+	tar = (int *)malloc(sizeof(int) * (num_edges + 1));
+	shift = (int *)malloc(sizeof(int) * 3 * (num_edges + 1));
+	inv_edge_idx = (int *)malloc(sizeof(int) * (num_edges + 1));
+	nbr = (double *)malloc(sizeof(double) * 3 * (num_edges + 1));
+
+	iedge = 0;
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		for (h_AN = 1; h_AN <= FNAN[ct_AN]; h_AN++)
+		{
+			Rn = ncn[ct_AN][h_AN];
+			src[iedge] = ct_AN - 1;
+			tar[iedge] = natn[ct_AN][h_AN] - 1;
+			for (k = 0; k < 3; k++)
+			{
+				shift[3 * iedge + k] = atv_ijk[Rn][k + 1];
+				nbr[3 * iedge + k] = atv[Rn][k + 1];
+			}
+			iedge++;
+		}
+	}
+	find_inv_edge_idx(num_edges, src, tar, shift, inv_edge_idx);
+
+	fp = fopen(fname, "wb");
+	if (fp == NULL)
+	{
+		printf("\nFailed to create %s file!\n", fname);
+		return 1;
+	}
+
+	fwrite(magic, sizeof(char), 8, fp);
+	fwrite(&atomnum, sizeof(int), 1, fp);
+	fwrite(&num_edges, sizeof(int), 1, fp);
+	fwrite(&SpinP_switch, sizeof(int), 1, fp);
+	fwrite(&Total_NumOrbs[1], sizeof(int), atomnum, fp);
+	fwrite(src, sizeof(int), num_edges, fp);
+	fwrite(tar, sizeof(int), num_edges, fp);
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		fwrite(&Gxyz[ct_AN][1], sizeof(double), 3, fp);
+	}
+	fwrite(shift, sizeof(int), 3 * num_edges, fp);
+	fwrite(inv_edge_idx, sizeof(int), num_edges, fp);
+	fwrite(nbr, sizeof(double), 3 * num_edges, fp);
+
+	/* Hon and Hoff */
+	for (spin = 0; spin <= SpinP_switch; spin++)
+	{
+		for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+		{
+			write_block(fp, Hks[spin][ct_AN][0], Total_NumOrbs[ct_AN], Total_NumOrbs[natn[ct_AN][0]]);
+		}
+	}
+	for (spin = 0; spin <= SpinP_switch; spin++)
+	{
+		for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+		{
+			for (h_AN = 1; h_AN <= FNAN[ct_AN]; h_AN++)
+			{
+				Gh_AN = natn[ct_AN][h_AN];
+				write_block(fp, Hks[spin][ct_AN][h_AN], Total_NumOrbs[ct_AN], Total_NumOrbs[Gh_AN]);
+			}
+		}
+	}
+
+	/* iHon and iHoff */
+	if (SpinP_switch == 3)
+	{
+		for (spin = 0; spin <= 2; spin++)
+		{
+			for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+			{
+				write_block(fp, iHks[spin][ct_AN][0], Total_NumOrbs[ct_AN], Total_NumOrbs[natn[ct_AN][0]]);
+			}
+		}
+		for (spin = 0; spin <= 2; spin++)
+		{
+			for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+			{
+				for (h_AN = 1; h_AN <= FNAN[ct_AN]; h_AN++)
+				{
+					Gh_AN = natn[ct_AN][h_AN];
+					write_block(fp, iHks[spin][ct_AN][h_AN], Total_NumOrbs[ct_AN], Total_NumOrbs[Gh_AN]);
+				}
+			}
+		}
+	}
+
+	/* Son and Soff */
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		write_block(fp, OLP[ct_AN][0], Total_NumOrbs[ct_AN], Total_NumOrbs[natn[ct_AN][0]]);
+	}
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		for (h_AN = 1; h_AN <= FNAN[ct_AN]; h_AN++)
+		{
+			Gh_AN = natn[ct_AN][h_AN];
+			write_block(fp, OLP[ct_AN][h_AN], Total_NumOrbs[ct_AN], Total_NumOrbs[Gh_AN]);
+		}
+	}
+
+	/* Lon and Loff */
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		write_L_block(fp, OLP_L[ct_AN][0], Total_NumOrbs[ct_AN], Total_NumOrbs[natn[ct_AN][0]]);
+	}
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		for (h_AN = 1; h_AN <= FNAN[ct_AN]; h_AN++)
+		{
+			Gh_AN = natn[ct_AN][h_AN];
+			write_L_block(fp, OLP_L[ct_AN][h_AN], Total_NumOrbs[ct_AN], Total_NumOrbs[Gh_AN]);
+		}
+	}
+
+	fclose(fp);
+	free(src);
+	free(tar);
+	free(shift);
+	free(inv_edge_idx);
+	free(nbr);
+	return 0;
+}
+
+/* Write the index of the inverse edge of every edge that has one to HS.json */
+static void write_inv_edge_idx(FILE *fp_json)
+{
+	int ct_AN, h_AN, Rn, num_edges, iedge, k;
+	int first_print = 1;
+	int *src, *tar, *shift, *inv_edge_idx;
+
+	num_edges = 0;
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		num_edges += FNAN[ct_AN];
+	}
+	src = (int *)malloc(sizeof(int) * (num_edges + 1));
+	tar = (int *)malloc(sizeof(int) * (num_edges + 1));
+	shift = (int *)malloc(sizeof(int) * 3 * (num_edges + 1));
+	inv_edge_idx = (int *)malloc(sizeof(int) * (num_edges + 1));
+
+	iedge = 0;
+	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
+	{
+		for (h_AN = 1; h_AN <= FNAN[ct_AN]; h_AN++)
+		{
+			Rn = ncn[ct_AN][h_AN];
+			src[iedge] = ct_AN - 1;
+			tar[iedge] = natn[ct_AN][h_AN] - 1;
+			for (k = 0; k < 3; k++)
+			{
+				shift[3 * iedge + k] = atv_ijk[Rn][k + 1];
+			}
+			iedge++;
+		}
+	}
+	find_inv_edge_idx(num_edges, src, tar, shift, inv_edge_idx);
+
+	for (iedge = 0; iedge < num_edges; iedge++)
+	{
+		if (inv_edge_idx[iedge] < 0)
+			continue;
+		if (first_print)
+		{
+			fprintf(fp_json, "%i", inv_edge_idx[iedge]);
+			first_print = 0;
+		}
+		else
+		{
+			fprintf(fp_json, ",%i", inv_edge_idx[iedge]);
+		}
+	}
+
+	free(src);
+	free(tar);
+	free(shift);
+	free(inv_edge_idx);
+}
+
 int main(int argc, char *argv[])
 {
 	static int ct_AN, h_AN, Gh_AN, i, j, TNO1, TNO2;
 	static int spin, Rn, myid;
-	static int src, tar, src_tmp, tar_tmp, dir, idx_tmp, ct_AN_tmp, h_AN_tmp, Rn_tmp, shift[3], shift_tmp[3];
-	static _Bool first_print;
 	static double *a;
 	static FILE *fp;
 	static FILE *fp_json;
 	double Ebond[30], Es, Ep;
 	read_scfout(argv);
 
+	/* read_openmx file.scfout -b: write HS.bin instead of HS.json */
+	if (argc > 2 && (strcmp(argv[2], "-b") == 0 || strcmp(argv[2], "--binary") == 0))
+	{
+		return write_binary("HS.bin");
+	}
+
 	// 检查是否有任何原子具有邻居
 	int has_neighbors = 0;
 	for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
@@ -937,56 +1241,7 @@ int main(int argc, char *argv[])
 	fprintf(fp_json, "\"inv_edge_idx\": [");
 	if (has_neighbors)
 	{
-		first_print = true;
-		for (ct_AN = 1; ct_AN <= atomnum; ct_AN++)
-		{
-			if (FNAN[ct_AN] == 0)
-				continue; // 跳过没有邻居的原子
-			for (h_AN = 1; h_AN <= FNAN[ct_AN]; h_AN++)
-			{
-				Rn = ncn[ct_AN][h_AN];
-				src = ct_AN - 1;
-				tar = natn[ct_AN][h_AN] - 1;
-				for (dir = 0; dir < 3; dir++)
-				{
-					shift[dir] = atv_ijk[Rn][dir + 1];
-				}
-				idx_tmp = 0;
-				for (ct_AN_tmp = 1; ct_AN_tmp <= atomnum; ct_AN_tmp++)
-				{
-					if (FNAN[ct_AN_tmp] == 0)
-						continue; // 跳过没有邻居的原子
-					for (h_AN_tmp = 1; h_AN_tmp <= FNAN[ct_AN_tmp]; h_AN_tmp++)
-					{
-						Rn_tmp = ncn[ct_AN_tmp][h_AN_tmp];
-						src_tmp = ct_AN_tmp - 1;
-						tar_tmp = natn[ct_AN_tmp][h_AN_tmp] - 1;
-						for (dir = 0; dir < 3; dir++)
-						{
-							shift_tmp[dir] = atv_ijk[Rn_tmp][dir + 1];
-						}
-						// 不满足打印条件
-						if ((src_tmp != tar) || (tar_tmp != src) || (shift_tmp[0] + shift[0]) || (shift_tmp[1] + shift[1]) || (shift_tmp[2] + shift[2]))
-						{
-							idx_tmp++;
-							continue;
-						}
-						// 满足打印条件
-						if (first_print)
-						{
-							fprintf(fp_json, "%i", idx_tmp);
-							first_print = false;
-						}
-						else
-						{
-							fprintf(fp_json, ",%i", idx_tmp);
-						}
-						goto flag;
-					} // h_AN_tmp
-				} // ct_AN_tmp
-			flag:;
-			} // h_AN
-		} // ct_AN
+		write_inv_edge_idx(fp_json);
 	}
 	fprintf(fp_json, "],\n");
 
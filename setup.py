@@ -26,8 +26,11 @@ setup(
         "console_scripts": [
             "HamGNN1.0 = HamGNN_v_1_0.main:HamGNN",
             "HamGNN2.0 = HamGNN_v_2_0.main:HamGNN",
+            "HamGNN2.0_predict = HamGNN_v_2_0.inference:main",
             "band_cal = utils_openmx.band_cal:main",
             "graph_data_gen = utils_openmx.graph_data_gen:main",
+            "graph_store_convert = HamGNN_v_2_0.GraphData.graph_store:main",
+            "kpm_dos = utils_openmx.kpm_dos:main",
             "poscar2openmx = utils_openmx.poscar2openmx:main"
         ]
     },
@@ -0,0 +1,13 @@
+'''
+Descripttion: pytest configuration: the packages are imported from the root of the repository.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 10:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 10:02:11
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+'''
+Descripttion: Tests of the budgeted batch sampler.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 10:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 10:02:11
+'''
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+
+from HamGNN_v_2_0.GraphData.batch_sampler import BudgetBatchSampler
+
+
+def costs(num_graphs=200, seed=0):
+    return np.random.RandomState(seed).randint(1, 50, size=num_graphs)
+
+
+@pytest.mark.parametrize('shuffle, sort, bucket_size', [(False, False, None), (False, True, None), (True, True, None),
+                                                        (True, True, 16), (True, False, None)])
+def test_batches_respect_the_budget(shuffle, sort, bucket_size):
+    cost = costs()
+    sampler = BudgetBatchSampler(cost, budget=100, shuffle=shuffle, sort=sort, bucket_size=bucket_size)
+    batches = list(sampler)
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(cost)))
+    assert all(np.sum(cost[batch]) <= 100 for batch in batches)
+    assert 0 < sampler.efficiency() <= 1
+
+
+def test_keeps_the_order_without_shuffle_and_sort():
+    sampler = BudgetBatchSampler(np.ones(10), budget=3, shuffle=False, sort=False)
+    assert list(sampler) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def test_oversized_graph_gets_its_own_batch():
+    sampler = BudgetBatchSampler(np.array([1, 10, 1]), budget=5, shuffle=False, sort=False)
+    assert list(sampler) == [[0], [1], [2]]
+
+
+def test_sorted_batches_group_similar_sizes():
+    cost = costs()
+    batches = list(BudgetBatchSampler(cost, budget=100, shuffle=False, sort=True))
+    largest = [np.max(cost[batch]) for batch in batches]
+    assert largest == sorted(largest, reverse=True)
+
+
+def test_shuffled_batches_change_between_epochs():
+    sampler = BudgetBatchSampler(costs(), budget=100, shuffle=True, sort=True)
+    compositions = []
+    for epoch in range(2):
+        sampler.set_epoch(epoch)
+        compositions.append({tuple(sorted(batch)) for batch in sampler})
+    assert compositions[0] != compositions[1]
+    # the same epoch gives the same batches
+    sampler.set_epoch(0)
+    assert {tuple(sorted(batch)) for batch in sampler} == compositions[0]
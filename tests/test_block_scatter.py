@@ -0,0 +1,71 @@
+'''
+Descripttion: Tests of the vectorized block scatter against the per-block mask assignment it replaces.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 10:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 10:02:11
+'''
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils_openmx.block_scatter import BlockScatter
+
+NAO_MAX = 6
+# an unsorted basis definition, for which the mask order and the basis_def order differ
+BASIS_DEF = {1: np.array([0, 1]), 6: np.array([0, 1, 2, 3, 4]), 8: np.array([3, 0, 5, 1])}
+
+
+def random_blocks(z_row, z_col, rng, dim=None):
+    shape = lambda zi, zj: (len(BASIS_DEF[zi]), len(BASIS_DEF[zj])) + (() if dim is None else (dim,))
+    return [rng.rand(*shape(zi, zj)) for zi, zj in zip(z_row, z_col)]
+
+
+def reference(blocks, z_row, z_col, mask_order, dim=None):
+    shape = (len(blocks), NAO_MAX**2) if dim is None else (len(blocks), NAO_MAX**2, dim)
+    out = np.zeros(shape)
+    for idx, (block, zi, zj) in enumerate(zip(blocks, z_row, z_col)):
+        H = np.zeros((NAO_MAX, NAO_MAX) + (() if dim is None else (dim,)))
+        if mask_order:
+            mask = np.zeros((NAO_MAX, NAO_MAX), dtype=bool)
+            mask[BASIS_DEF[zi][:, None], BASIS_DEF[zj][None, :]] = True
+            H[mask] = block.reshape((-1,) if dim is None else (-1, dim))
+        else:
+            H[BASIS_DEF[zi][:, None], BASIS_DEF[zj][None, :]] = block
+        out[idx] = H.reshape(out[idx].shape)
+    return out
+
+
+@pytest.mark.parametrize('mask_order', [True, False])
+@pytest.mark.parametrize('dim', [None, 3])
+def test_scatter_matches_the_mask_assignment(mask_order, dim):
+    rng = np.random.RandomState(0)
+    species = np.array(list(BASIS_DEF))
+    z_row, z_col = species[rng.randint(len(species), size=20)], species[rng.randint(len(species), size=20)]
+    blocks = random_blocks(z_row, z_col, rng, dim=dim)
+    scatter = BlockScatter(BASIS_DEF, NAO_MAX, mask_order=mask_order)
+    expected = reference(blocks, z_row, z_col, mask_order, dim=dim)
+    np.testing.assert_array_equal(scatter.scatter(blocks, z_row, z_col, dim=dim), expected)
+    # the blocks concatenated into one array
+    flat = np.concatenate([block.reshape(-1) for block in blocks])
+    np.testing.assert_array_equal(scatter.scatter(flat, z_row, z_col, dim=dim), expected)
+
+
+def test_scatter_graph():
+    rng = np.random.RandomState(1)
+    z = np.array([1, 6, 8, 6])
+    edge_index = rng.randint(len(z), size=(2, 9))
+    on_blocks = random_blocks(z, z, rng)
+    off_blocks = random_blocks(z[edge_index[0]], z[edge_index[1]], rng)
+    out = BlockScatter(BASIS_DEF, NAO_MAX).scatter_graph(on_blocks, off_blocks, z, edge_index)
+    assert out.shape == (len(z) + edge_index.shape[1], NAO_MAX**2)
+    np.testing.assert_array_equal(out[:len(z)], reference(on_blocks, z, z, True))
+    np.testing.assert_array_equal(out[len(z):], reference(off_blocks, z[edge_index[0]], z[edge_index[1]], True))
+
+
+def test_wrong_number_of_elements():
+    scatter = BlockScatter(BASIS_DEF, NAO_MAX)
+    with pytest.raises(ValueError):
+        scatter.scatter([np.zeros(3)], np.array([1]), np.array([6]))
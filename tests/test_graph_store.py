@@ -0,0 +1,133 @@
+'''
+Descripttion: Tests of the sharded graph store: round trip, append and resume of interrupted runs.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 10:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 10:02:11
+'''
+
+import os
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+
+from torch_geometric.data import Data
+from HamGNN_v_2_0.GraphData.graph_store import (GraphStoreWriter, GraphStoreDataset, convert_npz_to_store,
+                                                is_graph_store, PENDING_DIR_NAME)
+
+
+def make_graph(num_atoms: int, num_edges: int, seed: int) -> Data:
+    rng = np.random.RandomState(seed)
+    return Data(z=torch.LongTensor(rng.randint(1, 10, size=num_atoms)),
+                pos=torch.FloatTensor(rng.rand(num_atoms, 3)),
+                edge_index=torch.LongTensor(rng.randint(num_atoms, size=(2, num_edges))),
+                cell_shift=torch.LongTensor(rng.randint(-1, 2, size=(num_edges, 3))),
+                Hon=torch.FloatTensor(rng.rand(num_atoms, 4)),
+                Hoff=torch.FloatTensor(rng.rand(num_edges, 4)),
+                cell=torch.FloatTensor(rng.rand(1, 3, 3)),
+                doping_charge=torch.FloatTensor([0.5*seed]),
+                energy=torch.tensor(float(seed)),
+                natoms=num_atoms)
+
+
+def assert_same_graph(data: Data, expected: Data):
+    keys = lambda graph: sorted(graph.keys() if callable(graph.keys) else graph.keys)
+    assert keys(data) == keys(expected)
+    for key in keys(expected):
+        if isinstance(expected[key], torch.Tensor):
+            assert data[key].dtype == expected[key].dtype
+            assert torch.equal(data[key], expected[key]), key
+        else:
+            assert data[key] == expected[key], key
+
+
+def test_round_trip(tmp_path):
+    graphs = [make_graph(num_atoms, num_edges, seed) for seed, (num_atoms, num_edges) in enumerate([(3, 7), (1, 0), (5, 12), (2, 4), (4, 9)])]
+    with GraphStoreWriter(str(tmp_path), shard_size=2) as writer:
+        for idx, graph in enumerate(graphs):
+            writer.append(graph, key=f'graph_{idx}')
+
+    assert is_graph_store(str(tmp_path))
+    dataset = GraphStoreDataset(str(tmp_path))
+    assert len(dataset) == len(graphs)
+    assert dataset.keys == [f'graph_{idx}' for idx in range(len(graphs))]
+    assert len(dataset.index['shards']) == 3
+    for idx, graph in enumerate(graphs):
+        assert_same_graph(dataset[idx], graph)
+    assert_same_graph(dataset[-1], graphs[-1])
+    with pytest.raises(IndexError):
+        dataset[len(graphs)]
+
+    np.testing.assert_array_equal(dataset.field_counts('z'), [graph.num_nodes for graph in graphs])
+    np.testing.assert_array_equal(dataset.field_counts('edge_index'), [graph.edge_index.shape[1] for graph in graphs])
+    assert not os.path.exists(os.path.join(str(tmp_path), PENDING_DIR_NAME))
+
+
+def test_exclude_fields(tmp_path):
+    graph = make_graph(3, 5, 0)
+    with GraphStoreWriter(str(tmp_path)) as writer:
+        writer.append(graph)
+    dataset = GraphStoreDataset(str(tmp_path))
+    dataset.exclude_fields(['Hon', 'Hoff'])
+    data = dataset[0]
+    assert 'Hon' not in data and 'Hoff' not in data
+    assert torch.equal(data.edge_index, graph.edge_index)
+
+
+def test_append_to_existing_store(tmp_path):
+    graphs = [make_graph(2, 3, seed) for seed in range(3)]
+    with GraphStoreWriter(str(tmp_path), shard_size=10) as writer:
+        writer.append(graphs[0], key='a')
+    with GraphStoreWriter(str(tmp_path), shard_size=10) as writer:
+        assert len(writer) == 1 and 'a' in writer
+        with pytest.raises(KeyError):
+            writer.append(graphs[1], key='a')
+        writer.append(graphs[1], key='b')
+        writer.append(graphs[2], key='c')
+    dataset = GraphStoreDataset(str(tmp_path))
+    assert dataset.keys == ['a', 'b', 'c']
+    for idx, graph in enumerate(graphs):
+        assert_same_graph(dataset[idx], graph)
+
+
+def test_schema_mismatch(tmp_path):
+    with GraphStoreWriter(str(tmp_path)) as writer:
+        writer.append(make_graph(2, 3, 0))
+        graph = make_graph(2, 3, 1)
+        del graph['Hon']
+        with pytest.raises(ValueError):
+            writer.append(graph)
+
+
+def test_interrupted_run_keeps_the_finished_graphs(tmp_path):
+    graphs = [make_graph(3, 4, seed) for seed in range(5)]
+    writer = GraphStoreWriter(str(tmp_path), shard_size=3)
+    for idx, graph in enumerate(graphs[:4]):
+        writer.append(graph, key=str(idx))
+    # the run is killed: the first shard is written, the fourth graph only reached the pending directory
+    del writer
+    assert len(GraphStoreDataset(str(tmp_path))) == 3
+
+    with GraphStoreWriter(str(tmp_path), shard_size=3) as writer:
+        assert len(writer) == 4
+        assert all(str(idx) in writer for idx in range(4))
+        writer.append(graphs[4], key='4')
+
+    dataset = GraphStoreDataset(str(tmp_path))
+    assert dataset.keys == [str(idx) for idx in range(5)]
+    for idx, graph in enumerate(graphs):
+        assert_same_graph(dataset[idx], graph)
+    assert not os.path.exists(os.path.join(str(tmp_path), PENDING_DIR_NAME))
+
+
+def test_convert_npz_to_store(tmp_path):
+    graphs = {idx: make_graph(2, 3, idx) for idx in range(3)}
+    np.savez(str(tmp_path / 'graph_data.npz'), graph=graphs)
+    assert convert_npz_to_store(str(tmp_path / 'graph_data.npz'), str(tmp_path / 'store'), shard_size=2) == 3
+    dataset = GraphStoreDataset(str(tmp_path / 'store'))
+    assert dataset.keys == ['0', '1', '2']
+    for idx in range(3):
+        assert_same_graph(dataset[idx], graphs[idx])
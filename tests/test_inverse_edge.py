@@ -0,0 +1,91 @@
+'''
+Descripttion: Tests of the sort-based inverse-edge search shared by the converters and the models.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 10:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 10:02:11
+'''
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils_openmx.inverse_edge import find_inverse_edge_index
+
+
+def periodic_graph(num_atoms=5, num_pairs=40, max_shift=2, seed=0):
+    """
+    A random graph in which every edge (i, j, shift) has its inverse (j, i, -shift), in random order.
+    """
+    rng = np.random.RandomState(seed)
+    keys = set()
+    while len(keys) < num_pairs:
+        i, j = rng.randint(num_atoms, size=2)
+        shift = tuple(rng.randint(-max_shift, max_shift + 1, size=3).tolist())
+        if i == j and shift == (0, 0, 0):
+            continue
+        keys.add((i, j) + shift)
+        keys.add((j, i) + tuple(-s for s in shift))
+    keys = np.array(sorted(keys), dtype=np.int64)[rng.permutation(len(keys))]
+    return keys[:, :2].T.copy(), keys[:, 2:].copy()
+
+
+def assert_inverse(edge_index, cell_shift, inv_edge_idx):
+    assert np.all(inv_edge_idx >= 0)
+    np.testing.assert_array_equal(edge_index[0, inv_edge_idx], edge_index[1])
+    np.testing.assert_array_equal(edge_index[1, inv_edge_idx], edge_index[0])
+    np.testing.assert_array_equal(cell_shift[inv_edge_idx], -cell_shift)
+    # the inverse of the inverse is the edge itself
+    np.testing.assert_array_equal(inv_edge_idx[inv_edge_idx], np.arange(len(inv_edge_idx)))
+
+
+def test_pairs_every_edge_with_its_inverse():
+    edge_index, cell_shift = periodic_graph()
+    assert_inverse(edge_index, cell_shift, find_inverse_edge_index(edge_index, cell_shift))
+
+
+def test_matches_search_over_all_pairs():
+    edge_index, cell_shift = periodic_graph(num_atoms=3, num_pairs=20, seed=1)
+    expected = [next(jdx for jdx in range(edge_index.shape[1])
+                     if edge_index[0, jdx] == edge_index[1, idx] and edge_index[1, jdx] == edge_index[0, idx]
+                     and np.all(cell_shift[jdx] == -cell_shift[idx]))
+                for idx in range(edge_index.shape[1])]
+    np.testing.assert_array_equal(find_inverse_edge_index(edge_index, cell_shift), expected)
+
+
+def test_large_shifts_use_the_lexsort_fallback():
+    edge_index, cell_shift = periodic_graph(seed=2)
+    # the packed keys of these shifts do not fit in int64
+    cell_shift = cell_shift*(2**40)
+    assert_inverse(edge_index, cell_shift, find_inverse_edge_index(edge_index, cell_shift))
+
+
+def test_float_cell_shifts_are_rounded():
+    edge_index, cell_shift = periodic_graph(seed=3)
+    inv_edge_idx = find_inverse_edge_index(edge_index, cell_shift + 1e-9)
+    assert_inverse(edge_index, cell_shift, inv_edge_idx)
+
+
+def test_empty_graph():
+    inv_edge_idx = find_inverse_edge_index(np.zeros((2, 0), dtype=np.int64), np.zeros((0, 3)))
+    assert inv_edge_idx.shape == (0,)
+
+
+def test_unpaired_edges():
+    edge_index, cell_shift = periodic_graph(seed=4)
+    edge_index, cell_shift = edge_index[:, 1:], cell_shift[1:]
+    with pytest.raises(RuntimeError, match='do not have corresponding inverse edges'):
+        find_inverse_edge_index(edge_index, cell_shift)
+    inv_edge_idx = find_inverse_edge_index(edge_index, cell_shift, validate=False)
+    assert np.sum(inv_edge_idx == -1) == 1
+    paired = inv_edge_idx >= 0
+    np.testing.assert_array_equal(edge_index[0, inv_edge_idx[paired]], edge_index[1, paired])
+
+
+def test_duplicated_edges():
+    edge_index, cell_shift = periodic_graph(seed=5)
+    edge_index = np.concatenate([edge_index, edge_index[:, :1]], axis=1)
+    cell_shift = np.concatenate([cell_shift, cell_shift[:1]], axis=0)
+    with pytest.raises(RuntimeError, match='duplicated'):
+        find_inverse_edge_index(edge_index, cell_shift)
@@ -0,0 +1,83 @@
+'''
+Descripttion: Tests of the kernel polynomial method DOS against the dense generalized eigenvalues.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 10:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 10:02:11
+'''
+
+import pytest
+
+np = pytest.importorskip('numpy')
+scipy_linalg = pytest.importorskip('scipy.linalg')
+pytest.importorskip('threadpoolctl')
+kpm_dos = pytest.importorskip('utils_openmx.kpm_dos')
+
+from scipy.sparse import csr_matrix, diags
+
+KPMDos = kpm_dos.KPMDos
+
+
+def random_pencil(dim=40, seed=0):
+    rng = np.random.RandomState(seed)
+    H = rng.randn(dim, dim)*(rng.rand(dim, dim) < 0.2)
+    H = H + H.T + np.diag(rng.randn(dim))
+    S = 0.05*rng.randn(dim, dim)*(rng.rand(dim, dim) < 0.2)
+    S = S + S.T
+    S = S + np.diag(1.0 + np.abs(S).sum(axis=1))
+    return H, S
+
+
+def exact_moments(kpm, energies):
+    x = (energies - kpm.b)/kpm.a
+    return np.cos(np.arange(kpm.num_moments)[:, None]*np.arccos(x)[None, :]).sum(axis=1)
+
+
+def test_spectral_bounds_enclose_the_spectrum():
+    H, S = random_pencil()
+    energies = scipy_linalg.eigh(H, S, eigvals_only=True)
+    kpm = KPMDos(csr_matrix(H), csr_matrix(S), num_moments=10)
+    assert kpm.bounds[0] < energies[0] and energies[-1] < kpm.bounds[1]
+
+
+def test_diagonal_pencil_gives_the_exact_moments():
+    # for diagonal H and S every random vector gives the exact trace
+    rng = np.random.RandomState(1)
+    h, s = rng.randn(30), 1.0 + rng.rand(30)
+    kpm = KPMDos(diags(h), diags(s), num_moments=50)
+    mu = kpm.average_moments(num_vectors=4, block_size=2)
+    np.testing.assert_allclose(mu[0], exact_moments(kpm, h/s), atol=1e-8)
+
+
+def test_moments_and_dos_of_a_general_pencil():
+    H, S = random_pencil()
+    energies = scipy_linalg.eigh(H, S, eigvals_only=True)
+    kpm = KPMDos(csr_matrix(H), csr_matrix(S), num_moments=64)
+    mu = kpm.average_moments(num_vectors=256, block_size=32)
+    exact = exact_moments(kpm, energies)
+    assert mu[0, 0] == pytest.approx(len(energies))
+    # the stochastic trace converges as 1/sqrt(num_vectors)
+    np.testing.assert_allclose(mu[0, :8], exact[:8], atol=0.25*np.sqrt(len(energies)))
+
+    grid = np.linspace(kpm.bounds[0], kpm.bounds[1], 4001)
+    rho = kpm.dos(grid, mu)[0]
+    integral = np.sum(0.5*(rho[1:] + rho[:-1])*np.diff(grid))
+    assert integral == pytest.approx(len(energies), rel=0.02)
+
+
+def test_groups_sum_to_the_total():
+    H, S = random_pencil(seed=2)
+    kpm = KPMDos(csr_matrix(H), csr_matrix(S), num_moments=20)
+    groups = np.arange(H.shape[0]) % 3
+    mu_groups = kpm.average_moments(num_vectors=32, groups=groups, num_groups=3)
+    mu_total = kpm.average_moments(num_vectors=32)
+    np.testing.assert_allclose(mu_groups.sum(axis=0), mu_total[0], atol=1e-8)
+
+
+def test_result_does_not_depend_on_the_number_of_workers():
+    H, S = random_pencil(dim=20, seed=3)
+    kpm = KPMDos(csr_matrix(H), csr_matrix(S), num_moments=16)
+    serial = kpm.average_moments(num_vectors=8, block_size=2, num_workers=1)
+    parallel = kpm.average_moments(num_vectors=8, block_size=2, num_workers=2, num_threads=1)
+    np.testing.assert_allclose(parallel, serial, atol=1e-10)
@@ -0,0 +1,98 @@
+'''
+Descripttion: Tests of the per-structure splitting of batched predictions and of the prediction store.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 10:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 10:02:11
+'''
+
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+
+from torch_geometric.data import Data, Batch
+from HamGNN_v_2_0.models.prediction_writer import split_predictions, PredictionWriter, PredictionReader, is_prediction_store
+
+NAO2 = 4
+
+
+def make_batch():
+    graphs = []
+    for num_atoms, num_edges in [(2, 3), (3, 5), (1, 2)]:
+        graphs.append(Data(pos=torch.rand(num_atoms, 3),
+                           edge_index=torch.randint(num_atoms, (2, num_edges)),
+                           Hon=torch.rand(num_atoms, NAO2),
+                           Hoff=torch.rand(num_edges, NAO2)))
+    return graphs, Batch.from_data_list(graphs)
+
+
+def test_split_block_outputs():
+    graphs, batch = make_batch()
+    # the output head concatenates the on-site and off-site blocks structure by structure (cat_onsite_and_offsite)
+    hamiltonian = torch.cat([torch.cat([graph.Hon, graph.Hoff]) for graph in graphs])
+    results = split_predictions(batch, {'hamiltonian': hamiltonian}, ['hamiltonian'])
+    assert len(results) == len(graphs)
+    for result, graph in zip(results, graphs):
+        np.testing.assert_array_equal(result['hamiltonian'], torch.cat([graph.Hon, graph.Hoff]).numpy())
+
+
+def test_split_soc_block_outputs():
+    graphs, batch = make_batch()
+    real = [torch.cat([graph.Hon, graph.Hoff]) for graph in graphs]
+    imag = [-block for block in real]
+    # all real parts followed by all imaginary parts
+    hamiltonian = torch.cat(real + imag)
+    results = split_predictions(batch, {'hamiltonian': hamiltonian}, ['hamiltonian'])
+    for result, re, im in zip(results, real, imag):
+        np.testing.assert_array_equal(result['hamiltonian'], torch.cat([re, im]).numpy())
+
+
+def test_split_node_edge_and_graph_outputs():
+    graphs, batch = make_batch()
+    pred = {'forces': torch.cat([graph.pos for graph in graphs]),
+            'edge_weight': torch.cat([graph.Hoff[:, 0] for graph in graphs]),
+            'energy': torch.tensor([1.0, 2.0, 3.0])}
+    results = split_predictions(batch, pred, list(pred))
+    for idx, (result, graph) in enumerate(zip(results, graphs)):
+        np.testing.assert_array_equal(result['forces'], graph.pos.numpy())
+        np.testing.assert_array_equal(result['edge_weight'], graph.Hoff[:, 0].numpy())
+        assert result['energy'] == idx + 1.0
+
+
+def test_split_unknown_length():
+    _, batch = make_batch()
+    pred = {'other': torch.rand(7, 2)}
+    with pytest.raises(ValueError):
+        split_predictions(batch, pred, ['other'])
+    assert split_predictions(batch, pred, ['other'], strict=False) == [dict(), dict(), dict()]
+
+
+def test_prediction_store_round_trip(tmp_path):
+    graphs, batch = make_batch()
+    hamiltonian = torch.cat([torch.cat([graph.Hon, graph.Hoff]) for graph in graphs])
+    results = split_predictions(batch, {'hamiltonian': hamiltonian}, ['hamiltonian'])
+    records = [{'prediction_hamiltonian': result['hamiltonian']} for result in results]
+    keys = ['a', 'b', 'c']
+    with PredictionWriter(str(tmp_path), shard_size=2) as writer:
+        writer.write(keys[:2], records[:2])
+        assert 'a' in writer and 'c' not in writer
+    # resume: only the missing structure is written
+    with PredictionWriter(str(tmp_path), shard_size=2) as writer:
+        assert len(writer) == 2
+        writer.write(keys[2:], records[2:])
+
+    assert is_prediction_store(str(tmp_path))
+    predictions = PredictionReader(str(tmp_path))
+    assert predictions.keys == keys
+    for key, record in zip(keys, records):
+        np.testing.assert_array_equal(predictions[key]['prediction_hamiltonian'], record['prediction_hamiltonian'])
+    with pytest.raises(KeyError):
+        predictions['d']
+
+    onsite = predictions.select(['c', 'a'], transform=lambda idx, value: value[:graphs[[2, 0][idx]].num_nodes])
+    assert len(onsite) == 2
+    np.testing.assert_array_equal(onsite[0], graphs[2].Hon.numpy())
+    np.testing.assert_array_equal(onsite[1], graphs[0].Hon.numpy())
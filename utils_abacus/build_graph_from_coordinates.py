@@ -19,6 +19,7 @@ from ase import geometry, neighborlist
 import numpy as np
 from pymatgen.core.periodic_table import Element
 from typing import List, Union
+from utils_openmx.inverse_edge import find_inverse_edge_index
 
 ATOMIC_RADII = {
     'openmx': {
@@ -161,57 +162,6 @@ def create_neighbor_list_and_vectors(
     return edge_indices, shifts
 
 
-def find_inverse_edge_index(edge_index, cell_shifts):
-    """
-    Find the indices of inverse edges in a given set of edges with associated cell shifts.
-
-    This function takes a list of edges (defined by their start and end nodes) and a list of 
-    corresponding periodic cell shifts. It returns an array of indices where each entry 
-    contains the index of the inverse edge for the corresponding edge. If no inverse edge is found,
-    the index will be -1.
-
-    Parameters:
-    -----------
-    edge_index : np.ndarray
-        A 2xN numpy array where the first row contains the start nodes of edges, and the second 
-        row contains the end nodes of edges.
-
-    cell_shifts : np.ndarray
-        A Nx3 numpy array where each row represents a periodic shift vector associated with the 
-        corresponding edge in edge_index.
-
-    Returns:
-    --------
-    inverse_indices : np.ndarray
-        A 1D numpy array where each element is the index of the inverse edge for the corresponding 
-        edge. If an inverse edge does not exist, the entry is -1.
-    """
-    
-    # Combine edge information with cell shifts and ensure the shifts are tuples (for immutability)
-    edges_with_shifts = list(zip(edge_index[0], edge_index[1], map(tuple, cell_shifts)))
-    
-    # Create dictionaries to map edges and inverse edges to their indices
-    edge_to_index = {edge: idx for idx, edge in enumerate(edges_with_shifts)}
-    inverse_edge_to_index = {
-        (end, start, tuple(-np.array(shift))): idx
-        for idx, (start, end, shift) in enumerate(edges_with_shifts)
-    }
-    
-    # Initialize an array to hold the indices of the inverse edges, defaulting to -1
-    inverse_indices = np.full(len(edges_with_shifts), -1, dtype=int)
-    
-    # For each edge, check if its inverse exists and store the inverse's index
-    for edge, idx in edge_to_index.items():
-        if edge in inverse_edge_to_index:
-            inverse_indices[idx] = inverse_edge_to_index[edge]
-    
-    # Raise an exception if any inverse index was not found (i.e., is still -1)
-    if np.any(inverse_indices == -1):
-        raise RuntimeError("Some edges do not have corresponding inverse edges.")
-    
-    return inverse_indices
-
-
 def compute_graph_difference(edge_indices_1, cell_shifts_1, edge_indices_2, cell_shifts_2):
     """
     Compute the difference between two graphs based on their edges and corresponding cell shifts.
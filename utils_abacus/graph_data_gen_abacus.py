@@ -18,6 +18,7 @@ from pymatgen.core.periodic_table import Element
 from read_abacus import STRU, ABACUSHS
 from build_graph_from_coordinates import build_graph, compute_graph_difference, find_inverse_edge_index
 from utils import *
+from utils_openmx.block_scatter import BlockScatter
 
 ################################ Input Parameters ##############################
 # Maximum number of atomic orbitals (basis set size)
@@ -87,9 +88,9 @@ def generate_hamiltonian_and_overlap(graph_h0, graph_h, graph_s, z_indices, basi
 
     Returns:
     - H (numpy.ndarray): The Hamiltonian matrix.
-    - iH (numpy.ndarray or None): The imaginary part of the Hamiltonian if SOC is included, otherwise None.
+    - iH (numpy.ndarray): The imaginary part of the Hamiltonian (only returned if SOC is included).
     - H0 (numpy.ndarray): The zero-order Hamiltonian matrix.
-    - iH0 (numpy.ndarray or None): The imaginary part of the zero-order Hamiltonian if SOC is included, otherwise None.
+    - iH0 (numpy.ndarray): The imaginary part of the zero-order Hamiltonian (only returned if SOC is included).
     - S (numpy.ndarray): The overlap matrix.
     """
     try:
@@ -108,97 +109,52 @@ def generate_hamiltonian_and_overlap(graph_h0, graph_h, graph_s, z_indices, basi
         if len(inv_edge_idx) != len(edge_index[0]):
             raise ValueError(f"Mismatch in lengths: len(inv_edge_idx) ({len(inv_edge_idx)}) != len(edge_index[0]) ({len(edge_index[0])})")
 
-        # Initialize matrices
-        num_sub_matrix = pos.shape[0] + edge_index.shape[1]
-        matrix_size = (2 * nao_max if use_soc else nao_max) ** 2
-        H = np.zeros((num_sub_matrix, matrix_size), dtype=np.float32)
-        H0 = np.zeros((num_sub_matrix, matrix_size), dtype=np.float32)
-        iH = np.zeros_like(H, dtype=np.float32) if use_soc else None
-        iH0 = np.zeros_like(H0, dtype=np.float32) if use_soc else None
-        S = np.zeros((num_sub_matrix, nao_max**2), dtype=np.float32)
-
-        # Fill in on-site terms for Hamiltonian and overlap
-        for i, src in enumerate(z_indices):
-            mask = np.zeros((nao_max, nao_max), dtype=int)
-            mask[basis_definition[src][:, None], basis_definition[src][None, :]] = 1
-            mask = mask.astype(bool)  # Ensure mask is binary
-
-            # Populate matrices based on whether SOC is used
-            if not use_soc:
-                H[i][mask.flatten()] = Hon[0][i]
-                H0[i][mask.flatten()] = Hon0[0][i]
-            else:
-                H[i], iH[i], H0[i], iH0[i] = _fill_soc_terms(
-                    H[i], iH[i], H0[i], iH0[i], mask, Hon, Hon0, i
-                )
-
-            # Fill in overlap matrix
-            S[i][mask.flatten()] = Son[i]
-
-        # Fill in off-site terms for Hamiltonian and overlap
-        for num, (src, tar) in enumerate(zip(edge_index[0], edge_index[1])):
-            mask = np.zeros((nao_max, nao_max), dtype=int)
-            mask[basis_definition[z_indices[src]][:, None], basis_definition[z_indices[tar]][None, :]] = 1
-            mask = mask.astype(bool)
-
-            # Populate matrices based on whether SOC is used
-            if not use_soc:
-                H[num + len(z_indices)][mask.flatten()] = Hoff[0][num]
-                H0[num + len(z_indices)][mask.flatten()] = Hoff0[0][num]
-            else:
-                H[num + len(z_indices)], iH[num + len(z_indices)], H0[num + len(z_indices)], iH0[num + len(z_indices)] = _fill_soc_terms(
-                    H[num + len(z_indices)], iH[num + len(z_indices)], H0[num + len(z_indices)], iH0[num + len(z_indices)], mask, Hoff, Hoff0, num
-                )
+        # The flat indices of every species pair are built once and all blocks are placed at once
+        block_scatter = BlockScatter(basis_definition, nao_max)
 
-            # Fill in overlap matrix for off-site terms
-            S[num + len(z_indices)][mask.flatten()] = Soff[num]
-
-        # Return the computed matrices
-        if use_soc:
-            return H, iH, H0, iH0
-        else:
+        # Fill in on-site and off-site terms for Hamiltonian and overlap
+        num_sub_matrix = pos.shape[0] + edge_index.shape[1]
+        if not use_soc:
+            H = block_scatter.scatter_graph(Hon[0], Hoff[0], z_indices, edge_index, dtype=np.float32)
+            H0 = block_scatter.scatter_graph(Hon0[0], Hoff0[0], z_indices, edge_index, dtype=np.float32)
+            S = block_scatter.scatter_graph(Son, Soff, z_indices, edge_index, dtype=np.float32)
             return H, H0, S
+        else:
+            H, iH = _fill_soc_terms(block_scatter, Hon, Hoff, z_indices, edge_index, num_sub_matrix, nao_max)
+            H0, iH0 = _fill_soc_terms(block_scatter, Hon0, Hoff0, z_indices, edge_index, num_sub_matrix, nao_max)
+            # The overlap is spin-diagonal, its uu block is the orbital overlap
+            S = block_scatter.scatter_graph([np.real(b) for b in Son], [np.real(b) for b in Soff], z_indices, edge_index, dtype=np.float32)
+            return H, iH, H0, iH0, S
 
     except Exception as e:
         print(f"Error generating Hamiltonian and overlap matrices: {e}")
         if use_soc:
-            return None, None, None, None
+            return None, None, None, None, None
         else:
             return None, None, None
 
 
-def _fill_soc_terms(H, iH, H0, iH0, mask, graph_hon, graph_hon0, index):
+def _fill_soc_terms(block_scatter, graph_hon, graph_hoff, z_indices, edge_index, num_sub_matrix, nao_max):
     """
-    Helper function to fill in Hamiltonian and overlap matrices for spin-orbit coupling (SOC) terms.
+    Helper function to assemble the (2*nao_max, 2*nao_max) spinor blocks of a SOC Hamiltonian.
     
     Parameters:
-    - H, iH, H0, iH0 (numpy.ndarray): The matrices to be populated.
-    - mask (numpy.ndarray): A boolean mask to indicate the positions to populate.
-    - graph_hon, graph_hon0 (list): Lists of Hamiltonian terms, including spin components.
-    - index (int): The index of the current element to access the Hamiltonian terms.
+    - block_scatter (BlockScatter): The block placement engine.
+    - graph_hon, graph_hoff (list): On-site and off-site Hamiltonian terms of the uu, ud, du and dd spin components.
+    - z_indices (numpy.ndarray): The atomic numbers.
+    - edge_index (numpy.ndarray): The edge indices.
+    - num_sub_matrix (int): Number of on-site plus off-site blocks.
+    - nao_max (int): Maximum number of atomic orbitals.
 
     Returns:
-    - Updated matrices (H, iH, H0, iH0).
+    - The real and imaginary parts of the Hamiltonian, shape: (num_sub_matrix, (2*nao_max)**2).
     """
-    tH = np.zeros((2 * H.shape[0], 2 * H.shape[0]), dtype=np.complex64)
-    
-    # Populate the Hamiltonian matrix with SOC terms
-    tH[:H.shape[0], :H.shape[0]][mask] = graph_hon[0][index]  # uu
-    tH[:H.shape[0], H.shape[0]:][mask] = graph_hon[1][index]  # ud
-    tH[H.shape[0]:, :H.shape[0]][mask] = graph_hon[2][index]  # du
-    tH[H.shape[0]:, H.shape[0]:][mask] = graph_hon[3][index]  # dd
-    H = tH.real.flatten()
-    iH = tH.imag.flatten()
-
-    # Populate the zero-order Hamiltonian with SOC terms
-    tH[:H.shape[0], :H.shape[0]][mask] = graph_hon0[0][index]  # uu
-    tH[:H.shape[0], H.shape[0]:][mask] = graph_hon0[1][index]  # ud
-    tH[H.shape[0]:, :H.shape[0]][mask] = graph_hon0[2][index]  # du
-    tH[H.shape[0]:, H.shape[0]:][mask] = graph_hon0[3][index]  # dd
-    H0 = tH.real.flatten()
-    iH0 = tH.imag.flatten()
-
-    return H, iH, H0, iH0
+    tH = np.zeros((num_sub_matrix, 2 * nao_max, 2 * nao_max), dtype=np.complex64)
+    for ispin, (i, j) in enumerate([(0, 0), (0, 1), (1, 0), (1, 1)]): # uu, ud, du, dd
+        block = block_scatter.scatter_graph(graph_hon[ispin], graph_hoff[ispin], z_indices, edge_index, dtype=np.complex64)
+        tH[:, i*nao_max:(i+1)*nao_max, j*nao_max:(j+1)*nao_max] = block.reshape(-1, nao_max, nao_max)
+    tH = tH.reshape(num_sub_matrix, -1)
+    return tH.real.copy(), tH.imag.copy()
 
 
 def generate_expanded_graph_h0(atomic_numbers, lattice, pos, graph_h0, soc_enabled=False, radius_type='abacus', radius_scale=1.5):
@@ -437,7 +393,7 @@ def generate_graph(idx: int, scf_path: str) -> tuple:
     # Prepare Hamiltonian and overlap matrices
     try:
         if SOC_ENABLED:
-            H, iH, H0, iH0 = generate_hamiltonian_and_overlap(graph_h0, graph_h, graph_s, atomic_numbers, BASIS_DEF, NAO_MAX, use_soc=SOC_ENABLED)
+            H, iH, H0, iH0, S = generate_hamiltonian_and_overlap(graph_h0, graph_h, graph_s, atomic_numbers, BASIS_DEF, NAO_MAX, use_soc=SOC_ENABLED)
         else:
             H, H0, S = generate_hamiltonian_and_overlap(graph_h0, graph_h, graph_s, atomic_numbers, BASIS_DEF, NAO_MAX, use_soc=SOC_ENABLED)
     except Exception as e:
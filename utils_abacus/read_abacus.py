@@ -122,6 +122,65 @@ def find_matching_column_index(matrix, target_column_values):
     # If a match is found, return the index of the first matching column; otherwise, return None
     return np.argmax(column_matches) if column_matches.any() else None
 
+def parse_abacus_csr(file: str):
+    """
+    Parse a data-*R-sparse_SPIN0.csr file of ABACUS at once.
+
+    The file is read in one go, the values, column indices and row pointers of all R-blocks are
+    joined and converted by numpy in bulk, and the rows of the nonzeros are recovered from the row
+    pointers without Python loops over the matrix elements. Complex (SOC) values written as (re,im)
+    are detected automatically.
+
+    Args:
+        file (str): path of the csr file.
+
+    Returns:
+        no_u (int): number of orbitals in the unit cell.
+        cell_shift (np.ndarray): the cell shifts of the nonempty R-blocks in the order of the file, shape: (num_R, 3)
+        iR (np.ndarray): the R-block of every nonzero, shape: (nnz,)
+        row (np.ndarray): the row of every nonzero, shape: (nnz,)
+        col (np.ndarray): the column of every nonzero, shape: (nnz,)
+        val (np.ndarray): the values, float64 or complex128, shape: (nnz,)
+    """
+    with open(file, 'r') as fp:
+        lines = fp.read().splitlines()
+    iline = 1 if 'STEP' in lines[0] else 0
+    no_u = int(lines[iline].split()[-1])  # Number of orbitals in the unit cell.
+    ncell_shift = int(lines[iline + 1].split()[-1])
+    iline += 2
+
+    cell_shift, nnz, val_lines, col_lines, row_lines = [], [], [], [], []
+    for _ in range(ncell_shift):
+        while not lines[iline].strip():
+            iline += 1
+        tmp = lines[iline].split()
+        iline += 1
+        if int(tmp[3]) == 0:
+            continue
+        cell_shift.append([int(tmp[0]), int(tmp[1]), int(tmp[2])])
+        nnz.append(int(tmp[3]))
+        val_lines.append(lines[iline])
+        col_lines.append(lines[iline + 1])
+        row_lines.append(lines[iline + 2])
+        iline += 3
+
+    cell_shift = np.array(cell_shift, dtype=int).reshape(-1, 3)
+    nnz = np.array(nnz, dtype=int)
+    val = ' '.join(val_lines)
+    if '(' in val:
+        val = np.array(val.translate(str.maketrans('(),', '   ')).split(), dtype=np.float64)
+        val = val[0::2] + 1j*val[1::2]
+    else:
+        val = np.array(val.split(), dtype=np.float64)
+    col = np.array(' '.join(col_lines).split(), dtype=int)
+    indptr = np.array(' '.join(row_lines).split(), dtype=int).reshape(-1, no_u + 1)
+    if len(val) != nnz.sum() or len(col) != nnz.sum():
+        raise RuntimeError(f'{file} is corrupted: the number of values does not match the number of nonzeros!')
+
+    row = np.repeat(np.tile(np.arange(no_u), len(nnz)), np.diff(indptr, axis=1).reshape(-1))
+    iR = np.repeat(np.arange(len(nnz)), nnz)
+    return no_u, cell_shift, iR, row, col, val
+
 class STRU:
     """
     Class to read and store atomic and lattice information from a file.
@@ -290,14 +349,15 @@ class ABACUSHS:
         ncell_shift (int): Number of cell shifts.
         max_rcut (ndarray): Maximum cutoff distance for each species.
         noff (int): Number of off-site Hamiltonian terms.
-        fp (file object): File pointer for reading input data.
+        R (ndarray): The nonempty cell shifts of the file.
+        iR, row, col, val (ndarray): The R-block, row, column and value of every nonzero.
     
     Methods:
         __init__(file: str): Initialize the ABACUSHS class by reading data from the specified file.
         getGraph(stru: STRU, graph: dict, skip: bool, isH: bool, isSOC: bool, calcRcut: bool, tojson: bool): 
             Constructs and returns the graph (edges, Hamiltonian matrices, etc.) from the ABACUSHS data.
         getHK(stru: STRU, k: np.ndarray, isH: bool, isSOC: bool): Returns the Hamiltonian matrix for the specified k-point.
-        close(): Closes the file pointer.
+        close(): Releases the parsed matrix.
     """
     
     def __init__(self, file: str) -> None:
@@ -305,15 +365,10 @@ class ABACUSHS:
         Initializes the ABACUSHS object by reading the data from the provided file.
         
         Args:
-            file (str): The file containing the ABACUSHS data.
+            file (str): The file containing the ABACUSHS data, which is parsed at once by parse_abacus_csr.
         """
-        self.fp = open(file)
-        line = self.fp.readline()  # Read first line to determine the format
-        if 'STEP' in line:
-            self.no_u = int(self.fp.readline().split()[-1])
-        else:
-            self.no_u = int(line.split()[-1])  # Number of orbitals in the unit cell.
-        self.ncell_shift = int(self.fp.readline().split()[-1])
+        self.no_u, self.R, self.iR, self.row, self.col, self.val = parse_abacus_csr(file)
+        self.ncell_shift = len(self.R)  # Number of nonempty cell shifts.
 
     def _calculate_atom_orbitals(self, stru, repeat):
         """
@@ -377,12 +432,31 @@ class ABACUSHS:
         dtype = np.float32 if not isSOC else np.complex64
         repeat = 1 if not isSOC else 2
         nspin = 1 if not isSOC else 4
-        edge_idx_src, edge_idx_dst, cell_shift, nbr_shift = [], [], [], []
-        Hon = [[]] if not isSOC else [[], [], [], []]  # Cannot be written as [[]]*4
-        Hoff = [[]] if not isSOC else [[], [], [], []]
+        natoms = stru.num_atoms_unit_cell
+
+        # Initialize the atomic orbital indices
+        no, indo = self._calculate_atom_orbitals(stru, repeat)
+        blocks, block_atoms, block_R = self._get_blocks(no, indo, isSOC, isH)
+        ia, ja = block_atoms
+        R = self.R[block_R]
+        onsite = (ia == ja) & np.all(R == 0, axis=1)
+
+        # Onsite Hamiltonian of every atom, zero blocks for the atoms without elements
+        Hon = [[np.zeros((no[i] // repeat)**2, dtype=dtype) for i in range(natoms)] for _ in range(nspin)] if np.any(np.all(self.R == 0, axis=1)) else [[] for _ in range(nspin)]
+        for iblock in np.flatnonzero(onsite):
+            for ispin in range(nspin):
+                Hon[ispin][ia[iblock]] = blocks[ispin][iblock]
 
-        if skip:
-            # Load pre-existing graph data
+        offsite = np.flatnonzero(~onsite)
+        if not skip:
+            # Offsite Hamiltonian in the order of the file
+            Hoff = [[blocks[ispin][iblock] for iblock in offsite] for ispin in range(nspin)]
+            edge_idx_src = ia[offsite].tolist()
+            edge_idx_dst = ja[offsite].tolist()
+            cell_shift = list(R[offsite])
+            nbr_shift = list(R[offsite] @ stru.cell)
+        else:
+            # Load pre-existing graph data and place the blocks on the matching edges
             graph_ = deepcopy(graph)
             self.noff = len(graph_['inv_edge_idx'])
             edge_idx_src = graph_['edge_index'][0]
@@ -392,84 +466,10 @@ class ABACUSHS:
             for ispin in range(nspin):
                 for ioff in range(self.noff):
                     Hoff[ispin][ioff] = np.zeros_like(Hoff[ispin][ioff], dtype=dtype)
-
-        # Initialize the atomic orbital indices
-        no, indo = self._calculate_atom_orbitals(stru, repeat)
-
-        while True:
-            line = self.fp.readline()
-            if not line:
-                break
-            tmp = line.split()
-            cx, cy, cz = int(tmp[0]), int(tmp[1]), int(tmp[2])
-            nh = int(tmp[3])
-            if nh == 0:
-                continue
-            val = self.fp.readline()
-            col = self.fp.readline().split()
-            row = self.fp.readline().split()
-
-            # Handle Hamiltonian values
-            if not isSOC:
-                val = list(map(float, val.split()))
-            else:
-                val_raw = re.findall(r'[\-\+\d\.eE]+', val)
-                val_raw = np.asarray(val_raw, dtype=np.float32)
-                val = np.zeros(len(val_raw) // 2, dtype=np.complex64)
-                val += val_raw[0::2] + 1j * val_raw[1::2]
-            
-            col = list(map(int, col))
-            row = list(map(int, row))
-            hamilt = csr((val, col, row), shape=[self.no_u, self.no_u], dtype=dtype)
-
-            if isH:
-                hamilt *= ry2ha
-            
-            if skip:
-                edge_info_array = np.concatenate([np.array(graph_['edge_index']), np.array(cell_shift).T], axis=0) 
-            else:
-                edge_info_array = None
-            
-            # Process Hamiltonian and populate graph data
-            for ia in range(stru.num_atoms_unit_cell):
-                for ja in range(stru.num_atoms_unit_cell):
-                    ham = hamilt[indo[ia]:indo[ia] + no[ia], indo[ja]:indo[ja] + no[ja]]
-                    if ia == ja and cx == 0 and cy == 0 and cz == 0:
-                        # Onsite Hamiltonian
-                        if not isSOC:
-                            Hon[0].append(ham.toarray().flatten())
-                        else:
-                            Hon[0].append(ham[0::2, 0::2].toarray().flatten())  # uu
-                            Hon[1].append(ham[0::2, 1::2].toarray().flatten())  # ud
-                            Hon[2].append(ham[1::2, 0::2].toarray().flatten())  # du
-                            Hon[3].append(ham[1::2, 1::2].toarray().flatten())  # dd
-                    elif ham.getnnz() > 0:
-                        # Offsite Hamiltonian
-                        if not skip:
-                            if not isSOC:
-                                Hoff[0].append(ham.toarray().flatten())
-                            else:
-                                Hoff[0].append(ham[0::2, 0::2].toarray().flatten())  # uu
-                                Hoff[1].append(ham[0::2, 1::2].toarray().flatten())  # ud
-                                Hoff[2].append(ham[1::2, 0::2].toarray().flatten())  # du
-                                Hoff[3].append(ham[1::2, 1::2].toarray().flatten())  # dd
-                            edge_idx_src.append(ia)
-                            edge_idx_dst.append(ja)
-                            cell_shift.append(np.array([cx, cy, cz], dtype=int))
-                            nbr_shift.append(np.array([cx, cy, cz]) @ stru.cell)
-                        else:
-                            ierr, ioff = self._fill_offsite_hamiltonian(
-                                cx, cy, cz, ia, ja, edge_info_array
-                            )
-                            if ierr:
-                                continue
-                            if not isSOC:
-                                Hoff[0][ioff] = ham.toarray().flatten()
-                            else:
-                                Hoff[0][ioff] = ham[0::2, 0::2].toarray().flatten()  # uu
-                                Hoff[1][ioff] = ham[0::2, 1::2].toarray().flatten()  # ud
-                                Hoff[2][ioff] = ham[1::2, 0::2].toarray().flatten()  # du
-                                Hoff[3][ioff] = ham[1::2, 1::2].toarray().flatten()  # dd
+            ioff = self._match_edges(np.array(graph_['edge_index']).reshape(2, -1), np.array(cell_shift).reshape(-1, 3), ia[offsite], ja[offsite], R[offsite], natoms)
+            for iblock, jedge in zip(offsite[ioff >= 0], ioff[ioff >= 0]):
+                for ispin in range(nspin):
+                    Hoff[ispin][jedge] = blocks[ispin][iblock]
 
         if calcRcut:
             self._calculate_rcut(stru, edge_idx_src, edge_idx_dst, cell_shift)
@@ -501,16 +501,59 @@ class ABACUSHS:
 
         return graph_
 
-    def _fill_offsite_hamiltonian(self, cx, cy, cz, ia, ja, edge_info_array):
+    def _get_blocks(self, no, indo, isSOC, isH):
         """
-        Checks if an offsite Hamiltonian term already exists and returns the appropriate index.
-        """        
-        ioff = find_matching_column_index(edge_info_array, [ia, ja, cx, cy, cz])
-        
-        if ioff is not None:
-            return False, ioff
+        Groups the nonzeros by (R, ia, ja) and scatters them into dense flattened blocks.
+
+        Returns:
+            blocks (list): the flattened blocks of every spin channel (uu, ud, du, dd for SOC), ordered by
+                the R-blocks of the file and then by ia and ja.
+            block_atoms (tuple): ia and ja of every block.
+            block_R (np.ndarray): the index of the R-block of every block.
+        """
+        dtype = np.float32 if not isSOC else np.complex64
+        natoms = len(no)
+        orb_atom = np.repeat(np.arange(natoms), no)
+        orb_local = np.arange(self.no_u) - indo[orb_atom]
+        ia, ja = orb_atom[self.row], orb_atom[self.col]
+        li, lj = orb_local[self.row], orb_local[self.col]
+        if not isSOC:
+            nblock = no
+            channel = np.zeros_like(li)
         else:
-            return True, ioff
+            nblock = no // 2
+            channel = 2*(li % 2) + lj % 2  # uu, ud, du, dd
+            li, lj = li // 2, lj // 2
+
+        keys, block_id = np.unique((self.iR*natoms + ia)*natoms + ja, return_inverse=True)
+        block_id = block_id.reshape(-1)
+        block_R, block_ia, block_ja = keys // natoms**2, keys // natoms % natoms, keys % natoms
+        sizes = nblock[block_ia]*nblock[block_ja]
+        offsets = np.cumsum(sizes) - sizes
+
+        val = self.val.astype(dtype)
+        if isH:
+            val *= ry2ha
+        nspin = 1 if not isSOC else 4
+        buffer = np.zeros((nspin, sizes.sum()), dtype=dtype)
+        buffer[channel, offsets[block_id] + li*nblock[ja] + lj] = val
+        blocks = [np.split(buffer[ispin], offsets[1:]) if len(sizes) > 0 else [] for ispin in range(nspin)]
+        return blocks, (block_ia, block_ja), block_R
+
+    def _match_edges(self, edge_index, cell_shift, ia, ja, R, natoms):
+        """
+        Returns the index of the edge (ia, ja, R) in the graph for every block, or -1 if it is not an edge of the graph.
+        """
+        if edge_index.shape[1] == 0 or len(ia) == 0:
+            return np.full(len(ia), -1, dtype=int)
+        _, shift_id = np.unique(np.concatenate([cell_shift, R], axis=0), axis=0, return_inverse=True)
+        shift_id = shift_id.reshape(-1)
+        num_shifts = shift_id.max() + 1
+        edge_keys = (edge_index[0]*natoms + edge_index[1])*num_shifts + shift_id[:len(cell_shift)]
+        block_keys = (ia*natoms + ja)*num_shifts + shift_id[len(cell_shift):]
+        order = np.argsort(edge_keys)
+        position = np.minimum(np.searchsorted(edge_keys[order], block_keys), len(order) - 1)
+        return np.where(edge_keys[order][position] == block_keys, order[position], -1)
 
     def _calculate_rcut(self, stru, edge_idx_src, edge_idx_dst, cell_shift):
         """
@@ -550,43 +593,18 @@ class ABACUSHS:
         dtype = np.float32 if not isSOC else np.complex64
         HK = np.zeros([self.no_u, self.no_u], dtype=dtype)
 
-        while True:
-            line = self.fp.readline()
-            if not line:
-                break
-            tmp = line.split()
-            cx, cy, cz = int(tmp[0]), int(tmp[1]), int(tmp[2])
-            nh = int(tmp[3])
-            if nh == 0:
-                continue
-            val = self.fp.readline()
-            col = self.fp.readline().split()
-            row = self.fp.readline().split()
-
-            # Handle Hamiltonian values
-            if not isSOC:
-                val = list(map(float, val.split()))
-            else:
-                val_raw = re.findall(r'[\-\+\d\.eE]+', val)
-                val_raw = np.asarray(val_raw, dtype=np.float32)
-                val = np.zeros(len(val_raw) // 2, dtype=np.complex64)
-                val += val_raw[0::2] + 1j * val_raw[1::2]
-            
-            col = list(map(int, col))
-            row = list(map(int, row))
-            hamilt = csr((val, col, row), shape=[self.no_u, self.no_u], dtype=dtype)
-            if isH:
-                hamilt *= ry2ha
-
-            HK += hamilt
+        val = self.val.astype(dtype)
+        if isH:
+            val *= ry2ha
+        np.add.at(HK, (self.row, self.col), val)
 
         return HK
 
     def close(self):
         """
-        Closes the file pointer.
+        Releases the parsed matrix. The file itself is already closed after parsing.
         """
-        self.fp.close()
+        self.iR = self.row = self.col = self.val = None
 
 def process_graph_data():
     """
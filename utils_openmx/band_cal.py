@@ -16,6 +16,8 @@ from pymatgen.core.periodic_table import Element
 import math
 import os
 from utils_openmx.utils import *
+from utils_openmx.band_engine import BandEngine, window_band_edges, common_window
+from HamGNN_v_2_0.models.prediction_writer import PredictionReader, is_prediction_store
 import argparse
 import yaml
 import torch
@@ -53,6 +55,16 @@ def main():
     else:
         spin_colinear = False
     
+    # parallel k-point engine
+    num_workers = input['num_workers'] if 'num_workers' in input else 1 # the number of worker processes
+    num_threads = input['num_threads'] if 'num_threads' in input else None # the number of threads per worker
+    
+    # sparse mode: only the num_bands bands closest to sigma (eV) are computed with the shift-invert solver
+    sparse_mode = input['sparse_mode'] if 'sparse_mode' in input else False
+    if sparse_mode:
+        num_bands = input['num_bands']
+        sigma = input['sigma']
+    
     auto_mode = input['auto_mode']
     if not auto_mode:
         k_path=input['k_path'] 
@@ -65,6 +77,7 @@ def main():
     graph_data = np.load(graph_data_path, allow_pickle=True)
     graph_data = graph_data['graph'].item()
     graph_dataset = list(graph_data.values())
+    graph_keys = [str(key) for key in graph_data.keys()]
 
     num_val = np.zeros((99,), dtype=int)
     if Ham_type == 'openmx':
@@ -105,7 +118,10 @@ def main():
         for i in range(len(graph_dataset)):
             len_H.append(2*(len(graph_dataset[i].Hon)+len(graph_dataset[i].Hoff)))
     
-        if hamiltonian_path is not None:
+        if is_prediction_store(hamiltonian_path):
+            # read the predicted H of every structure from the prediction store when it is needed
+            Hsoc_all = PredictionReader(hamiltonian_path).select(graph_keys, 'prediction_hamiltonian')
+        elif hamiltonian_path is not None:
             H = np.load(hamiltonian_path)
             Hsoc_all = []
             idx = 0
@@ -127,7 +143,6 @@ def main():
             pos = data.pos.numpy()*au2ang
             nbr_shift = data.nbr_shift.numpy()
             edge_index = data.edge_index.numpy()
-            cell_shift = data.cell_shift.numpy()
             species = data.z.numpy()
             struct = Structure(lattice=latt*au2ang, species=[Element.from_Z(k).symbol for k in species], coords=pos, coords_are_cartesian=True)
             struct.to(filename=os.path.join(save_dir, filename+f'_{idx+1}.cif'))
@@ -146,86 +161,35 @@ def main():
                 label = [rf'${lb}$' for lb in klabels]   
     
             Hsoc_real, Hsoc_imag = np.split(Hsoc, 2, axis=0)
-            Hsoc = [Hsoc_real[:, :nao_max, :nao_max]+1.0j*Hsoc_imag[:, :nao_max, :nao_max], 
-                    Hsoc_real[:, :nao_max, nao_max:]+1.0j*Hsoc_imag[:, :nao_max, nao_max:], 
-                    Hsoc_real[:, nao_max:, :nao_max]+1.0j*Hsoc_imag[:, nao_max:, :nao_max],
-                    Hsoc_real[:, nao_max:, nao_max:]+1.0j*Hsoc_imag[:, nao_max:, nao_max:]]
+            Hsoc = Hsoc_real + 1.0j*Hsoc_imag # shape: (natoms+nedges, 2*nao_max, 2*nao_max)
     
             kpts=kpoints_generator(dim_k=3, lat=latt)
             k_vec, k_dist, k_node, lat_per_inv, node_index = kpts.k_path(k_path, nk)
             k_vec = k_vec.dot(lat_per_inv[np.newaxis,:,:]) # shape (nk,1,3)
             k_vec = k_vec.reshape(-1,3) # shape (nk, 3)
             
-            orb_mask = basis_definition[species].reshape(-1) # shape: [natoms*nao_max] 
-            orb_mask = orb_mask[:,None] * orb_mask[None,:]       # shape: [natoms*nao_max, natoms*nao_max]
-    
-            # cell index
-            cell_shift_tuple = [tuple(c) for c in cell_shift.tolist()] # len: (nedges,)
-            cell_shift_set = set(cell_shift_tuple)
-            cell_shift_list = list(cell_shift_set)
-            cell_index = [cell_shift_list.index(icell) for icell in cell_shift_tuple] # len: (nedges,)
-            ncells = len(cell_shift_set)
-    
-            # SK
             natoms = len(species)
-            eigen = []
-            for ik in range(nk):
-                phase = np.zeros((ncells,),dtype=np.complex64) # shape (ncells,)
-                phase[cell_index] = np.exp(2j*np.pi*np.sum(nbr_shift[:,:]*k_vec[ik,None,:], axis=-1))    
-                na = np.arange(natoms)
-        
-                S_cell = np.zeros((ncells, natoms, natoms, nao_max, nao_max), dtype=np.complex64)
-                S_cell[cell_index, edge_index[0], edge_index[1], :, :] = Soff  
-        
-                SK = np.einsum('ijklm, i->jklm', S_cell, phase) # (natoms, natoms, nao_max, nao_max)
-                SK[na,na,:,:] +=  Son[na,:,:]
-                SK = np.swapaxes(SK,-2,-3) #(natoms, nao_max, natoms, nao_max)
-                SK = SK.reshape(natoms*nao_max, natoms*nao_max)
-                SK = SK[orb_mask > 0]
-                norbs = int(math.sqrt(SK.size))
-                SK = SK.reshape(norbs, norbs)
-                I = np.identity(2,dtype=np.complex64)
-                SK = np.kron(I,SK)
-    
-                HK_list = []
-                for H in Hsoc:
-                    Hon = H[:natoms,:,:]
-                    Hoff = H[natoms:,:,:] 
-                    H_cell = np.zeros((ncells, natoms, natoms, nao_max, nao_max), dtype=np.complex64)
-                    H_cell[cell_index, edge_index[0], edge_index[1], :, :] = Hoff    
-        
-                    HK = np.einsum('ijklm, i->jklm', H_cell, phase) # (natoms, natoms, nao_max, nao_max)
-                    HK[na,na,:,:] +=  Hon[na,:,:] # shape (nk, natoms, nao_max, nao_max)
-        
-                    HK = np.swapaxes(HK,-2,-3) #(nk, natoms, nao_max, natoms, nao_max)
-                    HK = HK.reshape(natoms*nao_max, natoms*nao_max)
-        
-                    # mask HK
-                    HK = HK[orb_mask > 0]
-                    norbs = int(math.sqrt(HK.size))
-                    HK = HK.reshape(norbs, norbs)
-        
-                    HK_list.append(HK)
-        
-                HK = np.block([[HK_list[0],HK_list[1]],[HK_list[2],HK_list[3]]])
-            
-                SK_cuda = torch.complex(torch.Tensor(SK.real), torch.Tensor(SK.imag)).unsqueeze(0)
-                HK_cuda = torch.complex(torch.Tensor(HK.real), torch.Tensor(HK.imag)).unsqueeze(0)
-                L = torch.linalg.cholesky(SK_cuda)
-                L_t = torch.transpose(L.conj(), dim0=-1, dim1=-2)
-                L_inv = torch.linalg.inv(L)
-                L_t_inv = torch.linalg.inv(L_t)
-                Hs = torch.bmm(torch.bmm(L_inv, HK_cuda), L_t_inv)
-                orbital_energies, _ = torch.linalg.eigh(Hs)
-                orbital_energies = orbital_energies.squeeze(0)
-                eigen.append(orbital_energies.cpu().numpy())
+            engine = BandEngine(Hsoc[:natoms], Hsoc[natoms:], Son, Soff, edge_index, nbr_shift,
+                                basis_definition[species], nspinor=2)
+            if sparse_mode:
+                norbs = num_bands
+                eigen = engine.eigenvalues(k_vec, num_workers=num_workers, num_threads=num_threads,
+                                           sigma=sigma/au2ev, num_bands=num_bands, verbose=True)
+            else:
+                norbs = engine.norbs
+                eigen = engine.eigenvalues(k_vec, num_workers=num_workers, num_threads=num_threads)
             
             eigen = np.swapaxes(np.array(eigen), 0, 1)*au2ev # (nbands, nk)
     
             # plot fermi line    
             num_electrons = np.sum(num_val[species])
-            max_val = np.max(eigen[num_electrons-1])
-            min_con = np.min(eigen[num_electrons])
+            if sparse_mode:
+                eigen, e_min, e_max = common_window(eigen, sigma)
+                print(f"energy window covered at every k point: [{e_min}, {e_max}] eV")
+                max_val, min_con = window_band_edges(eigen, sigma)
+            else:
+                max_val = np.max(eigen[num_electrons-1])
+                min_con = np.min(eigen[num_electrons])
             eigen = eigen - max_val
             print(f"max_val = {max_val} eV")
             print(f"band gap = {min_con - max_val} eV")
@@ -245,8 +209,12 @@ def main():
                     ax.axvline(x=k_node[n], linewidth=0.5, color='k')
             
                 # plot bands
-                for n in range(norbs):
-                    ax.plot(k_dist, eigen[n])
+                if sparse_mode:
+                    # the rows of eigen are not bands in the sparse mode, so the eigenvalues are plotted as points
+                    ax.scatter(np.tile(k_dist, norbs), eigen.reshape(-1), s=2, c='C0')
+                else:
+                    for n in range(norbs):
+                        ax.plot(k_dist, eigen[n])
                 ax.plot(k_dist, nk*[0.0], linestyle='--')
             
                 # put title
@@ -273,13 +241,19 @@ def main():
             text_file.write("\n")
         
             node_index = node_index[1:]
-            for nb in range(len(eigen)):
+            if sparse_mode:
+                # the eigenvalues inside the window at every k point, which are not connected into bands
                 for ik in range(nk):
-                    text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))
-                    if ik in node_index[:-1]:
-                        text_file.write('\n')
-                        text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))       
-                text_file.write('\n')
+                    for energy in eigen[:, ik][np.isfinite(eigen[:, ik])]:
+                        text_file.write("%f    %f\n" % (k_dist[ik], energy))
+            else:
+                for nb in range(len(eigen)):
+                    for ik in range(nk):
+                        text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))
+                        if ik in node_index[:-1]:
+                            text_file.write('\n')
+                            text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))       
+                    text_file.write('\n')
             text_file.close()
 
     elif spin_colinear:
@@ -289,7 +263,12 @@ def main():
             len_H.append(len(graph_dataset[i].Hon))
             len_H.append(len(graph_dataset[i].Hoff))
 
-        if hamiltonian_path is not None:
+        if is_prediction_store(hamiltonian_path):
+            # read the predicted H of every structure from the prediction store when it is needed
+            predictions = PredictionReader(hamiltonian_path)
+            Hon_all = predictions.select(graph_keys, 'prediction_hamiltonian', lambda idx, H: H[:len(graph_dataset[idx].Hon)])
+            Hoff_all = predictions.select(graph_keys, 'prediction_hamiltonian', lambda idx, H: H[len(graph_dataset[idx].Hon):])
+        elif hamiltonian_path is not None:
             H = np.load(hamiltonian_path)
             Hon_all, Hoff_all = [], []
             idx = 0
@@ -332,68 +311,33 @@ def main():
                 k_path = [kpath_seek.kpath['kpoints'][k] for k in klabels]
                 label = [rf'${lb}$' for lb in klabels]            
                 
-            orb_mask = basis_definition[species].reshape(-1) # shape: [natoms*nao_max] 
-            orb_mask = orb_mask[:,None] * orb_mask[None,:]       # shape: [natoms*nao_max, natoms*nao_max]
-        
             kpts=kpoints_generator(dim_k=3, lat=latt)
             k_vec, k_dist, k_node, lat_per_inv, node_index = kpts.k_path(k_path, nk)
         
             k_vec = k_vec.dot(lat_per_inv[np.newaxis,:,:]) # shape (nk,1,3)
             k_vec = k_vec.reshape(-1,3) # shape (nk, 3)
         
-            natoms = len(struct)
-            
             for ispin in range(2):
-                eigen = []
-                for ik in range(len(k_vec)):            
-                    HK = np.zeros((natoms, natoms, nao_max, nao_max), dtype=np.complex64)
-                    SK = np.zeros((natoms, natoms, nao_max, nao_max), dtype=np.complex64)
-    
-                    na = np.arange(natoms)
-                    HK[na,na,:,:] +=  Hon[na, ispin, :, :] # shape (natoms, nao_max, nao_max)
-                    SK[na,na,:,:] +=  Son[na, :, :]
-    
-                    coe = np.exp(2j*np.pi*np.sum(nbr_shift*k_vec[ik][None,:], axis=-1)) # shape (nedges,)
-    
-                    for iedge in range(len(Hoff)):
-                        # shape (nao_max, nao_max) += (1, 1)*(nao_max, nao_max)
-                        HK[edge_index[0, iedge],edge_index[1, iedge]] += coe[iedge,None,None] * Hoff[iedge,ispin,:,:]
-                        SK[edge_index[0, iedge],edge_index[1, iedge]] += coe[iedge,None,None] * Soff[iedge,:,:]
-    
-    
-                    HK = np.swapaxes(HK,-2,-3) #(natoms, nao_max, natoms, nao_max)
-                    HK = HK.reshape(natoms*nao_max, natoms*nao_max)
-                    SK = np.swapaxes(SK,-2,-3) #(natoms, nao_max, natoms, nao_max)
-                    SK = SK.reshape(natoms*nao_max, natoms*nao_max)
-    
-                    # mask HK and SK
-                    #HK = torch.masked_select(HK, orb_mask[idx].repeat(nk,1,1) > 0)
-                    HK = HK[orb_mask > 0]
-                    norbs = int(math.sqrt(HK.size))
-                    HK = HK.reshape(norbs, norbs)
-    
-                    #SK = torch.masked_select(SK, orb_mask[idx].repeat(nk,1,1) > 0)
-                    SK = SK[orb_mask > 0]
-                    norbs = int(math.sqrt(SK.size))
-                    SK = SK.reshape(norbs, norbs)
-
-                    SK_cuda = torch.complex(torch.Tensor(SK.real), torch.Tensor(SK.imag)).unsqueeze(0)
-                    HK_cuda = torch.complex(torch.Tensor(HK.real), torch.Tensor(HK.imag)).unsqueeze(0)
-                    L = torch.linalg.cholesky(SK_cuda)
-                    L_t = torch.transpose(L.conj(), dim0=-1, dim1=-2)
-                    L_inv = torch.linalg.inv(L)
-                    L_t_inv = torch.linalg.inv(L_t)
-                    Hs = torch.bmm(torch.bmm(L_inv, HK_cuda), L_t_inv)
-                    orbital_energies, _ = torch.linalg.eigh(Hs)
-                    orbital_energies = orbital_energies.squeeze(0)
-                    eigen.append(orbital_energies.cpu().numpy())
+                engine = BandEngine(Hon[:, ispin], Hoff[:, ispin], Son, Soff, edge_index, nbr_shift, basis_definition[species])
+                if sparse_mode:
+                    norbs = num_bands
+                    eigen = engine.eigenvalues(k_vec, num_workers=num_workers, num_threads=num_threads,
+                                               sigma=sigma/au2ev, num_bands=num_bands, verbose=True)
+                else:
+                    norbs = engine.norbs
+                    eigen = engine.eigenvalues(k_vec, num_workers=num_workers, num_threads=num_threads)
 
                 eigen = np.swapaxes(np.array(eigen), 0, 1)*au2ev # (nbands, nk)
 
                 # plot fermi line    
                 num_electrons = np.sum(num_val[species])
-                max_val = np.max(eigen[math.ceil(num_electrons/2)-1])
-                min_con = np.min(eigen[math.ceil(num_electrons/2)])
+                if sparse_mode:
+                    eigen, e_min, e_max = common_window(eigen, sigma)
+                    print(f"energy window covered at every k point: [{e_min}, {e_max}] eV")
+                    max_val, min_con = window_band_edges(eigen, sigma)
+                else:
+                    max_val = np.max(eigen[math.ceil(num_electrons/2)-1])
+                    min_con = np.min(eigen[math.ceil(num_electrons/2)])
                 eigen = eigen - max_val
                 print(f'band info for spin No.{ispin}')
                 print(f"max_val = {max_val} eV")
@@ -414,8 +358,12 @@ def main():
                         ax.axvline(x=k_node[n], linewidth=0.5, color='k')
 
                     # plot bands
-                    for n in range(norbs):
-                        ax.plot(k_dist, eigen[n])
+                    if sparse_mode:
+                        # the rows of eigen are not bands in the sparse mode, so the eigenvalues are plotted as points
+                        ax.scatter(np.tile(k_dist, norbs), eigen.reshape(-1), s=2, c='C0')
+                    else:
+                        for n in range(norbs):
+                            ax.plot(k_dist, eigen[n])
                     ax.plot(k_dist, nk*[0.0], linestyle='--')
 
                     # put title
@@ -442,13 +390,19 @@ def main():
                 text_file.write("\n")
 
                 node_index = node_index[1:]
-                for nb in range(len(eigen)):
+                if sparse_mode:
+                    # the eigenvalues inside the window at every k point, which are not connected into bands
                     for ik in range(nk):
-                        text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))
-                        if ik in node_index[:-1]:
-                            text_file.write('\n')
-                            text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))       
-                    text_file.write('\n')
+                        for energy in eigen[:, ik][np.isfinite(eigen[:, ik])]:
+                            text_file.write("%f    %f\n" % (k_dist[ik], energy))
+                else:
+                    for nb in range(len(eigen)):
+                        for ik in range(nk):
+                            text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))
+                            if ik in node_index[:-1]:
+                                text_file.write('\n')
+                                text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))       
+                        text_file.write('\n')
                 text_file.close()
     
     else:
@@ -458,7 +412,12 @@ def main():
             len_H.append(len(graph_dataset[i].Hon))
             len_H.append(len(graph_dataset[i].Hoff))
                
-        if hamiltonian_path is not None:
+        if is_prediction_store(hamiltonian_path):
+            # read the predicted H of every structure from the prediction store when it is needed
+            predictions = PredictionReader(hamiltonian_path)
+            Hon_all = predictions.select(graph_keys, 'prediction_hamiltonian', lambda idx, H: H[:len(graph_dataset[idx].Hon)])
+            Hoff_all = predictions.select(graph_keys, 'prediction_hamiltonian', lambda idx, H: H[len(graph_dataset[idx].Hon):])
+        elif hamiltonian_path is not None:
             H = np.load(hamiltonian_path)
             Hon_all, Hoff_all = [], []
             idx = 0
@@ -501,66 +460,32 @@ def main():
                 k_path = [kpath_seek.kpath['kpoints'][k] for k in klabels]
                 label = [rf'${lb}$' for lb in klabels]            
         
-            orb_mask = basis_definition[species].reshape(-1) # shape: [natoms*nao_max] 
-            orb_mask = orb_mask[:,None] * orb_mask[None,:]       # shape: [natoms*nao_max, natoms*nao_max]
-        
             kpts=kpoints_generator(dim_k=3, lat=latt)
             k_vec, k_dist, k_node, lat_per_inv, node_index = kpts.k_path(k_path, nk)
         
             k_vec = k_vec.dot(lat_per_inv[np.newaxis,:,:]) # shape (nk,1,3)
             k_vec = k_vec.reshape(-1,3) # shape (nk, 3)
         
-            natoms = len(struct)
-            eigen = []
-            for ik in range(nk):
-                HK = np.zeros((natoms, natoms, nao_max, nao_max), dtype=np.complex64)
-                SK = np.zeros((natoms, natoms, nao_max, nao_max), dtype=np.complex64)
-            
-                na = np.arange(natoms)
-                HK[na,na,:,:] +=  Hon[na,:,:] # shape (natoms, nao_max, nao_max)
-                SK[na,na,:,:] +=  Son[na,:,:]
-            
-                coe = np.exp(2j*np.pi*np.sum(nbr_shift*k_vec[ik][None,:], axis=-1)) # shape (nedges,)
-            
-                for iedge in range(len(Hoff)):
-                    # shape (nao_max, nao_max) += (1, 1)*(nao_max, nao_max)
-                    HK[edge_index[0, iedge],edge_index[1, iedge]] += coe[iedge,None,None] * Hoff[iedge,:,:]
-                    SK[edge_index[0, iedge],edge_index[1, iedge]] += coe[iedge,None,None] * Soff[iedge,:,:]
-            
-            
-                HK = np.swapaxes(HK,-2,-3) #(natoms, nao_max, natoms, nao_max)
-                HK = HK.reshape(natoms*nao_max, natoms*nao_max)
-                SK = np.swapaxes(SK,-2,-3) #(natoms, nao_max, natoms, nao_max)
-                SK = SK.reshape(natoms*nao_max, natoms*nao_max)
-            
-                # mask HK and SK
-                #HK = torch.masked_select(HK, orb_mask[idx].repeat(nk,1,1) > 0)
-                HK = HK[orb_mask > 0]
-                norbs = int(math.sqrt(HK.size))
-                HK = HK.reshape(norbs, norbs)
-                        
-                #SK = torch.masked_select(SK, orb_mask[idx].repeat(nk,1,1) > 0)
-                SK = SK[orb_mask > 0]
-                norbs = int(math.sqrt(SK.size))
-                SK = SK.reshape(norbs, norbs)
-
-                SK_cuda = torch.complex(torch.Tensor(SK.real), torch.Tensor(SK.imag)).unsqueeze(0)
-                HK_cuda = torch.complex(torch.Tensor(HK.real), torch.Tensor(HK.imag)).unsqueeze(0)
-                L = torch.linalg.cholesky(SK_cuda)
-                L_t = torch.transpose(L.conj(), dim0=-1, dim1=-2)
-                L_inv = torch.linalg.inv(L)
-                L_t_inv = torch.linalg.inv(L_t)
-                Hs = torch.bmm(torch.bmm(L_inv, HK_cuda), L_t_inv)
-                orbital_energies, _ = torch.linalg.eigh(Hs)
-                orbital_energies = orbital_energies.squeeze(0)
-                eigen.append(orbital_energies.cpu().numpy())
+            engine = BandEngine(Hon, Hoff, Son, Soff, edge_index, nbr_shift, basis_definition[species])
+            if sparse_mode:
+                norbs = num_bands
+                eigen = engine.eigenvalues(k_vec, num_workers=num_workers, num_threads=num_threads,
+                                           sigma=sigma/au2ev, num_bands=num_bands, verbose=True)
+            else:
+                norbs = engine.norbs
+                eigen = engine.eigenvalues(k_vec, num_workers=num_workers, num_threads=num_threads)
             
             eigen = np.swapaxes(np.array(eigen), 0, 1)*au2ev # (nbands, nk)
             
             # plot fermi line    
             num_electrons = np.sum(num_val[species])
-            max_val = np.max(eigen[math.ceil(num_electrons/2)-1])
-            min_con = np.min(eigen[math.ceil(num_electrons/2)])
+            if sparse_mode:
+                eigen, e_min, e_max = common_window(eigen, sigma)
+                print(f"energy window covered at every k point: [{e_min}, {e_max}] eV")
+                max_val, min_con = window_band_edges(eigen, sigma)
+            else:
+                max_val = np.max(eigen[math.ceil(num_electrons/2)-1])
+                min_con = np.min(eigen[math.ceil(num_electrons/2)])
             eigen = eigen - max_val
             print(f"max_val = {max_val} eV")
             print(f"band gap = {min_con - max_val} eV")
@@ -580,8 +505,12 @@ def main():
                     ax.axvline(x=k_node[n], linewidth=0.5, color='k')
             
                 # plot bands
-                for n in range(norbs):
-                    ax.plot(k_dist, eigen[n])
+                if sparse_mode:
+                    # the rows of eigen are not bands in the sparse mode, so the eigenvalues are plotted as points
+                    ax.scatter(np.tile(k_dist, norbs), eigen.reshape(-1), s=2, c='C0')
+                else:
+                    for n in range(norbs):
+                        ax.plot(k_dist, eigen[n])
                 ax.plot(k_dist, nk*[0.0], linestyle='--')
             
                 # put title
@@ -608,13 +537,19 @@ def main():
             text_file.write("\n")
         
             node_index = node_index[1:]
-            for nb in range(len(eigen)):
+            if sparse_mode:
+                # the eigenvalues inside the window at every k point, which are not connected into bands
                 for ik in range(nk):
-                    text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))
-                    if ik in node_index[:-1]:
-                        text_file.write('\n')
-                        text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))       
-                text_file.write('\n')
+                    for energy in eigen[:, ik][np.isfinite(eigen[:, ik])]:
+                        text_file.write("%f    %f\n" % (k_dist[ik], energy))
+            else:
+                for nb in range(len(eigen)):
+                    for ik in range(nk):
+                        text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))
+                        if ik in node_index[:-1]:
+                            text_file.write('\n')
+                            text_file.write("%f    %f\n" % (k_dist[ik], eigen[nb,ik]))       
+                    text_file.write('\n')
             text_file.close()
 
 if __name__ == '__main__':
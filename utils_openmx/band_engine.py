@@ -0,0 +1,337 @@
+'''
+Descripttion: Parallel k-point engine of band_cal: vectorized dense or sparse assembly of H(k)/S(k) and a worker pool sharing H(R) through shared memory.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-16 23:48:09
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-16 23:48:09
+'''
+
+import numpy as np
+import torch
+import multiprocessing
+from multiprocessing import shared_memory
+from time import time
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import eigsh
+from HamGNN_v_2_0.models.eigen_solver import generalized_eigh
+
+# the engine of a worker process, built from the shared memory in _init_worker
+_worker_engine = None
+_worker_shms = []
+
+
+def orbital_index(orb_mask: np.ndarray, nspinor: int = 1) -> np.ndarray:
+    """
+    The index of every padded orbital in the matrix of the whole structure, -1 for the unoccupied ones.
+    For spinors the spin-up orbitals of all atoms come first.
+    @param orb_mask: the occupied orbitals of the padded blocks of every atom, shape: (natoms, nao_max)
+    @return: shape: (natoms, nspinor*nao_max)
+    """
+    orb_mask = np.asarray(orb_mask) > 0
+    norbs = int(orb_mask.sum())
+    orb_index = np.where(orb_mask, np.cumsum(orb_mask).reshape(orb_mask.shape) - 1, -1)
+    return np.concatenate([np.where(orb_index >= 0, orb_index + s*norbs, -1) for s in range(nspinor)], axis=1)
+
+
+def compress_blocks(blocks: np.ndarray, row_index: np.ndarray, col_index: np.ndarray, dim: int):
+    """
+    Keep the values of the occupied orbitals of the flattened blocks.
+    @param blocks: shape: (nblocks, n*n)
+    @param row_index, col_index: the orbital index of the rows and the columns of every block (see orbital_index), shape: (nblocks, n)
+    @param dim: the dimension of the matrix of the whole structure
+    @return: values, their flat index in the dense matrix and their block, shape: (nvalues,)
+    """
+    n = row_index.shape[1]
+    valid = (row_index[:, :, None] >= 0) & (col_index[:, None, :] >= 0) # shape: (nblocks, n, n)
+    dst = row_index[:, :, None]*dim + col_index[:, None, :]
+    blk, _, _ = np.nonzero(valid)
+    valid = valid.reshape(len(blocks), n*n)
+    return blocks[valid], dst.reshape(len(blocks), n*n)[valid], blk.astype(np.int64)
+
+
+def sparse_block_matrix(on_blocks: np.ndarray, off_blocks: np.ndarray, edge_index: np.ndarray, orb_mask: np.ndarray,
+                        nbr_shift: np.ndarray = None, k: np.ndarray = None, nspinor: int = 1, chunk_size: int = 100000) -> csr_matrix:
+    """
+    The sparse matrix M(k) = sum_R M(R) exp(2*pi*i*k.R) of a whole structure built directly from its padded blocks,
+    chunk_size blocks at a time, so that the memory scales linearly with the number of edges. At k = None
+    (the Gamma point) the matrix is real for real blocks.
+    For spinors (nspinor=2) the blocks are (2*nao_max, 2*nao_max).
+    """
+    natoms = len(on_blocks)
+    edge_index = np.asarray(edge_index).reshape(2, -1)
+    index = orbital_index(orb_mask, nspinor)
+    dim = int((index >= 0).sum())
+    block_i = np.concatenate([np.arange(natoms), edge_index[0]])
+    block_j = np.concatenate([np.arange(natoms), edge_index[1]])
+    blocks = [np.asarray(on_blocks).reshape(natoms, -1), np.asarray(off_blocks).reshape(edge_index.shape[1], -1)]
+    if k is not None:
+        phase = np.exp(2j*np.pi*(np.concatenate([np.zeros((natoms, 3)), np.asarray(nbr_shift).reshape(-1, 3)], axis=0) @ np.asarray(k, dtype=float)))
+    M = None
+    for start in range(0, len(block_i), chunk_size):
+        iblock = np.arange(start, min(start + chunk_size, len(block_i)))
+        chunk = np.concatenate([blocks[0][iblock[iblock < natoms]], blocks[1][iblock[iblock >= natoms] - natoms]], axis=0)
+        val, dst, blk = compress_blocks(chunk, index[block_i[iblock]], index[block_j[iblock]], dim)
+        if k is not None:
+            val = val*phase[iblock][blk]
+        row, col = np.divmod(dst, dim)
+        chunk_matrix = csr_matrix((val, (row, col)), shape=(dim, dim))
+        M = chunk_matrix if M is None else M + chunk_matrix
+    return M
+
+
+class BandEngine(object):
+    """
+    Computes the bands of one structure from its real-space blocks H(R) and S(R).
+
+    The padded (nao_max x nao_max) blocks are compressed once into the values of the occupied orbitals,
+    the flat index of every value in the dense H(k) and the block it belongs to. H(k) is then assembled with
+    one phase-weighted bincount over all values instead of a Python loop over the edges:
+        H(k)[dst] = sum Hval * exp(2*pi*i*k.R_block)
+    The on-site blocks are treated as blocks with R = 0.
+
+    For large systems H(k) and S(k) can be built as sparse matrices from the same block list and only
+    the bands closest to an energy sigma (e.g. the Fermi level) are computed with the shift-invert Lanczos
+    method, which needs neither the dense matrices nor a full diagonalization.
+
+    For spinors (nspinor=2, SOC) the blocks of H are (2*nao_max, 2*nao_max) with the spin-up orbitals first,
+    and S(k) is kron(I_2, S(k)) like in band_cal.
+
+    Args:
+        Hon (np.ndarray): on-site blocks of H, shape: (natoms, nspinor*nao_max, nspinor*nao_max)
+        Hoff (np.ndarray): off-site blocks of H, shape: (nedges, nspinor*nao_max, nspinor*nao_max)
+        Son (np.ndarray): on-site blocks of S, shape: (natoms, nao_max, nao_max)
+        Soff (np.ndarray): off-site blocks of S, shape: (nedges, nao_max, nao_max)
+        edge_index (np.ndarray): shape: (2, nedges)
+        nbr_shift (np.ndarray): the cartesian shifts of the edges, shape: (nedges, 3)
+        orb_mask (np.ndarray): the occupied orbitals of the padded blocks of every atom, shape: (natoms, nao_max)
+        nspinor (int): 1 or 2
+    """
+
+    def __init__(self, Hon, Hoff, Son, Soff, edge_index, nbr_shift, orb_mask, nspinor: int = 1):
+        orb_mask = np.asarray(orb_mask) > 0
+        natoms, nao_max = orb_mask.shape
+        self.norbs = int(orb_mask.sum())
+        self.nspinor = nspinor
+        edge_index = np.asarray(edge_index).reshape(2, -1)
+        # the R of every block, the on-site blocks first
+        self.block_shift = np.concatenate([np.zeros((natoms, 3)), np.asarray(nbr_shift).reshape(-1, 3)], axis=0)
+        block_i = np.concatenate([np.arange(natoms), edge_index[0]])
+        block_j = np.concatenate([np.arange(natoms), edge_index[1]])
+
+        # the index of every padded orbital in H(k), -1 for the unoccupied ones
+        orb_index = orbital_index(orb_mask)
+        spinor_index = orbital_index(orb_mask, nspinor)
+
+        H = np.concatenate([np.asarray(Hon).reshape(natoms, -1), np.asarray(Hoff).reshape(edge_index.shape[1], -1)], axis=0)
+        self.H_val, self.H_dst, self.H_blk = compress_blocks(H, spinor_index[block_i], spinor_index[block_j], self.dim)
+        S = np.concatenate([np.asarray(Son).reshape(natoms, -1), np.asarray(Soff).reshape(edge_index.shape[1], -1)], axis=0)
+        S_val, S_dst, S_blk = compress_blocks(S, orb_index[block_i], orb_index[block_j], self.dim)
+        # kron(I_nspinor, S)
+        dim = self.dim
+        S_row, S_col = divmod(S_dst, dim)
+        self.S_val = np.tile(S_val, nspinor)
+        self.S_dst = np.concatenate([(S_row + s*self.norbs)*dim + S_col + s*self.norbs for s in range(nspinor)])
+        self.S_blk = np.tile(S_blk, nspinor)
+
+    @property
+    def dim(self):
+        return self.nspinor*self.norbs
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, norbs: int, nspinor: int):
+        """
+        Build an engine from already compressed arrays (e.g. views into shared memory).
+        """
+        engine = cls.__new__(cls)
+        engine.norbs = norbs
+        engine.nspinor = nspinor
+        for name, array in arrays.items():
+            setattr(engine, name, array)
+        return engine
+
+    def arrays(self) -> dict:
+        return {name: getattr(self, name) for name in ('block_shift', 'H_val', 'H_dst', 'H_blk', 'S_val', 'S_dst', 'S_blk')}
+
+    def _bloch_sum(self, val, dst, blk, k):
+        phase = np.exp(2j*np.pi*(self.block_shift @ k)) # shape: (nblocks,)
+        weighted = val*phase[blk]
+        M = np.bincount(dst, weights=weighted.real, minlength=self.dim**2) + \
+            1j*np.bincount(dst, weights=weighted.imag, minlength=self.dim**2)
+        return M.reshape(self.dim, self.dim)
+
+    def HK(self, k: np.ndarray) -> np.ndarray:
+        """
+        H(k) at the cartesian k point (in units of 2*pi), shape: (dim, dim)
+        """
+        return self._bloch_sum(self.H_val, self.H_dst, self.H_blk, np.asarray(k, dtype=float))
+
+    def SK(self, k: np.ndarray) -> np.ndarray:
+        return self._bloch_sum(self.S_val, self.S_dst, self.S_blk, np.asarray(k, dtype=float))
+
+    def _sparse_bloch_sum(self, val, dst, blk, k):
+        phase = np.exp(2j*np.pi*(self.block_shift @ k)) # shape: (nblocks,)
+        row, col = np.divmod(dst, self.dim)
+        # the duplicated (row, col) entries are summed
+        return csr_matrix((val*phase[blk], (row, col)), shape=(self.dim, self.dim))
+
+    def HK_sparse(self, k: np.ndarray) -> csr_matrix:
+        """
+        H(k) as a sparse matrix, without building the dense matrix.
+        """
+        return self._sparse_bloch_sum(self.H_val, self.H_dst, self.H_blk, np.asarray(k, dtype=float))
+
+    def SK_sparse(self, k: np.ndarray) -> csr_matrix:
+        return self._sparse_bloch_sum(self.S_val, self.S_dst, self.S_blk, np.asarray(k, dtype=float))
+
+    def eigenvalues_at(self, k_vec: np.ndarray, sigma: float = None, num_bands: int = None):
+        """
+        The eigenvalues at the k points, computed one after another in this process.
+        If sigma is None, all eigenvalues are computed from the dense H(k) and S(k), shape: (nk, dim).
+        Otherwise the num_bands eigenvalues closest to sigma are computed from the sparse H(k) and S(k) with
+        the shift-invert Lanczos method, shape: (nk, num_bands).
+        @return: the eigenvalues and the wall time spent on every k point, shape: (nk,)
+        """
+        eigen, timings = [], []
+        for k in np.asarray(k_vec).reshape(-1, 3):
+            time1 = time()
+            if sigma is None:
+                HK = torch.from_numpy(self.HK(k).astype(np.complex64)).unsqueeze(0)
+                SK = torch.from_numpy(self.SK(k).astype(np.complex64)).unsqueeze(0)
+                eigen.append(generalized_eigh(HK, SK, eigenvectors=False).squeeze(0).cpu().numpy())
+            else:
+                eigenvalues = eigsh(self.HK_sparse(k), k=num_bands, M=self.SK_sparse(k), sigma=sigma,
+                                    which='LM', return_eigenvectors=False)
+                eigen.append(np.sort(eigenvalues.real))
+            timings.append(time() - time1)
+        nbands = self.dim if sigma is None else num_bands
+        return np.array(eigen).reshape(-1, nbands), np.array(timings)
+
+    def eigenvalues(self, k_vec: np.ndarray, num_workers: int = 1, num_threads: int = None, chunk_size: int = None,
+                    sigma: float = None, num_bands: int = None, verbose: bool = False) -> np.ndarray:
+        """
+        The eigenvalues at the k points, shape: (nk, dim), or (nk, num_bands) if sigma is given.
+
+        Args:
+            k_vec (np.ndarray): the cartesian k points, shape: (nk, 3)
+            num_workers (int): the number of worker processes. The k points are computed in this process if num_workers <= 1.
+            num_threads (int, optional): the number of threads of torch in every worker.
+            chunk_size (int, optional): the number of k points per task, by default the k points are evenly
+                distributed with a few tasks per worker for load balancing.
+            sigma (float, optional): if given, only the num_bands bands closest to the energy sigma (in Hartree)
+                are computed with the sparse shift-invert solver.
+            num_bands (int, optional): the number of bands computed around sigma.
+            verbose (bool): print the time spent on every k point.
+        """
+        k_vec = np.asarray(k_vec, dtype=float).reshape(-1, 3)
+        if sigma is not None:
+            # eigsh hands the complex H(k) to ARPACK's eigs, which needs num_bands < dim - 1
+            if num_bands is None or num_bands >= self.dim - 1:
+                raise ValueError(f'num_bands must be given and smaller than the number of orbitals minus one ({self.dim - 1}) in the sparse mode!')
+        num_workers = min(num_workers, len(k_vec))
+        if num_workers <= 1:
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            eigen, timings = self.eigenvalues_at(k_vec, sigma=sigma, num_bands=num_bands)
+            if verbose:
+                _print_timings(timings)
+            return eigen
+
+        if chunk_size is None:
+            chunk_size = max(1, int(np.ceil(len(k_vec)/(4*num_workers))))
+        chunks = [k_vec[i:i+chunk_size] for i in range(0, len(k_vec), chunk_size)]
+
+        # share the compressed H(R) and S(R) with the workers instead of pickling them for every task
+        shms, spec = share_arrays(self.arrays())
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            with ctx.Pool(processes=num_workers, initializer=_init_worker,
+                          initargs=(spec, self.norbs, self.nspinor, num_threads)) as pool:
+                results = pool.starmap(_solve_chunk, [(chunk, sigma, num_bands) for chunk in chunks])
+        finally:
+            release_arrays(shms)
+        if verbose:
+            _print_timings(np.concatenate([timings for _, timings in results]))
+        return np.concatenate([eigen for eigen, _ in results], axis=0)
+
+
+def window_band_edges(eigen: np.ndarray, sigma: float):
+    """
+    The highest band energy below sigma and the lowest band energy above sigma of the bands computed in the
+    sparse mode, i.e. the band edges if sigma lies in the gap. nan if there is no band on one side.
+    """
+    below, above = eigen[eigen <= sigma], eigen[eigen > sigma]
+    max_val = np.max(below) if below.size > 0 else np.nan
+    min_con = np.min(above) if above.size > 0 else np.nan
+    return max_val, min_con
+
+
+def common_window(eigen: np.ndarray, sigma: float):
+    """
+    In the sparse mode every k point has the bands closest to sigma, i.e. all bands of a different energy window
+    around sigma, so the n-th computed eigenvalue is not the same band at every k point. This keeps the eigenvalues
+    inside the widest window [sigma - r, sigma + r] that is complete at every k point and sets the others to nan.
+    Request more bands than needed with num_bands to widen the window.
+    @return: the eigenvalues (same shape as eigen), e_min and e_max of the window
+    """
+    eigen = np.array(eigen, dtype=float)
+    # the half width of the window computed at every k point (the bands are along the first axis)
+    radius = np.min(np.max(np.abs(eigen - sigma), axis=0))
+    eigen[np.abs(eigen - sigma) > radius] = np.nan
+    return eigen, sigma - radius, sigma + radius
+
+
+def share_arrays(arrays: dict):
+    """
+    Copy the arrays into new shared memory blocks.
+    @return: the shared memory blocks, which must be released with release_arrays, and the spec passed to attach_arrays
+    """
+    shms, spec = [], {}
+    try:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shms.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            spec[name] = (shm.name, array.shape, array.dtype.str)
+    except BaseException:
+        release_arrays(shms)
+        raise
+    return shms, spec
+
+
+def attach_arrays(spec: dict, shms: list) -> dict:
+    """
+    Views of the arrays shared by share_arrays (in a worker process). The opened blocks are appended to shms,
+    which must be kept alive as long as the views are used.
+    """
+    arrays = {}
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shms.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return arrays
+
+
+def release_arrays(shms: list):
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+
+def _init_worker(spec: dict, norbs: int, nspinor: int, num_threads: int = None):
+    global _worker_engine
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    arrays = attach_arrays(spec, _worker_shms)
+    _worker_engine = BandEngine.from_arrays(arrays, norbs, nspinor)
+
+
+def _solve_chunk(k_vec: np.ndarray, sigma: float = None, num_bands: int = None):
+    return _worker_engine.eigenvalues_at(k_vec, sigma=sigma, num_bands=num_bands)
+
+
+def _print_timings(timings: np.ndarray):
+    for ik, timing in enumerate(timings):
+        print(f'k point {ik+1}/{len(timings)}: {timing:.3f} s')
+    print(f'total time of the k points: {np.sum(timings):.3f} s', flush=True)
@@ -0,0 +1,122 @@
+'''
+Descripttion: Vectorized placement of the orbital blocks read from DFT codes into padded nao_max x nao_max blocks.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-16 15:02:11
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-16 15:02:11
+'''
+
+import numpy as np
+from typing import Union, List
+
+
+class BlockScatter(object):
+    """
+    Scatters the orbital blocks of on-site and off-site matrices into the padded (nao_max*nao_max) layout used by HamGNN.
+
+    The flat destination indices of a block only depend on the species of its two atoms, so they are
+    built once per species pair and cached. All blocks of the same species pair are then filled with
+    a single fancy-indexing assignment instead of building a mask for every block.
+
+    Args:
+        basis_def (dict): maps the atomic number to the indices of its orbitals in the padded block.
+        nao_max (int): the maximum number of atomic orbitals.
+        mask_order (bool): If True, the values of a block are placed in the ascending order of the padded
+            indices, which is the same as `H[mask] = values` with a boolean mask built from basis_def
+            (OpenMX, ABACUS). If False, they are placed with `H[basis_def[zi][:,None], basis_def[zj][None,:]] = values`,
+            i.e. in the order given by basis_def (SIESTA). Both are identical for sorted basis_def.
+    """
+
+    def __init__(self, basis_def: dict, nao_max: int, mask_order: bool = True):
+        self.basis_def = basis_def
+        self.nao_max = nao_max
+        self.mask_order = mask_order
+        self.num_orbitals = np.zeros((max(basis_def.keys())+1,), dtype=int)
+        for z, orbitals in basis_def.items():
+            self.num_orbitals[z] = len(orbitals)
+        self._index_cache = dict()
+
+    def pair_index(self, zi: int, zj: int) -> np.ndarray:
+        """
+        The flat indices in the padded block of the elements of a (zi, zj) block.
+        """
+        key = (int(zi), int(zj))
+        if key not in self._index_cache:
+            index = (np.asarray(self.basis_def[key[0]])[:,None]*self.nao_max + np.asarray(self.basis_def[key[1]])[None,:]).reshape(-1)
+            if self.mask_order:
+                index = np.sort(index)
+            self._index_cache[key] = index
+        return self._index_cache[key]
+
+    def block_sizes(self, z_row: np.ndarray, z_col: np.ndarray) -> np.ndarray:
+        return self.num_orbitals[z_row]*self.num_orbitals[z_col]
+
+    def scatter(self, blocks: Union[List, np.ndarray], z_row: np.ndarray, z_col: np.ndarray,
+                out: np.ndarray = None, dim: int = None, dtype=np.float64) -> np.ndarray:
+        """
+        Place the blocks into the padded layout.
+
+        Args:
+            blocks: a list of flattened blocks (arrays or lists) or all blocks concatenated into a 1-D array.
+                The elements of every block are in row-major order; if dim is given, every element is a vector of length dim.
+            z_row (np.ndarray): atomic numbers of the row atoms of the blocks, shape: (num_blocks,)
+            z_col (np.ndarray): atomic numbers of the column atoms of the blocks, shape: (num_blocks,)
+            out (np.ndarray, optional): the output array, shape: (num_blocks, nao_max**2) or (num_blocks, nao_max**2, dim).
+                It can be a view into a larger array. A new zero array is allocated if None.
+            dim (int, optional): the length of the vector elements (e.g. 3 for the L matrices).
+            dtype: the dtype of the new output array.
+
+        Returns:
+            np.ndarray: out
+        """
+        z_row = np.asarray(z_row, dtype=int).reshape(-1)
+        z_col = np.asarray(z_col, dtype=int).reshape(-1)
+        num_blocks = len(z_row)
+        if out is None:
+            shape = (num_blocks, self.nao_max**2) if dim is None else (num_blocks, self.nao_max**2, dim)
+            out = np.zeros(shape, dtype=dtype)
+        if num_blocks == 0:
+            return out
+
+        if isinstance(blocks, np.ndarray) and blocks.dtype != object:
+            values = blocks.reshape(-1)
+        else:
+            values = np.concatenate([np.asarray(block).reshape(-1) for block in blocks])
+        if dim is not None:
+            values = values.reshape(-1, dim)
+
+        sizes = self.block_sizes(z_row, z_col)
+        if len(values) != sizes.sum():
+            raise ValueError(f'The number of elements of the blocks ({len(values)}) does not match the basis definition ({sizes.sum()})!')
+        offsets = np.cumsum(sizes) - sizes
+
+        # fill all blocks of the same species pair at once
+        pair_keys = z_row*len(self.num_orbitals) + z_col
+        unique_keys, inverse = np.unique(pair_keys, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        group_ends = np.cumsum(np.bincount(inverse, minlength=len(unique_keys)))
+        group_starts = np.concatenate([[0], group_ends[:-1]])
+        for ikey, key in enumerate(unique_keys):
+            rows = order[group_starts[ikey]:group_ends[ikey]]
+            zi, zj = divmod(int(key), len(self.num_orbitals))
+            index = self.pair_index(zi, zj)
+            src = offsets[rows][:,None] + np.arange(len(index))[None,:]
+            out[rows[:,None], index[None,:]] = values[src]
+        return out
+
+    def scatter_graph(self, on_blocks, off_blocks, z: np.ndarray, edge_index: np.ndarray,
+                      out: np.ndarray = None, dim: int = None, dtype=np.float64) -> np.ndarray:
+        """
+        Place the on-site blocks of all atoms followed by the off-site blocks of all edges,
+        i.e. the (natoms + nedges, nao_max**2) layout of the `hamiltonian` and `overlap` fields.
+        """
+        z = np.asarray(z, dtype=int)
+        edge_index = np.asarray(edge_index, dtype=int).reshape(2, -1)
+        num_sub_matrix = len(z) + edge_index.shape[1]
+        if out is None:
+            shape = (num_sub_matrix, self.nao_max**2) if dim is None else (num_sub_matrix, self.nao_max**2, dim)
+            out = np.zeros(shape, dtype=dtype)
+        self.scatter(on_blocks, z, z, out=out[:len(z)], dim=dim)
+        self.scatter(off_blocks, z[edge_index[0]], z[edge_index[1]], out=out[len(z):], dim=dim)
+        return out
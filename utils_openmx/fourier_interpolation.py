@@ -0,0 +1,145 @@
+'''
+Descripttion: Fourier interpolation of H(R) and S(R) to dense uniform k meshes with FFTs.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 01:27:53
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 01:27:53
+'''
+
+import numpy as np
+import torch
+from typing import Tuple
+from utils_openmx.band_engine import orbital_index, compress_blocks
+from HamGNN_v_2_0.models.eigen_solver import generalized_eigh
+
+
+def monkhorst_pack(mesh: Tuple[int, int, int], shift: Tuple[float, float, float] = (0, 0, 0)) -> np.ndarray:
+    """
+    The fractional coordinates of the k points of a uniform mesh, k = (m + shift)/mesh for m = 0, ..., mesh-1,
+    in the order of the k points returned by FourierInterpolator (the last axis runs fastest).
+    shift = (0.5, 0.5, 0.5) gives the Monkhorst-Pack mesh of even meshes.
+    @return: shape: (n1*n2*n3, 3)
+    """
+    mesh = np.asarray(mesh, dtype=int)
+    grid = np.stack(np.meshgrid(*[np.arange(n) for n in mesh], indexing='ij'), axis=-1).reshape(-1, 3)
+    return (grid + np.asarray(shift, dtype=float))/mesh
+
+
+class FourierInterpolator(object):
+    """
+    H(k) = sum_R H(R) exp(2*pi*i*k.R) and S(k) on a whole uniform k mesh at once.
+
+    The on-site and off-site blocks are grouped by their cell shift R into the dense matrices H(R) of the
+    structure. On the mesh k = (m + shift)/mesh the phase of R only depends on R modulo the mesh, so H(R) is
+    folded onto the mesh grid (after the phase of the shift is applied) and one 3D FFT per orbital pair gives
+    H(k) at all k points. This replaces the O(Nk x Nedges) phase sums by O(N_R log N_R) work per orbital pair.
+
+    The conventions are the same as in band_cal: k.R = k_frac.cell_shift, and for spinors (nspinor=2, SOC)
+    the blocks of H are (2*nao_max, 2*nao_max) and S(k) is kron(I_2, S(k)).
+
+    Args:
+        Hon (np.ndarray): on-site blocks of H, shape: (natoms, nspinor*nao_max, nspinor*nao_max)
+        Hoff (np.ndarray): off-site blocks of H, shape: (nedges, nspinor*nao_max, nspinor*nao_max)
+        Son (np.ndarray): on-site blocks of S, shape: (natoms, nao_max, nao_max)
+        Soff (np.ndarray): off-site blocks of S, shape: (nedges, nao_max, nao_max)
+        edge_index (np.ndarray): shape: (2, nedges)
+        cell_shift (np.ndarray): the integer cell shifts of the edges, shape: (nedges, 3)
+        orb_mask (np.ndarray): the occupied orbitals of the padded blocks of every atom, shape: (natoms, nao_max)
+        nspinor (int): 1 or 2
+    """
+
+    def __init__(self, Hon, Hoff, Son, Soff, edge_index, cell_shift, orb_mask, nspinor: int = 1):
+        natoms = len(orb_mask)
+        edge_index = np.asarray(edge_index).reshape(2, -1)
+        self.nspinor = nspinor
+        self.norbs = int((np.asarray(orb_mask) > 0).sum())
+        cell_shift = np.rint(np.asarray(cell_shift)).reshape(-1, 3).astype(int)
+        block_shift = np.concatenate([np.zeros((natoms, 3), dtype=int), cell_shift], axis=0)
+        # the lattice vectors R of H(R) and the R of every block
+        self.R, block_R = np.unique(block_shift, axis=0, return_inverse=True)
+        block_R = block_R.reshape(-1)
+        block_i = np.concatenate([np.arange(natoms), edge_index[0]])
+        block_j = np.concatenate([np.arange(natoms), edge_index[1]])
+
+        H = np.concatenate([np.asarray(Hon).reshape(natoms, -1), np.asarray(Hoff).reshape(edge_index.shape[1], -1)], axis=0)
+        index = orbital_index(orb_mask, nspinor)
+        self.HR = self._group(*compress_blocks(H, index[block_i], index[block_j], self.dim), block_R, self.dim)
+        S = np.concatenate([np.asarray(Son).reshape(natoms, -1), np.asarray(Soff).reshape(edge_index.shape[1], -1)], axis=0)
+        index = orbital_index(orb_mask)
+        SR = self._group(*compress_blocks(S, index[block_i], index[block_j], self.norbs), block_R, self.norbs)
+        if nspinor > 1:
+            SR = np.einsum('st,rij->rsitj', np.eye(nspinor), SR).reshape(-1, self.dim, self.dim) # kron(I, S(R))
+        self.SR = SR
+
+    @property
+    def dim(self):
+        return self.nspinor*self.norbs
+
+    def _group(self, val, dst, blk, block_R, dim):
+        """
+        Sum the compressed values of the blocks into the dense matrices of every R, shape: (nR, dim, dim)
+        """
+        flat = block_R[blk]*dim*dim + dst
+        if np.iscomplexobj(val):
+            M = np.bincount(flat, weights=val.real, minlength=len(self.R)*dim*dim) + \
+                1j*np.bincount(flat, weights=val.imag, minlength=len(self.R)*dim*dim)
+        else:
+            M = np.bincount(flat, weights=val, minlength=len(self.R)*dim*dim)
+        return M.reshape(len(self.R), dim, dim)
+
+    def _interpolate(self, MR: np.ndarray, mesh, shift) -> np.ndarray:
+        mesh = np.asarray(mesh, dtype=int)
+        shift = np.asarray(shift, dtype=float)
+        # exp(2*pi*i*(m + shift).R/mesh) = exp(2*pi*i*shift.R/mesh) exp(2*pi*i*m.(R mod mesh)/mesh)
+        phase = np.exp(2j*np.pi*np.sum(self.R*shift/mesh, axis=-1))
+        grid = np.zeros(tuple(mesh) + MR.shape[1:], dtype=np.complex128)
+        folded = np.mod(self.R, mesh)
+        np.add.at(grid, (folded[:, 0], folded[:, 1], folded[:, 2]), MR*phase[:, None, None])
+        # numpy's ifftn has the exp(+2*pi*i*m*R/n) phases of H(k) and a 1/N factor
+        MK = np.fft.ifftn(grid, axes=(0, 1, 2))*np.prod(mesh)
+        return MK.reshape((-1,) + MR.shape[1:])
+
+    def HK(self, mesh: Tuple[int, int, int], shift: Tuple[float, float, float] = (0, 0, 0)) -> np.ndarray:
+        """
+        H(k) at the k points of monkhorst_pack(mesh, shift), shape: (nk, dim, dim)
+        """
+        return self._interpolate(self.HR, mesh, shift)
+
+    def SK(self, mesh: Tuple[int, int, int], shift: Tuple[float, float, float] = (0, 0, 0)) -> np.ndarray:
+        return self._interpolate(self.SR, mesh, shift)
+
+    def eigh(self, mesh: Tuple[int, int, int], shift: Tuple[float, float, float] = (0, 0, 0), chunk_size: int = 64,
+             eigenvectors: bool = False, band_window: Tuple[int, int] = None, ir_mesh=None):
+        """
+        Solve H(k) C = S(k) C E at the k points of monkhorst_pack(mesh, shift). H(k) and S(k) of the whole mesh
+        come from two FFTs and are diagonalized in batches of chunk_size k points.
+
+        If ir_mesh (an IrreducibleMesh of the same mesh) is given, only the irreducible k points are diagonalized
+        and the eigenvalues are unfolded to the full mesh. The eigenvectors can not be unfolded without the
+        representation of the rotations in the orbital basis, so they are not available in this case.
+
+        Returns:
+            the eigenvalues, shape: (nk, nbands), and the eigenvectors, shape: (nk, dim, nbands), if eigenvectors is True.
+        """
+        HK = self.HK(mesh, shift)
+        SK = self.SK(mesh, shift)
+        if ir_mesh is not None:
+            if eigenvectors:
+                raise ValueError('The eigenvectors can not be unfolded from the irreducible k points!')
+            if not (np.array_equal(ir_mesh.mesh, mesh) and np.allclose(ir_mesh.shift, shift)):
+                raise ValueError('The irreducible mesh does not match the k mesh!')
+            HK, SK = HK[ir_mesh.ir_index], SK[ir_mesh.ir_index]
+        eigen, vectors = [], []
+        for start in range(0, len(HK), chunk_size):
+            result = generalized_eigh(torch.from_numpy(HK[start:start+chunk_size]), torch.from_numpy(SK[start:start+chunk_size]),
+                                      band_window=band_window, eigenvectors=eigenvectors)
+            if eigenvectors:
+                eigen.append(result[0].numpy())
+                vectors.append(result[1].numpy())
+            else:
+                eigen.append(result.numpy())
+        if eigenvectors:
+            return np.concatenate(eigen, axis=0), np.concatenate(vectors, axis=0)
+        eigen = np.concatenate(eigen, axis=0)
+        return eigen if ir_mesh is None else ir_mesh.unfold(eigen)
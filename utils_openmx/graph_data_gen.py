@@ -10,7 +10,6 @@ LastEditTime: 2023-12-18 16:13:22
 import json
 import numpy as np
 import os
-import sys
 from torch_geometric.data import Data
 import torch
 import glob
@@ -21,12 +20,288 @@ from pymatgen.core.periodic_table import Element
 from utils_openmx.utils import *
 import argparse
 import yaml
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+from HamGNN_v_2_0.GraphData.graph_store import GraphStoreWriter
+from utils_openmx.block_scatter import BlockScatter
+from utils_openmx.inverse_edge import find_inverse_edge_index
+
+# scratch directory of the current (worker) process, in which read_openmx writes HS.json
+_scratch_dir = None
+
+def _init_scratch(scratch_root: str):
+    global _scratch_dir
+    _scratch_dir = tempfile.mkdtemp(prefix='worker_', dir=scratch_root)
+
+def _init_worker(scratch_root: str):
+    # the pool workers run one thread each, the main process keeps the threads of torch
+    _init_scratch(scratch_root)
+    torch.set_num_threads(1)
+
+def read_openmx_hs(read_openmx_path: str, f_scfout: str, scratch_dir: str, quiet: bool = False, binary: bool = False):
+    """
+    Run read_openmx on f_scfout inside scratch_dir and load the HS.json (or HS.bin if binary is True) it writes there.
+    Returns None if read_openmx fails or the output can not be parsed.
+    """
+    f_out = os.path.join(scratch_dir, 'HS.bin' if binary else 'HS.json')
+    if os.path.exists(f_out):
+        os.remove(f_out)
+    cmd = [read_openmx_path, os.path.abspath(f_scfout)]
+    if binary:
+        cmd.append('-b')
+    subprocess.run(cmd, cwd=scratch_dir, stdout=subprocess.DEVNULL if quiet else None)
+    if not os.path.exists(f_out):
+        return None
+    if binary:
+        try:
+            # The arrays are views into the memory-mapped file, which stays readable after it is removed.
+            load_dict = read_openmx_bin(f_out)
+        except:
+            print(f'{f_scfout} is not read successfully!')
+            load_dict = None
+    else:
+        with open(f_out, 'r') as load_f:
+            try:
+                load_dict = json.load(load_f)
+            except:
+                print(f'{f_scfout} is not read successfully!')
+                load_dict = None
+    os.remove(f_out)
+    return load_dict
+
+def generate_graph(scf_path: str, params: dict):
+    """
+    Generate the graph of the openmx calculation in scf_path.
+    Returns None if the calculation is skipped.
+    """
+    nao_max = params['nao_max']
+    block_scatter = params['block_scatter']
+    read_openmx_path = params['read_openmx_path']
+    max_SCF_skip = params['max_SCF_skip']
+    dat_file_name = params['dat_file_name']
+    std_file_name = params['std_file_name']
+    scfout_file_name = params['scfout_file_name']
+    soc_switch = params['soc_switch']
+    doping_charge = params['doping_charge']
+    quiet = params['num_workers'] > 1
+    binary = params['read_openmx_format'] == 'binary'
+    scratch_dir = _scratch_dir
+
+    # file paths
+    f_sc = os.path.join(scf_path, scfout_file_name)
+    f_dat = os.path.join(scf_path, dat_file_name)
+    f_H0 = os.path.join(scf_path, "overlap.scfout")
+
+    # read energy
+    if std_file_name is not None:
+        f_std = os.path.join(scf_path, std_file_name)
+        try:
+            with open(f_std, 'r') as f:
+                content = f.read()
+                Enpy = float(pattern_eng.findall((content).strip())[0][-1])
+                max_SCF = int(pattern_md.findall((content).strip())[-1][-1])
+        except:
+            return None
+    else:
+        Enpy = 0.0
+        max_SCF = 1
+
+
+    # check if the calculation is converged
+    if max_SCF > max_SCF_skip:
+        return None
+
+    # Read crystal parameters
+    try:
+        with open(f_dat,'r') as f:
+            content = f.read()
+            speciesAndCoordinates = pattern_coor.findall((content).strip())
+            latt = pattern_latt.findall((content).strip())[0]
+            latt = np.array([float(var) for var in latt]).reshape(-1, 3)/au2ang
+
+            species = []
+            coordinates = []
+            for item in speciesAndCoordinates:
+                species.append(item[0])
+                coordinates += item[1:]
+            z = atomic_numbers = np.array([Element[s].Z for s in species])
+            coordinates = np.array([float(pos) for pos in coordinates]).reshape(-1, 3)/au2ang
+    except:
+        return None
+
+    if soc_switch:
+        # read hopping parameters
+        load_dict = read_openmx_hs(read_openmx_path, f_sc, scratch_dir, quiet, binary)
+        if load_dict is None:
+            return None
+
+        pos = np.array(load_dict['pos'])
+        edge_index = np.array(load_dict['edge_index'])
+        #
+        Hon = load_dict['Hon']
+        Hoff = load_dict['Hoff']
+        iHon = load_dict['iHon']
+        iHoff = load_dict['iHoff']
+        Son = load_dict['Son']
+        Soff = load_dict['Soff']
+        nbr_shift = np.array(load_dict['nbr_shift'])
+        cell_shift = np.array(load_dict['cell_shift'])
+        # Find inverse edge_index
+        inv_edge_idx = find_inverse_edge_index(edge_index, cell_shift)
+
+        # Initialize Hks and iHks
+        num_sub_matrix = pos.shape[0] + edge_index.shape[1]
+        Hks = np.zeros((num_sub_matrix, 4, nao_max**2))
+        iHks = np.zeros((num_sub_matrix, 3, nao_max**2))
+
+        # on-site and off-site blocks
+        S = block_scatter.scatter_graph(Son, Soff, z, edge_index)
+        for i in range(4):
+            block_scatter.scatter_graph(Hon[i], Hoff[i], z, edge_index, out=Hks[:, i])
+        for i in range(3):
+            block_scatter.scatter_graph(iHon[i], iHoff[i], z, edge_index, out=iHks[:, i])
+        #
+        hamiltonian_real = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max))
+        hamiltonian_real[:,:nao_max,:nao_max] = Hks[:,0,:].reshape(-1, nao_max, nao_max)
+        hamiltonian_real[:,:nao_max, nao_max:] = Hks[:,2,:].reshape(-1,nao_max, nao_max)
+        hamiltonian_real[:,nao_max:,:nao_max] = Hks[:,2,:].reshape(-1,nao_max, nao_max)
+        hamiltonian_real[:,nao_max:,nao_max:] = Hks[:,1,:].reshape(-1,nao_max, nao_max)
+        hamiltonian_real = hamiltonian_real.reshape(-1, (2*nao_max)**2)
+
+        hamiltonian_imag = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max))
+        hamiltonian_imag[:,:nao_max,:nao_max] = iHks[:,0,:].reshape(-1, nao_max, nao_max)
+        hamiltonian_imag[:,:nao_max, nao_max:] = (Hks[:,3,:] + iHks[:,2,:]).reshape(-1, nao_max, nao_max)
+        hamiltonian_imag[:,nao_max:,:nao_max] = -(Hks[:,3,:] + iHks[:,2,:]).reshape(-1, nao_max, nao_max)
+        hamiltonian_imag[:,nao_max:,nao_max:] = iHks[:,1,:].reshape(-1, nao_max, nao_max)
+        hamiltonian_imag = hamiltonian_imag.reshape(-1, (2*nao_max)**2)
+
+        # read H0
+        load_dict = read_openmx_hs(read_openmx_path, f_H0, scratch_dir, quiet, binary)
+        if load_dict is None:
+            return None
+
+        #
+        Hon0 = load_dict['Hon']
+        Hoff0 = load_dict['Hoff']
+        iHon0 = load_dict['iHon']
+        iHoff0 = load_dict['iHoff']
+        Lon = load_dict['Lon']
+        Loff = load_dict['Loff']
+
+        # initialize Hks0 and iHks0
+        num_sub_matrix = pos.shape[0] + edge_index.shape[1]
+        Hks0 = np.zeros((num_sub_matrix, 4, nao_max**2))
+        iHks0 = np.zeros((num_sub_matrix, 3, nao_max**2))
+
+        # on-site and off-site blocks
+        L = block_scatter.scatter_graph(Lon, Loff, z, edge_index, dim=3)
+        for i in range(4):
+            block_scatter.scatter_graph(Hon0[i], Hoff0[i], z, edge_index, out=Hks0[:, i])
+        for i in range(3):
+            block_scatter.scatter_graph(iHon0[i], iHoff0[i], z, edge_index, out=iHks0[:, i])
+
+        hamiltonian_real0 = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max))
+        hamiltonian_real0[:,:nao_max,:nao_max] = Hks0[:,0,:].reshape(-1, nao_max, nao_max)
+        hamiltonian_real0[:,:nao_max, nao_max:] = Hks0[:,2,:].reshape(-1,nao_max, nao_max)
+        hamiltonian_real0[:,nao_max:,:nao_max] = Hks0[:,2,:].reshape(-1,nao_max, nao_max)
+        hamiltonian_real0[:,nao_max:,nao_max:] = Hks0[:,1,:].reshape(-1,nao_max, nao_max)
+        hamiltonian_real0 = hamiltonian_real0.reshape(-1, (2*nao_max)**2)
+
+        hamiltonian_imag0 = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max))
+        hamiltonian_imag0[:,:nao_max,:nao_max] = iHks0[:,0,:].reshape(-1, nao_max, nao_max)
+        hamiltonian_imag0[:,:nao_max, nao_max:] = (Hks0[:,3,:] + iHks0[:,2,:]).reshape(-1, nao_max, nao_max)
+        hamiltonian_imag0[:,nao_max:,:nao_max] = -(Hks0[:,3,:] + iHks0[:,2,:]).reshape(-1, nao_max, nao_max)
+        hamiltonian_imag0[:,nao_max:,nao_max:] = iHks0[:,1,:].reshape(-1, nao_max, nao_max)
+        hamiltonian_imag0 = hamiltonian_imag0.reshape(-1, (2*nao_max)**2)
+
+        graph = Data( z=torch.LongTensor(z),
+                            cell = torch.Tensor(latt[None,:,:]),
+                            total_energy=Enpy,
+                            pos=torch.FloatTensor(pos),
+                            node_counts=torch.LongTensor([len(z)]),
+                            edge_index=torch.LongTensor(edge_index),
+                            inv_edge_idx=torch.LongTensor(inv_edge_idx),
+                            nbr_shift=torch.FloatTensor(nbr_shift),
+                            cell_shift=torch.LongTensor(cell_shift),
+                            Hon=torch.FloatTensor(hamiltonian_real[:len(z),:]),
+                            Hoff=torch.FloatTensor(hamiltonian_real[len(z):,:]),
+                            iHon=torch.FloatTensor(hamiltonian_imag[:len(z),:]),
+                            iHoff=torch.FloatTensor(hamiltonian_imag[len(z):,:]),
+                            Hon0=torch.FloatTensor(hamiltonian_real0[:len(z),:]),
+                            Hoff0=torch.FloatTensor(hamiltonian_real0[len(z):,:]),
+                            iHon0=torch.FloatTensor(hamiltonian_imag0[:len(z),:]),
+                            iHoff0=torch.FloatTensor(hamiltonian_imag0[len(z):,:]),
+                            overlap=torch.FloatTensor(S),
+                            Son = torch.FloatTensor(S[:pos.shape[0],:]),
+                            Soff = torch.FloatTensor(S[pos.shape[0]:,:]),
+                            Lon = torch.FloatTensor(L[:pos.shape[0],:,:]),
+                            Loff = torch.FloatTensor(L[pos.shape[0]:,:,:]),
+                            doping_charge = torch.FloatTensor([doping_charge]))
+    else:
+        # read hopping parameters
+        load_dict = read_openmx_hs(read_openmx_path, f_sc, scratch_dir, quiet, binary)
+        if load_dict is None:
+            return None
+
+        pos = np.array(load_dict['pos'])
+        edge_index = np.array(load_dict['edge_index'])
+        #
+        Hon = load_dict['Hon'][0]
+        Hoff = load_dict['Hoff'][0]
+        Son = load_dict['Son']
+        Soff = load_dict['Soff']
+        nbr_shift = np.array(load_dict['nbr_shift'])
+        cell_shift = np.array(load_dict['cell_shift'])
+        # Find inverse edge_index
+        inv_edge_idx = find_inverse_edge_index(edge_index, cell_shift)
+
+        # on-site and off-site blocks
+        H = block_scatter.scatter_graph(Hon, Hoff, z, edge_index)
+        S = block_scatter.scatter_graph(Son, Soff, z, edge_index)
+
+        # read H0
+        load_dict = read_openmx_hs(read_openmx_path, f_H0, scratch_dir, quiet, binary)
+        if load_dict is None:
+            return None
+
+        Hon0 = load_dict['Hon'][0]
+        Hoff0 = load_dict['Hoff'][0]
+
+        # on-site and off-site blocks
+        H0 = block_scatter.scatter_graph(Hon0, Hoff0, z, edge_index)
+
+        # save in Data
+        graph = Data(z=torch.LongTensor(z),
+                            cell = torch.Tensor(latt[None,:,:]),
+                            total_energy=Enpy,
+                            pos=torch.FloatTensor(pos),
+                            node_counts=torch.LongTensor([len(z)]),
+                            edge_index=torch.LongTensor(edge_index),
+                            inv_edge_idx=torch.LongTensor(inv_edge_idx),
+                            nbr_shift=torch.FloatTensor(nbr_shift),
+                            cell_shift=torch.LongTensor(cell_shift),
+                            hamiltonian=torch.FloatTensor(H),
+                            overlap=torch.FloatTensor(S),
+                            Hon = torch.FloatTensor(H[:pos.shape[0],:]),
+                            Hoff = torch.FloatTensor(H[pos.shape[0]:,:]),
+                            Hon0 = torch.FloatTensor(H0[:pos.shape[0],:]),
+                            Hoff0 = torch.FloatTensor(H0[pos.shape[0]:,:]),
+                            Son = torch.FloatTensor(S[:pos.shape[0],:]),
+                            Soff = torch.FloatTensor(S[pos.shape[0]:,:]),
+                            doping_charge = torch.FloatTensor([doping_charge]))
+    return graph
+
+def _generate_graph_worker(args):
+    scf_path, params = args
+    return scf_path, generate_graph(scf_path, params)
 
 def main():
     parser = argparse.ArgumentParser(description='graph data generation')
     parser.add_argument('--config', default='graph_data_gen.yaml', type=str, metavar='N')
     args = parser.parse_args()
-    
+
     with open(args.config, encoding='utf-8') as rstream:
         input = yaml.load(rstream, yaml.SafeLoader)
     ################################ Input parameters begin ####################
@@ -35,6 +310,9 @@ def main():
     read_openmx_path = input['read_openmx_path']
     if os.path.isdir(read_openmx_path):
         read_openmx_path = os.path.join(read_openmx_path, 'read_openmx')
+    if os.path.exists(read_openmx_path):
+        # read_openmx is run inside the scratch directories
+        read_openmx_path = os.path.abspath(read_openmx_path)
     max_SCF_skip = input['max_SCF_skip']
     scfout_paths = input['scfout_paths'] # The directory of the .scfout file calculated by openmx/openmx_postprocess, or a wildcard directory name to match multiple directories
     dat_file_name = input['dat_file_name']
@@ -45,8 +323,28 @@ def main():
         doping_charge = input['doping_charge']
     else:
         doping_charge = 0.0
+    if 'output_format' in input:
+        output_format = input['output_format'].lower() # 'npz' or 'store'
+    else:
+        output_format = 'npz'
+    if 'shard_size' in input:
+        shard_size = input['shard_size']
+    else:
+        shard_size = 100
+    if 'num_workers' in input:
+        num_workers = input['num_workers']
+    else:
+        num_workers = 1
+    if 'read_openmx_format' in input:
+        read_openmx_format = input['read_openmx_format'].lower() # 'json' or 'binary' (requires read_openmx built from the current read_openmx.c)
+    else:
+        read_openmx_format = 'json'
+    if 'scratch_path' in input:
+        scratch_path = input['scratch_path'] # The directory in which the scratch directories of read_openmx are created
+    else:
+        scratch_path = None
     ################################ Input parameters end ######################
-    
+
     if nao_max == 14:
         basis_def = basis_def_14
     elif nao_max == 19:
@@ -55,324 +353,69 @@ def main():
         basis_def = basis_def_26
     else:
         raise NotImplementedError
-    
+
     graphs = dict()
     if not os.path.exists(graph_data_path):
         os.makedirs(graph_data_path)
     scfout_paths = glob.glob(scfout_paths)
     scfout_paths = natsort.natsorted(scfout_paths)
-    
-    for idx, scf_path in enumerate(tqdm(scfout_paths)):
-        # file paths
-        f_sc = os.path.join(scf_path, scfout_file_name)
-        f_dat = os.path.join(scf_path, dat_file_name)
-        f_H0 = os.path.join(scf_path, "overlap.scfout")
-        
-        # read energy
-        if std_file_name is not None:   
-            f_std = os.path.join(scf_path, std_file_name) 
-            try:
-                with open(f_std, 'r') as f:
-                    content = f.read()
-                    Enpy = float(pattern_eng.findall((content).strip())[0][-1])
-                    max_SCF = int(pattern_md.findall((content).strip())[-1][-1])
-            except:
-                continue
+
+    # In the 'store' format every finished graph is appended to a graph store in graph_data_path,
+    # so the memory usage stays flat and a re-run skips the directories that are already converted.
+    if output_format == 'store':
+        writer = GraphStoreWriter(graph_data_path, shard_size=shard_size)
+        num_converted = len(writer)
+        scfout_paths = [scf_path for scf_path in scfout_paths if os.path.normpath(scf_path) not in writer]
+        if num_converted > 0:
+            print(f'{num_converted} graphs already exist in {graph_data_path}, {len(scfout_paths)} directories remain to be converted.')
+    elif output_format == 'npz':
+        writer = None
+    else:
+        raise NotImplementedError
+
+    params = {'nao_max': nao_max, 'block_scatter': BlockScatter(basis_def, nao_max), 'read_openmx_path': read_openmx_path, 'max_SCF_skip': max_SCF_skip,
+              'dat_file_name': dat_file_name, 'std_file_name': std_file_name, 'scfout_file_name': scfout_file_name,
+              'soc_switch': soc_switch, 'doping_charge': doping_charge, 'num_workers': num_workers,
+              'read_openmx_format': read_openmx_format}
+
+    # Every process runs read_openmx in its own scratch directory. The graphs are merged in the order
+    # of scfout_paths, so the output does not depend on the number of workers.
+    scratch_root = tempfile.mkdtemp(prefix='graph_data_gen_', dir=scratch_path)
+    pool = None
+    try:
+        tasks = [(scf_path, params) for scf_path in scfout_paths]
+        if num_workers > 1:
+            pool = multiprocessing.Pool(processes=min(num_workers, max(len(tasks), 1)), initializer=_init_worker, initargs=(scratch_root,))
+            results = pool.imap(_generate_graph_worker, tasks)
         else:
-            Enpy = 0.0
-            max_SCF = 1
-
-        
-        # check if the calculation is converged
-        if max_SCF > max_SCF_skip:
-            continue  
-        
-        # Read crystal parameters
-        try:
-            with open(f_dat,'r') as f:
-                content = f.read()
-                speciesAndCoordinates = pattern_coor.findall((content).strip())
-                latt = pattern_latt.findall((content).strip())[0]
-                latt = np.array([float(var) for var in latt]).reshape(-1, 3)/au2ang
-        
-                species = []
-                coordinates = []
-                for item in speciesAndCoordinates:
-                    species.append(item[0])
-                    coordinates += item[1:]
-                z = atomic_numbers = np.array([Element[s].Z for s in species])
-                coordinates = np.array([float(pos) for pos in coordinates]).reshape(-1, 3)/au2ang
-        except:
-            continue
-        
-        if soc_switch:
-            # read hopping parameters
-            os.system(read_openmx_path + " " + f_sc)
-            if not os.path.exists("./HS.json"):
-                continue
-            
-            with open("./HS.json",'r') as load_f:
-                try:
-                    load_dict = json.load(load_f)
-                except:
-                    print(f'{f_sc} is not read successfully!')
-                    continue
-                pos = np.array(load_dict['pos'])
-                edge_index = np.array(load_dict['edge_index'])
-                inv_edge_idx = np.array(load_dict['inv_edge_idx'])
-                #
-                Hon = load_dict['Hon']
-                Hoff = load_dict['Hoff']
-                iHon = load_dict['iHon']
-                iHoff = load_dict['iHoff']
-                Son = load_dict['Son']
-                Soff = load_dict['Soff']
-                nbr_shift = np.array(load_dict['nbr_shift'])
-                cell_shift = np.array(load_dict['cell_shift'])
-
-                if len(inv_edge_idx) != len(edge_index[0]):
-                    print('Wrong info: len(inv_edge_idx) != len(edge_index[0]) !')
-                    quit()
-
-                # Initialize Hks and iHks 
-                num_sub_matrix = pos.shape[0] + edge_index.shape[1]
-                Hks = np.zeros((num_sub_matrix, 4, nao_max**2))   
-                iHks = np.zeros((num_sub_matrix, 3, nao_max**2))
-                S = np.zeros((num_sub_matrix, nao_max**2))
-
-                # on-site
-                for iatm in range(len(z)):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src = z[iatm]
-                    mask[basis_def[src][:,None], basis_def[src][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    S[iatm][mask] = np.array(Son[iatm])
-                    for i in range(4):
-                        Hks[iatm, i][mask] = np.array(Hon[i][iatm]) 
-                    for i in range(3):
-                        iHks[iatm, i][mask] = np.array(iHon[i][iatm])    
-
-                # off-site
-                for iedge in range(len(edge_index[0])):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src, tar = z[edge_index[0, iedge]], z[edge_index[1, iedge]]
-                    mask[basis_def[src][:,None], basis_def[tar][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    S[len(z)+iedge][mask] = np.array(Soff[iedge])
-                    for i in range(4):
-                        Hks[iedge + len(z), i][mask] = np.array(Hoff[i][iedge]) 
-                    for i in range(3):
-                        iHks[iedge + len(z), i][mask] = np.array(iHoff[i][iedge])
-                #
-                hamiltonian_real = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max)) 
-                hamiltonian_real[:,:nao_max,:nao_max] = Hks[:,0,:].reshape(-1, nao_max, nao_max)
-                hamiltonian_real[:,:nao_max, nao_max:] = Hks[:,2,:].reshape(-1,nao_max, nao_max)
-                hamiltonian_real[:,nao_max:,:nao_max] = Hks[:,2,:].reshape(-1,nao_max, nao_max)
-                hamiltonian_real[:,nao_max:,nao_max:] = Hks[:,1,:].reshape(-1,nao_max, nao_max)
-                hamiltonian_real = hamiltonian_real.reshape(-1, (2*nao_max)**2)
-
-                hamiltonian_imag = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max)) 
-                hamiltonian_imag[:,:nao_max,:nao_max] = iHks[:,0,:].reshape(-1, nao_max, nao_max)
-                hamiltonian_imag[:,:nao_max, nao_max:] = (Hks[:,3,:] + iHks[:,2,:]).reshape(-1, nao_max, nao_max)
-                hamiltonian_imag[:,nao_max:,:nao_max] = -(Hks[:,3,:] + iHks[:,2,:]).reshape(-1, nao_max, nao_max)
-                hamiltonian_imag[:,nao_max:,nao_max:] = iHks[:,1,:].reshape(-1, nao_max, nao_max)
-                hamiltonian_imag = hamiltonian_imag.reshape(-1, (2*nao_max)**2)
-            os.system("rm HS.json")
-
-            # read H0
-            os.system(read_openmx_path + " " + f_H0)
-            if not os.path.exists("./HS.json"):
-                continue
-            
-            with open("./HS.json",'r') as load_f:
-                try:
-                    load_dict = json.load(load_f)
-                except:
-                    print(f'{f_H0} is not read successfully!')
-                    continue
-                #
-                Hon0 = load_dict['Hon']
-                Hoff0 = load_dict['Hoff']
-                iHon0 = load_dict['iHon']
-                iHoff0 = load_dict['iHoff']
-                Lon = load_dict['Lon']
-                Loff = load_dict['Loff']
-
-                # initialize Hks0 and iHks0
-                num_sub_matrix = pos.shape[0] + edge_index.shape[1]
-                Hks0 = np.zeros((num_sub_matrix, 4, nao_max**2))   
-                iHks0 = np.zeros((num_sub_matrix, 3, nao_max**2))
-                L = np.zeros((num_sub_matrix, nao_max**2, 3))
-
-                # on-site
-                for iatm in range(len(z)):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src = z[iatm]
-                    mask[basis_def[src][:,None], basis_def[src][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    L[iatm][mask] = np.array(Lon[iatm])
-                    for i in range(4):
-                        Hks0[iatm, i][mask] = np.array(Hon0[i][iatm]) 
-                    for i in range(3):
-                        iHks0[iatm, i][mask] = np.array(iHon0[i][iatm])    
-
-                # off-site
-                for iedge in range(len(edge_index[0])):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src, tar = z[edge_index[0, iedge]], z[edge_index[1, iedge]]
-                    mask[basis_def[src][:,None], basis_def[tar][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    L[len(z)+iedge][mask] = np.array(Loff[iedge])
-                    for i in range(4):
-                        Hks0[iedge + len(z), i][mask] = np.array(Hoff0[i][iedge]) 
-                    for i in range(3):
-                        iHks0[iedge + len(z), i][mask] = np.array(iHoff0[i][iedge])
-
-                hamiltonian_real0 = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max)) 
-                hamiltonian_real0[:,:nao_max,:nao_max] = Hks0[:,0,:].reshape(-1, nao_max, nao_max)
-                hamiltonian_real0[:,:nao_max, nao_max:] = Hks0[:,2,:].reshape(-1,nao_max, nao_max)
-                hamiltonian_real0[:,nao_max:,:nao_max] = Hks0[:,2,:].reshape(-1,nao_max, nao_max)
-                hamiltonian_real0[:,nao_max:,nao_max:] = Hks0[:,1,:].reshape(-1,nao_max, nao_max)
-                hamiltonian_real0 = hamiltonian_real0.reshape(-1, (2*nao_max)**2)
-
-                hamiltonian_imag0 = np.zeros((num_sub_matrix, 2*nao_max, 2*nao_max)) 
-                hamiltonian_imag0[:,:nao_max,:nao_max] = iHks0[:,0,:].reshape(-1, nao_max, nao_max)
-                hamiltonian_imag0[:,:nao_max, nao_max:] = (Hks0[:,3,:] + iHks0[:,2,:]).reshape(-1, nao_max, nao_max)
-                hamiltonian_imag0[:,nao_max:,:nao_max] = -(Hks0[:,3,:] + iHks0[:,2,:]).reshape(-1, nao_max, nao_max)
-                hamiltonian_imag0[:,nao_max:,nao_max:] = iHks0[:,1,:].reshape(-1, nao_max, nao_max)
-                hamiltonian_imag0 = hamiltonian_imag0.reshape(-1, (2*nao_max)**2)
-            os.system("rm HS.json")
-
-            graphs[idx] = Data( z=torch.LongTensor(z),
-                                cell = torch.Tensor(latt[None,:,:]),
-                                total_energy=Enpy,
-                                pos=torch.FloatTensor(pos),
-                                node_counts=torch.LongTensor([len(z)]),
-                                edge_index=torch.LongTensor(edge_index),
-                                inv_edge_idx=torch.LongTensor(inv_edge_idx),
-                                nbr_shift=torch.FloatTensor(nbr_shift),
-                                cell_shift=torch.LongTensor(cell_shift),
-                                Hon=torch.FloatTensor(hamiltonian_real[:len(z),:]),
-                                Hoff=torch.FloatTensor(hamiltonian_real[len(z):,:]),
-                                iHon=torch.FloatTensor(hamiltonian_imag[:len(z),:]),
-                                iHoff=torch.FloatTensor(hamiltonian_imag[len(z):,:]),
-                                Hon0=torch.FloatTensor(hamiltonian_real0[:len(z),:]),
-                                Hoff0=torch.FloatTensor(hamiltonian_real0[len(z):,:]),
-                                iHon0=torch.FloatTensor(hamiltonian_imag0[:len(z),:]),
-                                iHoff0=torch.FloatTensor(hamiltonian_imag0[len(z):,:]),
-                                overlap=torch.FloatTensor(S),
-                                Son = torch.FloatTensor(S[:pos.shape[0],:]),
-                                Soff = torch.FloatTensor(S[pos.shape[0]:,:]),
-                                Lon = torch.FloatTensor(L[:pos.shape[0],:,:]),
-                                Loff = torch.FloatTensor(L[pos.shape[0]:,:,:]),
-                                doping_charge = torch.FloatTensor([doping_charge]))
-        else:            
-            # read hopping parameters
-            os.system(read_openmx_path + " " + f_sc)
-            if not os.path.exists("./HS.json"):
-                continue
-            
-            with open("./HS.json",'r') as load_f:
-                try:
-                    load_dict = json.load(load_f)
-                except:
-                    print(f'{f_sc} is not read successfully!')
-                    continue
-                pos = np.array(load_dict['pos'])
-                edge_index = np.array(load_dict['edge_index'])
-                inv_edge_idx = np.array(load_dict['inv_edge_idx'])
-                #
-                Hon = load_dict['Hon'][0]
-                Hoff = load_dict['Hoff'][0]
-                Son = load_dict['Son']
-                Soff = load_dict['Soff']
-                nbr_shift = np.array(load_dict['nbr_shift'])
-                cell_shift = np.array(load_dict['cell_shift'])
-                
-                # Find inverse edge_index
-                if len(inv_edge_idx) != len(edge_index[0]):
-                    print('Wrong info: len(inv_edge_idx) != len(edge_index[0]) !')
-                    sys.exit()
-        
-                #
-                num_sub_matrix = pos.shape[0] + edge_index.shape[1]
-                H = np.zeros((num_sub_matrix, nao_max**2))
-                S = np.zeros((num_sub_matrix, nao_max**2))
-                
-                for i, (sub_maxtrix_H, sub_maxtrix_S) in enumerate(zip(Hon, Son)):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src = z[i]
-                    mask[basis_def[src][:,None], basis_def[src][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    H[i][mask] = np.array(sub_maxtrix_H)
-                    S[i][mask] = np.array(sub_maxtrix_S)
-                
-                num = 0
-                for i, (sub_maxtrix_H, sub_maxtrix_S) in enumerate(zip(Hoff, Soff)):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src, tar = z[edge_index[0,num]], z[edge_index[1,num]]
-                    mask[basis_def[src][:,None], basis_def[tar][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    H[num + len(z)][mask] = np.array(sub_maxtrix_H)
-                    S[num + len(z)][mask] = np.array(sub_maxtrix_S)
-                    num = num + 1
-            os.system("rm HS.json")
-            
-            # read H0
-            os.system(read_openmx_path + " " + f_H0)
-            if not os.path.exists("./HS.json"):
+            _init_scratch(scratch_root)
+            results = map(_generate_graph_worker, tasks)
+
+        for idx, (scf_path, graph) in enumerate(tqdm(results, total=len(tasks))):
+            if graph is None:
                 continue
-            
-            with open("./HS.json",'r') as load_f:
-                try:
-                    load_dict = json.load(load_f)
-                except:
-                    print(f'{f_H0} is not read successfully!')
-                    continue
-                Hon0 = load_dict['Hon'][0]
-                Hoff0 = load_dict['Hoff'][0]
-        
-                #
-                num_sub_matrix = pos.shape[0] + edge_index.shape[1]
-                H0 = np.zeros((num_sub_matrix, nao_max**2))
-                
-                for i, sub_maxtrix_H in enumerate(Hon0):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src = z[i]
-                    mask[basis_def[src][:,None], basis_def[src][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    H0[i][mask] = np.array(sub_maxtrix_H)
-                
-                num = 0
-                for i, sub_maxtrix_H in enumerate(Hoff0):
-                    mask = np.zeros((nao_max, nao_max), dtype=int)
-                    src, tar = z[edge_index[0,num]], z[edge_index[1,num]]
-                    mask[basis_def[src][:,None], basis_def[tar][None,:]] = 1
-                    mask = (mask > 0).reshape(-1)
-                    H0[num + len(z)][mask] = np.array(sub_maxtrix_H)
-                    num = num + 1
-            os.system("rm HS.json")
-            
-            # save in Data
-            graphs[idx] = Data(z=torch.LongTensor(z),
-                                cell = torch.Tensor(latt[None,:,:]),
-                                total_energy=Enpy,
-                                pos=torch.FloatTensor(pos),
-                                node_counts=torch.LongTensor([len(z)]),
-                                edge_index=torch.LongTensor(edge_index),
-                                inv_edge_idx=torch.LongTensor(inv_edge_idx),
-                                nbr_shift=torch.FloatTensor(nbr_shift),
-                                cell_shift=torch.LongTensor(cell_shift),
-                                hamiltonian=torch.FloatTensor(H),
-                                overlap=torch.FloatTensor(S),
-                                Hon = torch.FloatTensor(H[:pos.shape[0],:]),
-                                Hoff = torch.FloatTensor(H[pos.shape[0]:,:]),
-                                Hon0 = torch.FloatTensor(H0[:pos.shape[0],:]),
-                                Hoff0 = torch.FloatTensor(H0[pos.shape[0]:,:]),
-                                Son = torch.FloatTensor(S[:pos.shape[0],:]),
-                                Soff = torch.FloatTensor(S[pos.shape[0]:,:]),
-                                doping_charge = torch.FloatTensor([doping_charge]))
-    if len(graphs) == 0:
+            if writer is not None:
+                writer.append(graph, key=os.path.normpath(scf_path))
+            else:
+                graphs[idx] = graph
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        # stop the workers still running after an exception before their scratch directories are removed
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+    if writer is not None:
+        writer.close()
+        if len(writer) == 0:
+            print('No valid data found! Please check the input paths or if the DFT calculations are converged.')
+        else:
+            print('The graph store is saved in %s' % graph_data_path)
+    elif len(graphs) == 0:
         print('No valid data found! Please check the input paths or if the DFT calculations are converged.')
     else:
         print('The graph data is saved in %s' % graph_data_path)
@@ -0,0 +1,91 @@
+'''
+Descripttion: Vectorized search of the inverse edges of a periodic graph shared by the DFT converters and the models.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-16 23:05:18
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-16 23:05:18
+'''
+
+import numpy as np
+
+
+def find_inverse_edge_index(edge_index: np.ndarray, cell_shift: np.ndarray, validate: bool = True) -> np.ndarray:
+    """
+    Find the index of the inverse edge (dst, src, -cell_shift) of every edge (src, dst, cell_shift).
+
+    The (src, dst, cell_shift) keys of the edges and of their inverses are packed into int64 ids (or,
+    if they do not fit, grouped with one lexsort), and the ids of the inverses are looked up among the
+    sorted ids of the edges with a binary search. The cost is dominated by one sort, so millions of
+    edges take seconds.
+
+    Args:
+        edge_index (np.ndarray): the source and target atoms of the edges, shape: (2, num_edges)
+        cell_shift (np.ndarray): the integer cell shifts of the edges, shape: (num_edges, 3)
+        validate (bool): If True, a RuntimeError reporting the unpaired and duplicated edges is raised
+            when not every edge has exactly one inverse. If False, unpaired edges get the index -1.
+
+    Returns:
+        np.ndarray: the indices of the inverse edges, shape: (num_edges,)
+    """
+    edge_index = np.asarray(edge_index).reshape(2, -1).astype(np.int64)
+    cell_shift = np.rint(np.asarray(cell_shift)).reshape(-1, 3).astype(np.int64)
+    num_edges = edge_index.shape[1]
+    if num_edges == 0:
+        return np.zeros((0,), dtype=np.int64)
+
+    # keys of the edges followed by the keys of their inverses
+    keys = np.concatenate([np.concatenate([edge_index.T, cell_shift], axis=1),
+                           np.concatenate([edge_index[::-1].T, -cell_shift], axis=1)], axis=0)
+    group = _group_keys(keys)
+    group_edge, group_inv = group[:num_edges], group[num_edges:]
+
+    edge_order = np.argsort(group_edge, kind='stable')
+    sorted_group_edge = group_edge[edge_order]
+    position = np.minimum(np.searchsorted(sorted_group_edge, group_inv), num_edges - 1)
+    paired = sorted_group_edge[position] == group_inv
+    inv_edge_idx = np.where(paired, edge_order[position], -1)
+
+    if validate:
+        unpaired = np.flatnonzero(~paired)
+        same_as_next = sorted_group_edge[1:] == sorted_group_edge[:-1]
+        duplicated = np.zeros(num_edges, dtype=bool)
+        duplicated[:-1] |= same_as_next
+        duplicated[1:] |= same_as_next
+        duplicated = np.sort(edge_order[duplicated])
+        if len(unpaired) > 0 or len(duplicated) > 0:
+            raise RuntimeError(_report_edges('Some edges do not have corresponding inverse edges', unpaired, edge_index, cell_shift)
+                               + _report_edges('Some edges are duplicated', duplicated, edge_index, cell_shift))
+    return inv_edge_idx
+
+
+def _group_keys(keys: np.ndarray) -> np.ndarray:
+    """
+    Integer ids of the rows of keys, equal for equal rows. The columns are packed into a single int64 if their
+    ranges allow it, otherwise the rows are sorted with lexsort.
+    """
+    keys = keys - keys.min(axis=0)
+    radix = keys.max(axis=0) + 1
+    if np.prod(radix.astype(object)) < 2**63:
+        group = keys[:, 0]
+        for icol in range(1, keys.shape[1]):
+            group = group*radix[icol] + keys[:, icol]
+        return group
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    new_group = np.ones(len(keys), dtype=bool)
+    new_group[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+    group = np.empty(len(keys), dtype=np.int64)
+    group[order] = np.cumsum(new_group) - 1
+    return group
+
+
+def _report_edges(message: str, edges: np.ndarray, edge_index: np.ndarray, cell_shift: np.ndarray, max_edges: int = 10) -> str:
+    if len(edges) == 0:
+        return ''
+    lines = [f'{message} ({len(edges)} edges):']
+    for idx in edges[:max_edges]:
+        lines.append(f'  edge {idx}: {edge_index[0, idx]} -> {edge_index[1, idx]}, cell shift {tuple(cell_shift[idx].tolist())}')
+    if len(edges) > max_edges:
+        lines.append('  ...')
+    return '\n'.join(lines) + '\n'
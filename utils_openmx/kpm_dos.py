@@ -0,0 +1,373 @@
+'''
+Descripttion: Density of states of large structures from the predicted Hamiltonians with the kernel polynomial method (KPM).
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 00:41:26
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 00:41:26
+'''
+
+import numpy as np
+import os
+import argparse
+import yaml
+import torch
+import multiprocessing
+from threadpoolctl import threadpool_limits
+from scipy.sparse import csr_matrix, block_diag
+from utils_openmx.utils import *
+from utils_openmx.band_engine import sparse_block_matrix, orbital_index, share_arrays, attach_arrays, release_arrays
+from HamGNN_v_2_0.models.prediction_writer import PredictionReader, is_prediction_store
+
+# the KPM solver of a worker process, built from the shared memory in _init_worker
+_worker_kpm = None
+_worker_groups = None
+_worker_shms = []
+
+
+def jackson_kernel(num_moments: int) -> np.ndarray:
+    n = np.arange(num_moments)
+    q = np.pi/(num_moments + 1)
+    return ((num_moments - n + 1)*np.cos(q*n) + np.sin(q*n)/np.tan(q))/(num_moments + 1)
+
+
+def lorentz_kernel(num_moments: int, lambda_: float = 4.0) -> np.ndarray:
+    n = np.arange(num_moments)
+    return np.sinh(lambda_*(1 - n/num_moments))/np.sinh(lambda_)
+
+
+class KPMDos(object):
+    """
+    Density of states of the generalized eigenproblem H C = S C E from the Chebyshev moments of the
+    operator A = S^-1 H, which is never formed:
+        mu_n = Tr T_n((A - b)/a)
+    The trace is estimated stochastically with random vectors r (Rademacher), mu_n ~ mean_r r^T T_n((A - b)/a) r,
+    and every product with S^-1 is a preconditioned conjugate gradient solve, so that only sparse
+    matrix-vector products are needed and the memory scales with the number of nonzeros of H and S.
+
+    The diagonal of T_n((A - b)/a) = C T_n((E - b)/a) C^H S gives the Mulliken populations of the orbitals,
+    so the projected DOS of groups of orbitals (e.g. atoms or species) is obtained from the same random vectors.
+
+    Args:
+        H (csr_matrix): the Hamiltonian, shape: (dim, dim)
+        S (csr_matrix, optional): the overlap, the identity if None.
+        num_moments (int): the number of Chebyshev moments.
+        bounds (tuple, optional): (Emin, Emax) enclosing the spectrum. Estimated with the Lanczos method if None.
+        cg_tol (float): the relative tolerance of the conjugate gradient solves.
+        cg_maxiter (int): the maximum number of conjugate gradient iterations.
+    """
+
+    def __init__(self, H: csr_matrix, S: csr_matrix = None, num_moments: int = 1000, bounds=None,
+                 cg_tol: float = 1e-10, cg_maxiter: int = 1000):
+        self.H = csr_matrix(H)
+        self.S = None if S is None else csr_matrix(S)
+        self.dim = self.H.shape[0]
+        self.num_moments = num_moments
+        self.cg_tol = cg_tol
+        self.cg_maxiter = cg_maxiter
+        if bounds is None:
+            bounds = self.spectral_bounds()
+        self.bounds = bounds
+        # the spectrum is mapped to [-1, 1] by x = (E - b)/a
+        self.a = (bounds[1] - bounds[0])/2
+        self.b = (bounds[1] + bounds[0])/2
+
+    def solve_overlap(self, B: np.ndarray) -> np.ndarray:
+        """
+        Solve S X = B for the columns of B with the Jacobi preconditioned conjugate gradient method.
+        """
+        if self.S is None:
+            return B
+        inv_diag = 1.0/self.S.diagonal().real[:, None]
+        X = np.zeros_like(B)
+        R = B.copy()
+        Z = inv_diag*R
+        P = Z.copy()
+        rz = np.sum(np.conj(R)*Z, axis=0).real
+        b_norm = np.linalg.norm(B, axis=0)
+        for _ in range(self.cg_maxiter):
+            if np.all(np.linalg.norm(R, axis=0) <= self.cg_tol*b_norm):
+                return X
+            SP = self.S @ P
+            alpha = rz/np.maximum(np.sum(np.conj(P)*SP, axis=0).real, np.finfo(float).tiny)
+            X += alpha*P
+            R -= alpha*SP
+            Z = inv_diag*R
+            rz_new = np.sum(np.conj(R)*Z, axis=0).real
+            P = Z + (rz_new/np.maximum(rz, np.finfo(float).tiny))*P
+            rz = rz_new
+        raise RuntimeError(f'The conjugate gradient solve of the overlap did not converge in {self.cg_maxiter} iterations!')
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """
+        (S^-1 H X - b X)/a
+        """
+        return (self.solve_overlap(self.H @ X) - self.b*X)/self.a
+
+    def spectral_bounds(self, num_steps: int = 50, margin: float = 0.05, seed: int = 0):
+        """
+        Estimate (Emin, Emax) with the Lanczos method on S^-1 H, which is self-adjoint in the S inner product.
+        The extreme Ritz values lie inside the spectrum, so the interval is widened by margin of its width.
+        """
+        rng = np.random.default_rng(seed)
+        s_dot = lambda x, y: np.vdot(x, self.S @ y if self.S is not None else y).real
+        q = rng.standard_normal(self.dim)
+        q = q/np.sqrt(s_dot(q, q))
+        q_prev = np.zeros_like(q)
+        alphas, betas = [], []
+        beta = 0.0
+        for _ in range(min(num_steps, self.dim)):
+            Hq = self.H @ q
+            w = self.solve_overlap(Hq[:, None])[:, 0] - beta*q_prev
+            alpha = np.vdot(q, Hq).real
+            w = w - alpha*q
+            alphas.append(alpha)
+            beta = np.sqrt(max(s_dot(w, w), 0.0))
+            if beta < 1e-12:
+                break
+            betas.append(beta)
+            q_prev, q = q, w/beta
+        T = np.diag(alphas) + np.diag(betas[:len(alphas)-1], 1) + np.diag(betas[:len(alphas)-1], -1)
+        ritz = np.linalg.eigvalsh(T)
+        width = max(ritz[-1] - ritz[0], 1e-6)
+        return ritz[0] - margin*width, ritz[-1] + margin*width
+
+    def moments(self, num_vectors: int, groups: np.ndarray = None, num_groups: int = 1, seed: int = 0,
+                block_size: int = 16) -> np.ndarray:
+        """
+        The sums over num_vectors random vectors of the Chebyshev moments r^T T_n((A - b)/a) r, resolved in groups of orbitals.
+
+        Args:
+            num_vectors (int): the number of random vectors.
+            groups (np.ndarray, optional): the group of every orbital, shape: (dim,). All orbitals are in group 0 if None.
+            num_groups (int): the number of groups.
+            seed (int): the seed of the random vectors.
+            block_size (int): the number of random vectors propagated together.
+
+        Returns:
+            np.ndarray: shape: (num_groups, num_moments)
+        """
+        if groups is None:
+            groups = np.zeros(self.dim, dtype=int)
+        rng = np.random.default_rng(seed)
+        mu = np.zeros((num_groups, self.num_moments))
+        dtype = np.result_type(self.H.dtype, np.float64) if self.S is None else np.result_type(self.H.dtype, self.S.dtype, np.float64)
+        for start in range(0, num_vectors, block_size):
+            nvec = min(block_size, num_vectors - start)
+            r = rng.choice([-1.0, 1.0], size=(self.dim, nvec)).astype(dtype)
+            v_prev, v = r, self.apply(r)
+            mu[:, 0] += np.bincount(groups, weights=np.sum(r*r, axis=1).real, minlength=num_groups)
+            if self.num_moments > 1:
+                mu[:, 1] += np.bincount(groups, weights=np.sum(np.conj(r)*v, axis=1).real, minlength=num_groups)
+            for n in range(2, self.num_moments):
+                v_prev, v = v, 2*self.apply(v) - v_prev
+                mu[:, n] += np.bincount(groups, weights=np.sum(np.conj(r)*v, axis=1).real, minlength=num_groups)
+        return mu
+
+    def dos(self, energies: np.ndarray, mu: np.ndarray, kernel: str = 'jackson') -> np.ndarray:
+        """
+        Reconstruct the DOS (states per unit energy) at the energies from the averaged moments.
+        @param mu: shape: (..., num_moments)
+        @return: shape: (..., len(energies))
+        """
+        num_moments = mu.shape[-1]
+        if kernel == 'jackson':
+            g = jackson_kernel(num_moments)
+        elif kernel == 'lorentz':
+            g = lorentz_kernel(num_moments)
+        else:
+            raise NotImplementedError(f'The kernel {kernel} is not supported!')
+        x = (np.asarray(energies) - self.b)/self.a
+        inside = np.abs(x) < 1
+        T = np.cos(np.arange(num_moments)[:, None]*np.arccos(np.clip(x, -1, 1))[None, :]) # shape: (num_moments, nE)
+        coeff = g*mu
+        coeff[..., 1:] *= 2
+        rho = coeff @ T
+        rho = np.where(inside, rho/(np.pi*np.sqrt(np.clip(1 - x**2, 1e-300, None))), 0.0)
+        return rho/self.a
+
+    def average_moments(self, num_vectors: int, groups: np.ndarray = None, num_groups: int = 1, seed: int = 0,
+                        block_size: int = 16, num_workers: int = 1, num_threads: int = None) -> np.ndarray:
+        """
+        The moments averaged over num_vectors random vectors; the blocks of random vectors are distributed
+        over num_workers processes sharing H and S through shared memory. Every block has its own seed, so
+        the result does not depend on num_workers. num_threads limits the BLAS/OpenMP threads of numpy and scipy
+        in every worker; by default the CPUs are shared evenly between the workers.
+        @return: shape: (num_groups, num_moments)
+        """
+        tasks = [(seed + iblock, min(block_size, num_vectors - start))
+                 for iblock, start in enumerate(range(0, num_vectors, block_size))]
+        num_workers = min(num_workers, len(tasks))
+        if num_workers <= 1:
+            with threadpool_limits(limits=num_threads):
+                mu = sum(self.moments(nvec, groups, num_groups, seed=task_seed, block_size=block_size) for task_seed, nvec in tasks)
+            return mu/num_vectors
+        if num_threads is None:
+            num_threads = max(1, (os.cpu_count() or 1)//num_workers)
+
+        arrays = {'H_data': self.H.data, 'H_indices': self.H.indices, 'H_indptr': self.H.indptr}
+        if self.S is not None:
+            arrays.update({'S_data': self.S.data, 'S_indices': self.S.indices, 'S_indptr': self.S.indptr})
+        if groups is not None:
+            arrays['groups'] = groups
+        shms, spec = share_arrays(arrays)
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            settings = {'dim': self.dim, 'num_moments': self.num_moments, 'bounds': self.bounds,
+                        'cg_tol': self.cg_tol, 'cg_maxiter': self.cg_maxiter}
+            with ctx.Pool(processes=num_workers, initializer=_init_worker, initargs=(spec, settings, num_threads)) as pool:
+                results = pool.starmap(_moments_task, [(nvec, num_groups, task_seed, block_size) for task_seed, nvec in tasks])
+        finally:
+            release_arrays(shms)
+        return sum(results)/num_vectors
+
+
+def _init_worker(spec: dict, settings: dict, num_threads: int = None):
+    global _worker_kpm, _worker_groups
+    threadpool_limits(limits=num_threads)
+    arrays = attach_arrays(spec, _worker_shms)
+    dim = settings['dim']
+    H = csr_matrix((arrays['H_data'], arrays['H_indices'], arrays['H_indptr']), shape=(dim, dim))
+    S = csr_matrix((arrays['S_data'], arrays['S_indices'], arrays['S_indptr']), shape=(dim, dim)) if 'S_data' in arrays else None
+    _worker_kpm = KPMDos(H, S, num_moments=settings['num_moments'], bounds=settings['bounds'],
+                         cg_tol=settings['cg_tol'], cg_maxiter=settings['cg_maxiter'])
+    _worker_groups = arrays['groups'] if 'groups' in arrays else None
+
+
+def _moments_task(num_vectors: int, num_groups: int, seed: int, block_size: int) -> np.ndarray:
+    return _worker_kpm.moments(num_vectors, _worker_groups, num_groups, seed=seed, block_size=block_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KPM density of states')
+    parser.add_argument('--config', default='kpm_dos.yaml', type=str, metavar='N')
+    args = parser.parse_args()
+
+    with open(args.config, encoding='utf-8') as rstream:
+        input = yaml.load(rstream, yaml.SafeLoader)
+    ################################ Input parameters begin ####################
+    nao_max = input['nao_max']
+    graph_data_path = input['graph_data_path']
+    hamiltonian_path = input['hamiltonian_path']
+    save_dir = input['save_dir'] # The directory to save the results
+    Ham_type = input['Ham_type'].lower() if 'Ham_type' in input else 'openmx'
+    soc_switch = input['soc_switch'] if 'soc_switch' in input else False
+    spin_colinear = input['spin_colinear'] if 'spin_colinear' in input else False
+    num_moments = input['num_moments'] if 'num_moments' in input else 1000
+    num_random_vectors = input['num_random_vectors'] if 'num_random_vectors' in input else 64
+    block_size = input['block_size'] if 'block_size' in input else 16 # the number of random vectors per task
+    num_workers = input['num_workers'] if 'num_workers' in input else 1
+    num_threads = input['num_threads'] if 'num_threads' in input else None
+    emin, emax = input['emin'], input['emax'] # eV
+    num_energies = input['num_energies'] if 'num_energies' in input else 2000
+    kernel = input['kernel'] if 'kernel' in input else 'jackson'
+    pdos = input['pdos'] if 'pdos' in input else False # species resolved Mulliken PDOS
+    seed = input['seed'] if 'seed' in input else 42
+    ################################ Input parameters end ######################
+
+    if not os.path.exists(save_dir):
+        os.mkdir(save_dir)
+
+    graph_data = np.load(graph_data_path, allow_pickle=True)
+    graph_data = graph_data['graph'].item()
+    graph_dataset = list(graph_data.values())
+    graph_keys = [str(key) for key in graph_data.keys()]
+
+    # parse the Atomic Orbital Basis Sets
+    basis_definition = np.zeros((99, nao_max))
+    # key is the atomic number, value is the index of the occupied orbits.
+    if Ham_type == 'openmx':
+        if nao_max == 14:
+            basis_def = basis_def_14
+        elif nao_max == 19:
+            basis_def = basis_def_19
+        else:
+            basis_def = basis_def_26
+    elif Ham_type == 'abacus':
+        if nao_max == 27:
+            basis_def = basis_def_27_abacus
+        elif nao_max == 40:
+            basis_def = basis_def_40_abacus
+        else:
+            raise NotImplementedError
+    else:
+        raise NotImplementedError
+
+    for k in basis_def.keys():
+        basis_definition[k][basis_def[k]] = 1
+
+    # the predicted Hamiltonians of all structures
+    if soc_switch:
+        len_H = [2*(len(data.Hon)+len(data.Hoff)) for data in graph_dataset]
+    else:
+        len_H = [len(data.Hon)+len(data.Hoff) for data in graph_dataset]
+    if is_prediction_store(hamiltonian_path):
+        H_all = PredictionReader(hamiltonian_path).select(graph_keys, 'prediction_hamiltonian')
+    elif hamiltonian_path is not None:
+        H = np.load(hamiltonian_path)
+        H_all = np.split(H, np.cumsum(len_H)[:-1])
+    elif soc_switch:
+        H_all = [torch.cat([data.Hon, data.Hoff, data.iHon, data.iHoff], dim=0).numpy() for data in graph_dataset]
+    else:
+        H_all = [torch.cat([data.Hon, data.Hoff], dim=0).numpy() for data in graph_dataset]
+
+    energies = np.linspace(emin, emax, num_energies)
+    for idx, data in enumerate(graph_dataset):
+        Son = data.Son.numpy().reshape(-1, nao_max, nao_max)
+        Soff = data.Soff.numpy().reshape(-1, nao_max, nao_max)
+        edge_index = data.edge_index.numpy()
+        species = data.z.numpy()
+        natoms = len(species)
+        orb_mask = basis_definition[species]
+
+        # the Hamiltonians of the spin channels at the Gamma point
+        S = sparse_block_matrix(Son, Soff, edge_index, orb_mask)
+        if soc_switch:
+            Hsoc = H_all[idx].reshape(-1, 2*nao_max, 2*nao_max)
+            Hsoc_real, Hsoc_imag = np.split(Hsoc, 2, axis=0)
+            Hsoc = Hsoc_real + 1.0j*Hsoc_imag
+            H_spins = [sparse_block_matrix(Hsoc[:natoms], Hsoc[natoms:], edge_index, orb_mask, nspinor=2)]
+            S = block_diag([S, S], format='csr') # kron(I_2, S)
+            nspinor = 2
+        elif spin_colinear:
+            Hcol = H_all[idx].reshape(-1, 2, nao_max, nao_max)
+            H_spins = [sparse_block_matrix(Hcol[:natoms, ispin], Hcol[natoms:, ispin], edge_index, orb_mask) for ispin in range(2)]
+            nspinor = 1
+        else:
+            Hnon = H_all[idx].reshape(-1, nao_max, nao_max)
+            H_spins = [sparse_block_matrix(Hnon[:natoms], Hnon[natoms:], edge_index, orb_mask)]
+            nspinor = 1
+
+        # the species of every orbital for the projected DOS
+        if pdos:
+            unique_species, atom_group = np.unique(species, return_inverse=True)
+            index = orbital_index(orb_mask, nspinor)
+            groups = np.zeros(S.shape[0], dtype=int)
+            groups[index[index >= 0]] = np.broadcast_to(atom_group[:, None], index.shape)[index >= 0]
+            num_groups = len(unique_species)
+        else:
+            groups, num_groups = None, 1
+
+        dos_all, pdos_all = [], []
+        for H in H_spins:
+            kpm = KPMDos(H, S, num_moments=num_moments)
+            print(f'spectral bounds: {kpm.bounds[0]*au2ev:.3f} eV, {kpm.bounds[1]*au2ev:.3f} eV', flush=True)
+            mu = kpm.average_moments(num_random_vectors, groups, num_groups, seed=seed, block_size=block_size,
+                                     num_workers=num_workers, num_threads=num_threads)
+            rho = kpm.dos(energies/au2ev, mu, kernel=kernel)/au2ev # states/eV, shape: (num_groups, num_energies)
+            dos_all.append(rho.sum(axis=0))
+            pdos_all.append(rho)
+
+        # Export the DOS
+        np.savetxt(os.path.join(save_dir, f'dos_{idx+1}.dat'), np.stack([energies] + dos_all, axis=1),
+                   header='E(eV) ' + ' '.join(f'DOS_spin{ispin}(states/eV)' for ispin in range(len(dos_all))))
+        if pdos:
+            for ispin, rho in enumerate(pdos_all):
+                symbols = [Element.from_Z(int(z)).symbol for z in unique_species]
+                filename = f'pdos_{idx+1}.dat' if len(pdos_all) == 1 else f'pdos_spin{ispin}_{idx+1}.dat'
+                np.savetxt(os.path.join(save_dir, filename), np.concatenate([energies[:, None], rho.T], axis=1),
+                           header='E(eV) ' + ' '.join(symbols))
+        print(f'The DOS of structure {idx+1} is saved in {save_dir}')
+
+if __name__ == '__main__':
+    main()
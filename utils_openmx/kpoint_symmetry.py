@@ -0,0 +1,84 @@
+'''
+Descripttion: Reduction of uniform k meshes to the irreducible wedge with the point group of the crystal.
+version: 1.0
+Author: Yang Zhong
+Date: 2026-10-17 02:05:31
+LastEditors: Yang Zhong
+LastEditTime: 2026-10-17 02:05:31
+'''
+
+import numpy as np
+from typing import Tuple
+from pymatgen.core.structure import Structure
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+from utils_openmx.fourier_interpolation import monkhorst_pack
+
+
+class IrreducibleMesh(object):
+    """
+    The irreducible k points of the uniform mesh k = (m + shift)/mesh (see monkhorst_pack) and their weights.
+
+    The rotations W of the space group act on fractional coordinates, so the star of k is {W^T k} (and {-W^T k}
+    with time-reversal symmetry). As in spglib, every k point is mapped through all the operations that take it
+    onto the mesh, even if an operation does not map the whole (shifted) mesh onto itself. Every k point of the
+    mesh is represented by the k point of its star with the lowest index in the mesh.
+
+    Note that the symmetry of the structure is used: the magnetic order of spin-polarized or SOC Hamiltonians
+    may lower the symmetry, in which case the reduction must not be used.
+
+    Args:
+        structure (Structure): the crystal structure, with the same lattice as the cell of the graph.
+        mesh (tuple): the number of k points along the reciprocal lattice vectors.
+        shift (tuple): the shift of the mesh in units of the mesh spacing.
+        symprec (float): the symmetry tolerance of spglib.
+        time_reversal (bool): whether k and -k are equivalent.
+    """
+
+    def __init__(self, structure: Structure, mesh: Tuple[int, int, int], shift: Tuple[float, float, float] = (0, 0, 0),
+                 symprec: float = 0.01, time_reversal: bool = True):
+        self.mesh = np.asarray(mesh, dtype=int)
+        self.shift = np.asarray(shift, dtype=float)
+        self.kpoints = monkhorst_pack(mesh, shift) # shape: (nk, 3)
+        nk = len(self.kpoints)
+
+        rotations = [op.rotation_matrix for op in SpacegroupAnalyzer(structure, symprec=symprec).get_symmetry_operations(cartesian=False)]
+        rotations = np.rint(np.array(rotations)).astype(int)
+        if time_reversal:
+            rotations = np.concatenate([rotations, -rotations], axis=0)
+
+        # the index of the representative of every k point
+        self.mapping = np.arange(nk)
+        for W in rotations:
+            rotated = (self.kpoints @ W)*self.mesh - self.shift # (W^T k)*mesh - shift
+            rounded = np.rint(rotated)
+            # the k points that W takes onto the mesh
+            on_mesh = np.all(np.abs(rotated - rounded) < 1e-6, axis=1)
+            rotated_grid = np.mod(rounded[on_mesh].astype(int), self.mesh)
+            rotated_index = np.ravel_multi_index(rotated_grid.T, tuple(self.mesh))
+            self.mapping[on_mesh] = np.minimum(self.mapping[on_mesh], rotated_index)
+        # every representative must be its own representative
+        while np.any(self.mapping[self.mapping] != self.mapping):
+            self.mapping = self.mapping[self.mapping]
+
+        # ir_index: the indices of the irreducible k points in the mesh, inverse: the irreducible k point of every k point
+        self.ir_index, self.inverse, counts = np.unique(self.mapping, return_inverse=True, return_counts=True)
+        self.inverse = self.inverse.reshape(-1)
+        self.weights = counts/nk
+
+    def __len__(self):
+        return len(self.ir_index)
+
+    @property
+    def ir_kpoints(self) -> np.ndarray:
+        """
+        The fractional coordinates of the irreducible k points, shape: (nir, 3)
+        """
+        return self.kpoints[self.ir_index]
+
+    def unfold(self, values: np.ndarray) -> np.ndarray:
+        """
+        Unfold values (e.g. eigenvalues) at the irreducible k points to the full mesh.
+        @param values: shape: (nir, ...)
+        @return: shape: (nk, ...)
+        """
+        return np.asarray(values)[self.inverse]
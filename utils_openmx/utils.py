@@ -798,3 +798,64 @@ def read_openmx_dat(filename: str = None):
     
     return atomic_numbers, latt, coordinates
     
+
+def read_openmx_bin(filename: str = 'HS.bin'):
+    """
+    Load the HS.bin file written by `read_openmx file.scfout -b`. The file is memory-mapped and every
+    block is returned as a view into it, in the same nested layout as the HS.json file:
+    Hon[spin][iatm], Hoff[spin][iedge], iHon/iHoff (SOC only), Son[iatm], Soff[iedge], Lon[iatm] and Loff[iedge]
+    are flattened (TNO1*TNO2,) or (TNO1*TNO2, 3) arrays.
+
+    Args:
+        filename (str): path of HS.bin.
+
+    Returns:
+        dict: the same keys as HS.json.
+    """
+    buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+    if bytes(buffer[:8]) != b'HSBIN001':
+        raise ValueError(f'{filename} is not a binary file written by read_openmx!')
+    offset = 8
+
+    def take(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    natoms, num_edges, spinP_switch = take(np.int32, 3)
+    norbs = take(np.int32, natoms).astype(int)
+    edge_index = take(np.int32, 2*num_edges).reshape(2, num_edges)
+    pos = take(np.float64, 3*natoms).reshape(natoms, 3)
+    cell_shift = take(np.int32, 3*num_edges).reshape(num_edges, 3)
+    inv_edge_idx = take(np.int32, num_edges)
+    nbr_shift = take(np.float64, 3*num_edges).reshape(num_edges, 3)
+
+    # sizes of the on-site and off-site blocks
+    size_on = norbs**2
+    size_off = norbs[edge_index[0]]*norbs[edge_index[1]]
+    split_on = np.cumsum(size_on)[:-1]
+    split_off = np.cumsum(size_off)[:-1]
+
+    def take_blocks(num_channels, on_site, dim=1):
+        blocks = []
+        for _ in range(num_channels):
+            sizes, splits = (size_on, split_on) if on_site else (size_off, split_off)
+            array = take(np.float64, int(sizes.sum())*dim)
+            if dim > 1:
+                array = array.reshape(-1, dim)
+            blocks.append(np.split(array, splits) if len(sizes) > 0 else [])
+        return blocks
+
+    load_dict = {'edge_index': edge_index, 'pos': pos, 'cell_shift': cell_shift,
+                 'inv_edge_idx': inv_edge_idx, 'nbr_shift': nbr_shift}
+    load_dict['Hon'] = take_blocks(spinP_switch+1, True)
+    load_dict['Hoff'] = take_blocks(spinP_switch+1, False)
+    if spinP_switch == 3:
+        load_dict['iHon'] = take_blocks(3, True)
+        load_dict['iHoff'] = take_blocks(3, False)
+    load_dict['Son'] = take_blocks(1, True)[0]
+    load_dict['Soff'] = take_blocks(1, False)[0]
+    load_dict['Lon'] = take_blocks(1, True, dim=3)[0]
+    load_dict['Loff'] = take_blocks(1, False, dim=3)[0]
+    return load_dict
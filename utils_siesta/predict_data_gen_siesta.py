@@ -17,6 +17,7 @@ import multiprocessing
 from pymatgen.core.periodic_table import Element
 from read_siesta import FDF, HSX
 from utils import *
+from utils_openmx.block_scatter import BlockScatter
 
 ################################ Input parameters begin ####################
 nao_max = 13
@@ -35,6 +36,8 @@ elif nao_max == 19:
     basis_def = basis_def_19_siesta
 else:
     raise NotImplementedError
+# the SIESTA basis definitions are not sorted, so the blocks are placed in the order of basis_def
+block_scatter = BlockScatter(basis_def, nao_max, mask_order=False)
 
 graphs = dict()
 if not os.path.exists(graph_data_path):
@@ -82,33 +85,9 @@ def generate_graph_data(idx:int, scf_path:str):
             print('Wrong info: len(inv_edge_idx) != len(edge_index[0]) !')
             sys.exit()
 
-        #
-        num_sub_matrix = pos.shape[0] + edge_index.shape[1]
-        H = np.zeros((num_sub_matrix, nao_max**2))
-        S = np.zeros((num_sub_matrix, nao_max**2))
-        
-        for i, (sub_maxtrix_H, sub_maxtrix_S) in enumerate(zip(Hon, Son)):
-            tH = np.zeros((nao_max, nao_max))
-            tS = np.zeros((nao_max, nao_max))
-            src = z[i]
-            nao = len(basis_def[src])
-            tH[basis_def[src][:,None], basis_def[src][None,:]] = sub_maxtrix_H.reshape(nao, nao)
-            tS[basis_def[src][:,None], basis_def[src][None,:]] = sub_maxtrix_S.reshape(nao, nao)
-            H[i] = tH.flatten()
-            S[i] = tS.flatten()
-        
-        num = 0
-        for i, (sub_maxtrix_H, sub_maxtrix_S) in enumerate(zip(Hoff, Soff)):
-            tH = np.zeros((nao_max, nao_max))
-            tS = np.zeros((nao_max, nao_max))
-            src, tar = z[edge_index[0,num]], z[edge_index[1,num]]
-            nao_i = len(basis_def[src])
-            nao_j = len(basis_def[tar])
-            tH[basis_def[src][:,None], basis_def[tar][None,:]] = sub_maxtrix_H.reshape(nao_i, nao_j)
-            tS[basis_def[src][:,None], basis_def[tar][None,:]] = sub_maxtrix_S.reshape(nao_i, nao_j)
-            H[num + len(z)] = tH.flatten()
-            S[num + len(z)] = tS.flatten()
-            num = num + 1
+        # place all blocks of the same species pair at once
+        H = block_scatter.scatter_graph(Hon, Hoff, z, edge_index)
+        S = block_scatter.scatter_graph(Son, Soff, z, edge_index)
     except:
         print('Error: H and S. Continue...')
         return False, None
@@ -6,7 +6,6 @@ Last Modified time: 2023-05-18 17:07:53
 '''
 
 import numpy as np
-from numba import njit
 from copy import deepcopy
 import json
 import re
@@ -14,7 +13,7 @@ import sys
 import os
 from time import time
 import multiprocessing
-from scipy.sparse import csr_matrix as csr
+from utils_openmx.inverse_edge import find_inverse_edge_index
 # import matplotlib.pyplot as plt
 
 # the hamilt matrix almost stored as follows, with some modification.
@@ -110,48 +109,35 @@ class FDF:
     self.invcell = np.linalg.inv(latt)
 
 
-def mp_parse_sparse_matrix(fdf:FDF, hamilt:csr, Sover:csr, xijs:list[csr], no:np.ndarray, indo:np.ndarray,
-                           no_u, no_s, na_u, ia, ispin=0):
-  edge_idx_src = []
-  edge_idx_dst = []
-  Hon = []
-  Hoff= []
-  Son = []
-  Soff= []
-  cell_shift = []
-  nbr_shift = []
-  for jsuper in range(0, no_s, no_u):
-    hamil:csr = hamilt[:,jsuper:jsuper+no_u]
-    if ispin == 0:
-      Sove:csr = Sover[:,jsuper:jsuper+no_u]
-    for ja in range(na_u):
-      ham:csr = hamil[:,indo[ja]:indo[ja]+no[ja]]
-      if ham.getnnz() == 0:
-        continue
-      if ispin == 0:
-        sr:csr = Sove[:,indo[ja]:indo[ja]+no[ja]] 
-      indptr = np.array(ham.indptr, dtype=int)
-      io = len(indptr[indptr==0])-1
-      jo = ham.indices[0]+indo[ja]
-      jos = jo + jsuper
-      xij = np.array([xijs[0][io,jos], xijs[1][io,jos], xijs[2][io,jos]])
-      cs = getCellShift(fdf.pos[ia]-fdf.pos[ja]+xij, fdf.invcell) # cell_shift
-
-      if ia == ja and np.all(cs == 0):
-        # onsite
-        Hon.append(ham.toarray().flatten())
-        if ispin == 0:
-          Son.append(sr.toarray().flatten())
-      else:
-        # offsite
-        Hoff.append(ham.toarray().flatten())
-        if ispin == 0:
-          Soff.append(sr.toarray().flatten())
-        edge_idx_src.append(ia)
-        edge_idx_dst.append(ja)
-        cell_shift.append(cs)
-        nbr_shift.append(cs @ fdf.cell)
-  return edge_idx_src, edge_idx_dst, Hon, Hoff, Son, Soff, cell_shift, nbr_shift
+def scatter_sparse_blocks(values:np.ndarray, block_id:np.ndarray, block_pos:np.ndarray, sizes:np.ndarray):
+  '''
+  Scatter the nonzeros of one matrix (one spin channel or the overlap) into dense flattened blocks.
+  @param values: the nonzeros, shape: (nh,)
+  @param block_id, block_pos: the block of every nonzero and its position in the flattened block, shape: (nh,)
+  @param sizes: the sizes of the blocks, shape: (nblocks,)
+  @return: list of the flattened blocks
+  '''
+  offsets = np.cumsum(sizes) - sizes
+  buffer = np.zeros(sizes.sum(), dtype=values.dtype)
+  buffer[offsets[block_id] + block_pos] = values
+  return np.split(buffer, offsets[1:]) if len(sizes) > 0 else []
+
+def find_edges(edge_index:np.ndarray, cell_shift:np.ndarray, ia:np.ndarray, ja:np.ndarray, cs:np.ndarray):
+  '''
+  @return: the index of the edge (ia, ja, cs) in the graph for every block, -1 if it is not an edge of the graph.
+  '''
+  edge_index = edge_index.reshape(2, -1)
+  if edge_index.shape[1] == 0 or len(ia) == 0:
+    return np.full(len(ia), -1, dtype=int)
+  natoms = max(edge_index.max(), ia.max(), ja.max()) + 1
+  _, shift_id = np.unique(np.concatenate([cell_shift.reshape(-1, 3), cs], axis=0), axis=0, return_inverse=True)
+  shift_id = shift_id.reshape(-1)
+  num_shifts = shift_id.max() + 1
+  edge_keys = (edge_index[0]*natoms + edge_index[1])*num_shifts + shift_id[:edge_index.shape[1]]
+  block_keys = (ia*natoms + ja)*num_shifts + shift_id[edge_index.shape[1]:]
+  order = np.argsort(edge_keys)
+  position = np.minimum(np.searchsorted(edge_keys[order], block_keys), len(order) - 1)
+  return np.where(edge_keys[order][position] == block_keys, order[position], -1)
 
 class HSX:
   
@@ -199,45 +185,50 @@ class HSX:
     s.zval     = np.fromfile(s.fp, dtype=np.float32, count=s.nspecies)
     s.fp.close()
 
+  def getOrbitals(s):
+    '''
+    @return: no: number of orbitals of every atom, indo: index of the first orbital of every atom, shape: (natoms)
+    '''
+    no = np.bincount(s.iaorb - 1, minlength=s.na_u).astype(int) # shape: (natoms)
+    indo = np.zeros_like(no, dtype=int) # shape: (natoms)
+    indo[1:] = np.cumsum(no[:-1])
+    return no, indo
+
+  def getBlocks(s, fdf:FDF):
+    '''
+    Group all nonzeros by (supercell column block, ia, ja) with one sort.
+    The blocks are in the order of the supercell column blocks, then ia, then ja.
+    @return: dict with ia, ja, cell_shift and onsite of every block, and block_id, block_pos of every nonzero
+    and sizes of the blocks (see scatter_sparse_blocks).
+    '''
+    no, indo = s.getOrbitals()
+    orb_atom = np.repeat(np.arange(s.na_u), no)
+    listhptr = np.append(s.listhptr, s.nh) # listhptr start from 0 in fortran!
+    row = np.repeat(np.arange(s.no_u), np.diff(listhptr))
+    cols = s.listh - 1
+    jsuper, col = cols // s.no_u, cols % s.no_u
+    ia, ja = orb_atom[row], orb_atom[col]
+
+    keys, first, block_id = np.unique((jsuper*s.na_u + ia)*s.na_u + ja, return_index=True, return_inverse=True)
+    block_id = block_id.reshape(-1)
+    block_ia, block_ja = keys // s.na_u % s.na_u, keys % s.na_u
+    # the cell shift of a block from the first nonzero
+    xij = s.xij[first]
+    cs = getCellShift(fdf.pos[block_ia] - fdf.pos[block_ja] + xij, fdf.invcell)
+    return {'ia': block_ia, 'ja': block_ja, 'cell_shift': cs,
+            'onsite': (block_ia == block_ja) & np.all(cs == 0, axis=1),
+            'block_id': block_id,
+            'block_pos': (row - indo[ia])*no[ja] + col - indo[ja],
+            'sizes': no[block_ia]*no[block_ja]}
+
   def getGraph2(s, fdf:FDF, graph:dict={}, skip=False, tojson=False):
-    #######################################################
-    @njit
-    def constructInvEdges(noff, edge_idx_src, edge_idx_dst, cell_shift):
-      ierr = False
-      inv_edge_idx = -1 * np.ones(noff, dtype=np.int32)
-      for idx in range(0, noff):
-        if inv_edge_idx[idx] != -1:
-          continue
-        for jdx in range(0, noff):
-          if (edge_idx_dst[jdx] == edge_idx_src[idx] and
-              edge_idx_src[jdx] == edge_idx_dst[idx] and
-              np.all(cell_shift[jdx] == -cell_shift[idx])):
-            inv_edge_idx[idx] = jdx
-            inv_edge_idx[jdx] = idx
-            break
-        else:
-          ierr = True
-      return ierr, inv_edge_idx
-    #######################################################
-    @njit
-    def fillHoff(noff, cx, cy, cz, ia, ja,
-                 edge_idx_src, edge_idx_dst, cell_shift):
-      '''ierr, ioff'''
-      for ioff, src, dst, cs in zip(np.arange(noff), edge_idx_src, edge_idx_dst, cell_shift):
-        if (src == ia and dst == ja and cx == cs[0] and cy == cs[1] and cz == cs[2]):
-          return False, ioff
-      return True, 0
-    #######################################################
     assert (not graph and not skip) or (graph and skip)
-    edge_idx_src = []
-    edge_idx_dst = []
-    cell_shift   = []
-    nbr_shift    = []
     Hon = [[]] if s.nspin == 1 else [[],[]] if s.nspin == 2 else [[],[],[],[]]
     Hoff= [[]] if s.nspin == 1 else [[],[]] if s.nspin == 2 else [[],[],[],[]]
-    Son = []
-    Soff= []
 
+    blocks = s.getBlocks(fdf)
+    onsite = np.flatnonzero(blocks['onsite'])
+    offsite = np.flatnonzero(~blocks['onsite'])
     if skip:
       graph_ = deepcopy(graph)
       s.noff = len(graph_['inv_edge_idx'])
@@ -245,90 +236,33 @@ class HSX:
       for ispin in range(s.nspin):
         for ioff in range(s.noff):
           Hoff[ispin][ioff] = np.zeros_like(Hoff[ispin][ioff], dtype=np.float32)
-
-    no = []
-    tmp = [0,0]
-    for io in range(s.no_u):
-      ia = s.iaorb[io]-1
-      if tmp[0] == 0:
-        tmp = [1,ia]
-      elif tmp[1] == ia:
-        tmp[0] += 1
-      else:
-        no.append(tmp[0])
-        tmp = [1,ia]
-    no.append(tmp[0])
-    no = np.array(no, dtype=int) # shape: (natoms)
-    indo = np.zeros_like(no, dtype=int) # shape: (natoms)
-    indo[1:] = np.cumsum(no[:-1])
-
-    s.listh -= 1
-    s.listhptr = np.append(s.listhptr, s.nh) # listhptr start from 0 in fortran!
-    hamilts = [] # shape (nspin, no_u, no_s)
-    xijs = [] # shape(3, no_u, no_s)
-    for ispin in range(0, s.nspin):
-      hamilts.append(csr((s.hamilt[ispin], s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)))
-    Sovers = csr((s.Sover, s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)) # shape (no_u, no_s)
-    for tmp in range(0, 3):
-      xijs.append(csr((s.xij[:,tmp], s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)))
+      # the edges of the graph matching the offsite blocks
+      ioff = find_edges(np.array(graph['edge_index']), np.array(graph['cell_shift']),
+                        blocks['ia'][offsite], blocks['ja'][offsite], blocks['cell_shift'][offsite])
 
     for ispin in range(0, s.nspin):
-      for jsuper in range(0, s.no_s, s.no_u):
-        hamilt:csr = hamilts[ispin][:,jsuper:jsuper+s.no_u]
-        if ispin == 0 and not skip:
-          Sover:csr = Sovers[:,jsuper:jsuper+s.no_u]
-        for ia in range(s.na_u):
-          hamil:csr = hamilt[indo[ia]:indo[ia]+no[ia],:]
-          if ispin == 0 and not skip:
-            Sove:csr = Sover[indo[ia]:indo[ia]+no[ia],:]
-          for ja in range(s.na_u):
-            ham:csr = hamil[:,indo[ja]:indo[ja]+no[ja]]
-            if ham.getnnz() == 0:
-              continue
-            if ispin == 0 and not skip:
-              sr:csr = Sove[:,indo[ja]:indo[ja]+no[ja]] 
-            indptr = np.array(ham.indptr, dtype=int)
-            io = len(indptr[indptr==0])-1+indo[ia]
-            jo = ham.indices[0]+indo[ja]
-            jos = jo + jsuper
-            xij = np.array([xijs[0][io,jos], xijs[1][io,jos], xijs[2][io,jos]])
-            cs = getCellShift(fdf.pos[ia]-fdf.pos[ja]+xij, fdf.invcell) # cell_shift
-
-            # plt.scatter(np.ones_like(ham.toarray().flatten())*np.linalg.norm(xij), ham.toarray().flatten(), s=0.2, marker='.')
-            if ia == ja and np.all(cs == 0):
-              # onsite
-              Hon[ispin].append(ham.toarray().flatten())
-              if ispin == 0 and not skip:
-                Son.append(sr.toarray().flatten())
-            else:
-              # offsite
-              if not skip:
-                Hoff[ispin].append(ham.toarray().flatten())
-                if ispin == 0:
-                  Soff.append(sr.toarray().flatten())
-                  edge_idx_src.append(ia)
-                  edge_idx_dst.append(ja)
-                  cell_shift.append(cs)
-                  nbr_shift.append(cs @ fdf.cell)
-              else:
-                ierr, ioff = fillHoff(s.noff, cs[0], cs[1], cs[2], ia, ja,
-                                      np.array(graph['edge_index'][0]), 
-                                      np.array(graph['edge_index'][1]), 
-                                      np.array(graph['cell_shift']))
-                Hoff[ispin][ioff] = ham.toarray().flatten()
+      ham = scatter_sparse_blocks(s.hamilt[ispin], blocks['block_id'], blocks['block_pos'], blocks['sizes'])
+      Hon[ispin] = [ham[iblock] for iblock in onsite]
+      if not skip:
+        Hoff[ispin] = [ham[iblock] for iblock in offsite]
+      else:
+        for iblock, jedge in zip(offsite[ioff >= 0], ioff[ioff >= 0]):
+          Hoff[ispin][jedge] = ham[iblock]
+    if not skip:
+      sr = scatter_sparse_blocks(s.Sover, blocks['block_id'], blocks['block_pos'], blocks['sizes'])
+      Son = [sr[iblock] for iblock in onsite]
+      Soff = [sr[iblock] for iblock in offsite]
+      edge_idx_src = blocks['ia'][offsite].tolist()
+      edge_idx_dst = blocks['ja'][offsite].tolist()
+      cell_shift = list(blocks['cell_shift'][offsite])
+      nbr_shift = list(blocks['cell_shift'][offsite] @ fdf.cell)
     #######################################################
     if not skip:
       # construct the edges
       edge_index = [edge_idx_src, edge_idx_dst]
       s.noff = len(edge_idx_src)
       # inv_edge_idx
-      ierr, inv_edge_idx = constructInvEdges(s.noff, 
-                                             np.array(edge_idx_src),
-                                             np.array(edge_idx_dst),
-                                             np.array(cell_shift))
-      if ierr:
-        print('inv_edge_idx error')
-        exit()
+      inv_edge_idx = find_inverse_edge_index(np.array(edge_index), np.array(cell_shift))
       # construct the graph
       graph_ = {}
       graph_['edge_index'] = convInt(edge_index) if tojson else np.array(edge_index)
@@ -343,108 +277,43 @@ class HSX:
     return graph_
   
   def getGraph3(s, fdf:FDF, graph:dict={}, ntask=1, tojson=False):
+    '''
+    The edges are in the block order of getBlocks (supercell column block, then ia, then ja), which differs from
+    the order of getGraph2, and the edge lists are built once for all spin channels.
+    '''
     #######################################################
-    def constructInvEdges(noff, edge_idx_src, edge_idx_dst, cell_shift):
-      ierr = False
-      assert np.mod(noff, 2) == 0
-      cast = np.hstack((np.arange(noff).reshape(-1,1), cell_shift, edge_idx_src.reshape(-1,1), edge_idx_dst.reshape(-1,1)))
-
-      uporder0 = sorted(cast[cast[:,4] == cast[:,5]], key=lambda x: (x[1], x[2], x[3], x[4]))
-
-      uporder1 = sorted(cast[cast[:,4] == cast[:,5]], key=lambda x: (x[1], x[2], x[3], -x[4]))
-      
-      uporder2 = sorted(cast[cast[:,4] < cast[:,5]],  key=lambda x: (x[1], x[2], x[3], x[4], x[5]))
-
-      uporder3 = sorted(cast[cast[:,4] > cast[:,5]],  key=lambda x: (x[1], x[2], x[3], -x[5], -x[4]))
-      
-      if len(uporder0) != 0:
-        leneq = len(uporder0) // 2
-        upordereq = np.array(uporder0[:leneq] + uporder1[leneq:], dtype=np.int32)[:,0]
-      else:
-        upordereq = []
-      uporderne = np.array(uporder2 + uporder3, dtype=np.int32)[:,0]
-      downordereq = upordereq[::-1]
-      downorderne = uporderne[::-1]
-      cast0 = np.array([upordereq, downordereq])
-      cast1 = np.array([uporderne, downorderne])
-      cast = np.hstack((cast0, cast1)).T
-      inv_edge_idx = sorted(cast, key=lambda x: x[0])
-      inv_edge_idx = np.array(inv_edge_idx, dtype=np.int32)[:,1]
-      return ierr, inv_edge_idx
-    #######################################################
-    edge_idx_src = []
-    edge_idx_dst = []
-    cell_shift   = []
-    nbr_shift    = []
     Hon = [[]] if s.nspin == 1 else [[],[]] if s.nspin == 2 else [[],[],[],[]]
     Hoff= [[]] if s.nspin == 1 else [[],[]] if s.nspin == 2 else [[],[],[],[]]
-    Son = []
-    Soff= []
-
-    # multiprocessing
-    mp_results = []
-    mp_nproc = min(multiprocessing.cpu_count(), ntask)
-    mp_pool = multiprocessing.Pool(processes=mp_nproc)
 
     #################################################
     time1 = time()###################################
     #################################################
 
-    no = []
-    tmp = [0,0]
-    for io in range(s.no_u):
-      ia = s.iaorb[io]-1
-      if tmp[0] == 0:
-        tmp = [1,ia]
-      elif tmp[1] == ia:
-        tmp[0] += 1
-      else:
-        no.append(tmp[0])
-        tmp = [1,ia]
-    no.append(tmp[0])
-    no = np.array(no, dtype=int) # shape: (natoms)
-    indo = np.zeros_like(no, dtype=int) # shape: (natoms)
-    indo[1:] = np.cumsum(no[:-1])
-
-    s.listh -= 1
-    s.listhptr = np.append(s.listhptr, s.nh) # listhptr start from 0 in fortran!
-    hamilts = [] # shape (nspin, no_u, no_s)
-    xijs = [] # shape(3, no_u, no_s)
-    for ispin in range(0, s.nspin):
-      hamilts.append(csr((s.hamilt[ispin], s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)))
-    Sovers = csr((s.Sover, s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)) # shape (no_u, no_s)
-    for tmp in range(0, 3):
-      xijs.append(csr((s.xij[:,tmp], s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)))
-    delattr(s, 'hamilt')
-    delattr(s, 'Sover')
-    delattr(s, 'xij')
+    blocks = s.getBlocks(fdf)
+    onsite = np.flatnonzero(blocks['onsite'])
+    offsite = np.flatnonzero(~blocks['onsite'])
 
     #################################################
     print('PART1 %f' % (time() - time1), flush=True)#
     time1 = time()###################################
 
+    # multiprocessing over the spin channels and the overlap
+    mp_nproc = min(multiprocessing.cpu_count(), ntask, s.nspin + 1)
+    mp_pool = multiprocessing.Pool(processes=mp_nproc)
+    matrices = [s.hamilt[ispin] for ispin in range(s.nspin)] + [s.Sover]
+    mp_results = [mp_pool.apply_async(scatter_sparse_blocks, (matrix, blocks['block_id'], blocks['block_pos'], blocks['sizes']))
+                  for matrix in matrices]
     for ispin in range(0, s.nspin):
-      for ia in range(s.na_u):
-        hamilt:csr = hamilts[ispin][indo[ia]:indo[ia]+no[ia],:]
-        if ispin == 0:
-          Sover:csr = Sovers[indo[ia]:indo[ia]+no[ia],:]
-        xij1 = xijs[0][indo[ia]:indo[ia]+no[ia],:]
-        xij2 = xijs[1][indo[ia]:indo[ia]+no[ia],:]
-        xij3 = xijs[2][indo[ia]:indo[ia]+no[ia],:]
-        tmp = mp_pool.apply_async(mp_parse_sparse_matrix, (fdf, hamilt, Sover, [xij1, xij2, xij3],
-                                                           no, indo, s.no_u, s.no_s, s.na_u, ia, ispin))
-        mp_results.append(tmp)
-      for mp_res in mp_results:
-        tmp = mp_res.get()
-        edge_idx_src.extend(tmp[0])
-        edge_idx_dst.extend(tmp[1])
-        Hon[ispin].extend(tmp[2])
-        Hoff[ispin].extend(tmp[3])
-        Son.extend(tmp[4])
-        Soff.extend(tmp[5])
-        cell_shift.extend(tmp[6])
-        nbr_shift.extend(tmp[7])
-      mp_results = []
+      ham = mp_results[ispin].get()
+      Hon[ispin] = [ham[iblock] for iblock in onsite]
+      Hoff[ispin] = [ham[iblock] for iblock in offsite]
+    sr = mp_results[-1].get()
+    Son = [sr[iblock] for iblock in onsite]
+    Soff = [sr[iblock] for iblock in offsite]
+    edge_idx_src = blocks['ia'][offsite].tolist()
+    edge_idx_dst = blocks['ja'][offsite].tolist()
+    cell_shift = list(blocks['cell_shift'][offsite])
+    nbr_shift = list(blocks['cell_shift'][offsite] @ fdf.cell)
     #################################################
     print('PART2 %f' % (time() - time1), flush=True)#
     time1 = time()###################################
@@ -453,13 +322,7 @@ class HSX:
     edge_index = [edge_idx_src, edge_idx_dst]
     s.noff = len(edge_idx_src)
     # inv_edge_idx
-    ierr, inv_edge_idx = constructInvEdges(s.noff, 
-                                            np.array(edge_idx_src),
-                                            np.array(edge_idx_dst),
-                                            np.array(cell_shift))
-    if ierr:
-      print('inv_edge_idx error')
-      exit()
+    inv_edge_idx = find_inverse_edge_index(np.array(edge_index), np.array(cell_shift))
     #####################################
     print('PART3 %f' % (time() - time1), flush=True)#
     #####################################
@@ -481,38 +344,19 @@ class HSX:
 
   def getHK(s, fdf:FDF, k=np.array([0,0,0]), isSOC=False):
     assert(np.all(k == 0))
-    dtype = np.float32 if not isSOC else np.complex64
     HK = np.zeros([s.nspin, s.no_u, s.no_u], dtype=np.float32)
-
-    s.listh -= 1
-    s.listhptr = np.append(s.listhptr, s.nh) # listhptr start from 0 in fortran!
-    hamilts = [] # shape (nspin, no_u, no_s)
-    # xijs = [] # shape(3, no_u, no_s)
+    row = np.repeat(np.arange(s.no_u), np.diff(np.append(s.listhptr, s.nh))) # listhptr start from 0 in fortran!
+    col = (s.listh - 1) % s.no_u
     for ispin in range(0, s.nspin):
-      hamilts.append(csr((s.hamilt[ispin], s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)))
-    # for tmp in range(0, 3):
-    #   xijs.append(csr((s.xij[:,tmp], s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)))
-
-    for ispin in range(0, s.nspin):
-      for jsuper in range(0, s.no_s, s.no_u):
-        hamilt:csr = hamilts[ispin][:,jsuper:jsuper+s.no_u]
-        HK[ispin] += hamilt
+      np.add.at(HK[ispin], (row, col), s.hamilt[ispin])
     return HK
   
   def getSK(s, fdf:FDF, k=np.array([0,0,0]), isSOC=False):
     assert(np.all(k == 0))
     SK = np.zeros([s.no_u, s.no_u], dtype=np.float32)
-
-    s.listh -= 1
-    s.listhptr = np.append(s.listhptr, s.nh) # listhptr start from 0 in fortran!
-    # xijs = [] # shape(3, no_u, no_s)
-    Sovers = csr((s.Sover, s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s))
-    # for tmp in range(0, 3):
-    #   xijs.append(csr((s.xij[:,tmp], s.listh, s.listhptr), dtype=np.float32, shape=(s.no_u,s.no_s)))
-
-    for jsuper in range(0, s.no_s, s.no_u):
-      Sover:csr = Sovers[:,jsuper:jsuper+s.no_u]
-      SK += Sover
+    row = np.repeat(np.arange(s.no_u), np.diff(np.append(s.listhptr, s.nh))) # listhptr start from 0 in fortran!
+    col = (s.listh - 1) % s.no_u
+    np.add.at(SK, (row, col), s.Sover)
     return SK
 
 